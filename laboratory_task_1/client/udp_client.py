@@ -1,119 +1,319 @@
+import argparse
+import csv
+import os
 import socket
-import sys
-import io
-import numpy as np
-from typing import Tuple
+import threading
 import time
+import numpy as np
+from typing import Optional, Tuple
 import matplotlib.pyplot as plt
-import random as rand
-from math import log2
-
-MAX_DATAGRAM_SIZE = 2 ** 1024
-POSSIBLE_SYMBOLS = ['R','E','G','G', 'I', 'N']
-
-def send_data(host: str, port: int, datagram_size: int) -> Tuple[bool, float]:
-	with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-		s.connect((host, port))
-		binary_stream = io.BytesIO()
-		for _ in range(datagram_size):
-			letter_to_be_written = POSSIBLE_SYMBOLS[rand.randint(0, len(POSSIBLE_SYMBOLS)-1)]
-			binary_stream.write(letter_to_be_written.encode('ascii'))
-		binary_stream.seek(0)
-		stream_data = binary_stream.read()
-		print("Sending buffer size= ", datagram_size)
 
+MAX_DATAGRAM_SIZE = 65507
+POSSIBLE_SYMBOLS = b"REGGIN"
+MAX_MEASURED_SIZES = 2 * MAX_DATAGRAM_SIZE.bit_length()
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8888
+WARMUP_ROUNDS = 3
+REPETITIONS = 20
+UNSUPPORTED_AFTER_LOSSES = 5
+RESPONSE_TIMEOUT_S = 1.0
+STREAM_DURATION_S = 2.0
+STREAM_GRACE_S = 0.2
+SEND_BATCH = 64
+OUTPUT_DIR = "/images_saved"
+
+def open_socket(host: str, port: int, timeout: float, sndbuf: int = 0, rcvbuf: int = 0) -> socket.socket:
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	# buffers are set before connect; the kernel may round or cap them (see net.core.wmem_max / rmem_max)
+	if sndbuf:
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+	if rcvbuf:
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+	sock.connect((host, port))
+	sock.settimeout(timeout)
+	return sock
+
+def generate_payload(size: int) -> bytes:
+	# one vectorised draw instead of a letter at a time - every probe sends a prefix of this buffer
+	symbols = np.frombuffer(POSSIBLE_SYMBOLS, dtype=np.uint8)
+	return symbols[np.random.randint(0, len(symbols), size)].tobytes()
+
+class MeasurementEngine:
+	def __init__(self, host: str, port: int, repetitions: int, warmup: int, timeout: float, sndbuf: int = 0,
+				 rcvbuf: int = 0):
+		self.repetitions = repetitions
+		self.warmup = warmup
+		self.timeout = timeout
+		self.sock = open_socket(host, port, timeout, sndbuf, rcvbuf)
+		self.payload = memoryview(generate_payload(MAX_DATAGRAM_SIZE))
+		self.response = bytearray(16)
+		self.sizes = np.zeros(MAX_MEASURED_SIZES, dtype=np.int64)
+		self.times = np.full((MAX_MEASURED_SIZES, repetitions), np.nan)
+		self.lost = np.zeros(MAX_MEASURED_SIZES, dtype=np.int64)
+		self.warmup_lost = np.zeros(MAX_MEASURED_SIZES, dtype=np.int64)
+		self.count = 0
+
+	def close(self):
+		self.sock.close()
+
+	def drain(self):
+		# a reply that arrived after its timeout would otherwise be taken as the answer to the next probe
+		self.sock.setblocking(False)
+		try:
+			while True:
+				self.sock.recv_into(self.response)
+		except OSError:
+			pass
+		finally:
+			self.sock.settimeout(self.timeout)
+
+	def probe(self, size: int) -> Optional[float]:
+		"""Round trip of one datagram in seconds, None if it was rejected or lost"""
+		datagram = self.payload[:size]
 		start_time = time.perf_counter()
-		data = 0
 		try:
-			s.sendall(stream_data)
-			data = s.recv(5)
-		except Exception as e:
+			self.sock.send(datagram)
+			nbytes = self.sock.recv_into(self.response)
+		except socket.timeout:
+			self.drain()
+			return None
+		except OSError as e:
 			print(e)
-			time.sleep(0.05)
-			return (False, -1)
-		end_time = time.perf_counter()
-		elapsed_time = end_time - start_time
-	
-		data_str = data.decode('ascii')
-  
-		if data_str == "OK":
-			print('Received', data_str)
-			s.close()
-			return (True, elapsed_time)
-		elif data_str == "ERROR":
-			print('Received', data_str)
-			s.close()
-			return (False, elapsed_time)
-		else:
-			raise Exception("Unknown server reponse")
+			return None
+		elapsed_time = time.perf_counter() - start_time
+
+		reply = self.response[:nbytes]
+		if reply == b"OK":
+			return elapsed_time
+		if reply == b"ERROR":
+			return None
+		raise Exception("Unknown server reponse")
+
+	def measure(self, size: int) -> bool:
+		"""Warm-up followed by the timed repetitions; the size counts as accepted if any probe, warm-up included, got through.
+
+		A lost probe alone says nothing on a lossy path, so measuring stops early only when the first
+		UNSUPPORTED_AFTER_LOSSES probes are all lost.
+		"""
+		print(f"Measuring datagram size: {size} bytes")
+		row = self.times[self.count]
+		answered = 0
+		warmup_lost = 0
+		lost = 0
+		for index in range(self.warmup + self.repetitions):
+			elapsed_time = self.probe(size)
+			if elapsed_time is not None:
+				answered += 1
+				if index >= self.warmup:
+					row[index - self.warmup] = elapsed_time
+				continue
+			if index < self.warmup:
+				warmup_lost += 1
+			else:
+				lost += 1
+			if answered == 0 and warmup_lost + lost >= UNSUPPORTED_AFTER_LOSSES:
+				return False
+
+		if answered == 0:
+			return False
+		if lost == self.repetitions:
+			print(f"Only warm-up probes of {size} bytes were answered, no times recorded")
+			return True
+
+		self.sizes[self.count] = size
+		self.lost[self.count] = lost
+		self.warmup_lost[self.count] = warmup_lost
+		self.count += 1
+		return True
+
+	def stream(self, size: int, duration: float) -> Tuple[int, int, float]:
+		"""Sends size-byte datagrams for duration seconds while another thread counts the replies on the same socket.
+
+		Returns datagrams sent, replies received and seconds from the first send to the last reply.
+		"""
+		datagram = self.payload[:size]
+		sent = [0]
+		sender_done = threading.Event()
 
-def find_max_datagram_size(host: str, port: int, initial_size: int = 2) -> Tuple[int, np.ndarray, np.ndarray]:
+		def sender():
+			count = 0
+			deadline = time.perf_counter() + duration
+			try:
+				while time.perf_counter() < deadline:
+					for _ in range(SEND_BATCH):
+						try:
+							self.sock.send(datagram)
+							count += 1
+						except socket.timeout:
+							pass
+			except OSError as e:
+				print(e)
+			finally:
+				sent[0] = count
+				sender_done.set()
+
+		self.drain()
+		self.sock.settimeout(STREAM_GRACE_S)
+		received = 0
+		start_time = time.perf_counter()
+		last_reply_time = start_time
+		sender_thread = threading.Thread(target=sender)
+		sender_thread.start()
+		try:
+			while True:
+				try:
+					self.sock.recv_into(self.response)
+				except socket.timeout:
+					if sender_done.is_set():
+						break
+					continue
+				except OSError:
+					if sender_done.is_set():
+						break
+					continue
+				received += 1
+				last_reply_time = time.perf_counter()
+		finally:
+			sender_thread.join()
+			self.sock.settimeout(self.timeout)
+		return (sent[0], received, last_reply_time - start_time)
+
+	def results(self):
+		"""Measured sizes in increasing order with their round trip times (rows) and lost timed and warm-up probe counts"""
+		order = np.argsort(self.sizes[:self.count], kind='stable')
+		return self.sizes[order], self.times[order], self.lost[order], self.warmup_lost[order]
+
+def find_max_datagram_size(engine: MeasurementEngine, initial_size: int = 2) -> int:
 	lower_bound = 0
 	test_size = initial_size
-	datagram_sizes: np.ndarray = np.array([])
-	times_measured: np.ndarray = np.array([])
- 
-	while test_size <= MAX_DATAGRAM_SIZE:	
-		print(f"Testing doubling size: {test_size} bytes")	
-		print(f"Interation: {int(log2(test_size))}")
-  
-		is_response_ok, elapsed_time = send_data(host, port, test_size)
-		
-		if is_response_ok:
-			times_measured = np.append(times_measured, elapsed_time)
-			datagram_sizes = np.append(datagram_sizes, test_size)
+
+	while test_size <= MAX_DATAGRAM_SIZE:
+		print(f"Testing doubling size: {test_size} bytes")
+		if engine.measure(test_size):
 			lower_bound = test_size
 			test_size *= 2
 		else:
 			break
 
-	upper_bound = min(lower_bound*2, MAX_DATAGRAM_SIZE)
- 
-	if upper_bound == lower_bound:
-		return (lower_bound, datagram_sizes, times_measured)
+	if lower_bound == 0:
+		return 0
+	upper_bound = min(test_size - 1, MAX_DATAGRAM_SIZE)
 
 	while lower_bound < upper_bound:
-		midpoint = (upper_bound + lower_bound) // 2
-	
-		is_response_ok, elapsed_time = send_data(host, port, midpoint)
-	
-		if is_response_ok:
-			times_measured = np.append(times_measured, elapsed_time)
-			datagram_sizes = np.append(datagram_sizes, test_size)
+		midpoint = (upper_bound + lower_bound + 1) // 2
+		if engine.measure(midpoint):
 			lower_bound = midpoint
 		else:
 			upper_bound = midpoint - 1
 
-	send_data(host, port, lower_bound)
-	return (lower_bound, datagram_sizes, times_measured)
+	return lower_bound
+
+def get_sweep_sizes(max_size: int = MAX_DATAGRAM_SIZE):
+	sizes = []
+	size = 16
+	while size < max_size:
+		sizes.append(size)
+		size *= 2
+	sizes.append(max_size)
+	return sizes
+
+def sweep_throughput(engine: MeasurementEngine, sizes, duration: float):
+	"""Rows of (size, sent, received, loss, datagrams/s, MB/s) for each size, measured with a stream of datagrams"""
+	rows = []
+	for size in sizes:
+		sent, received, elapsed_time = engine.stream(size, duration)
+		loss = 1 - received / sent if sent else 1.0
+		datagrams_per_s = received / elapsed_time if elapsed_time > 0 else 0.0
+		mb_per_s = datagrams_per_s * size / 1e6
+		print(f"size {size:>6} B: sent {sent}, received {received}, loss {loss * 100:.1f}%, "
+			  f"{datagrams_per_s:.0f} datagrams/s, {mb_per_s:.2f} MB/s")
+		rows.append((size, sent, received, loss, datagrams_per_s, mb_per_s))
+	return rows
+
+def write_throughput_csv(path: str, rows, duration: float):
+	with open(path, 'w', newline='') as csv_file:
+		writer = csv.writer(csv_file)
+		writer.writerow(['datagram_size', 'sent', 'received', 'loss', 'datagrams_per_s', 'mb_per_s', 'duration_s'])
+		for size, sent, received, loss, datagrams_per_s, mb_per_s in rows:
+			writer.writerow([size, sent, received, f"{loss:.4f}", f"{datagrams_per_s:.1f}", f"{mb_per_s:.3f}", duration])
+
+def save_throughput_plot(path: str, rows):
+	plt.figure()
+	plt.plot([row[0] for row in rows], [row[5] for row in rows], marker='.')
+	plt.xscale('log', base=2)
+	plt.xlabel("datagram size [B]")
+	plt.ylabel("goodput [MB/s]")
+	plt.savefig(path)
+
+def summarize(times: np.ndarray):
+	return (np.nanmin(times, axis=1), np.nanmedian(times, axis=1), np.nanpercentile(times, 99, axis=1))
+
+def write_csv(path: str, sizes: np.ndarray, minimum: np.ndarray, median: np.ndarray, p99: np.ndarray,
+			  lost: np.ndarray, warmup_lost: np.ndarray, repetitions: int):
+	with open(path, 'w', newline='') as csv_file:
+		writer = csv.writer(csv_file)
+		writer.writerow(['datagram_size', 'min_us', 'median_us', 'p99_us', 'lost', 'repetitions', 'warmup_lost'])
+		for row in zip(sizes, minimum, median, p99, lost, warmup_lost):
+			size, min_time, median_time, p99_time, lost_count, warmup_lost_count = row
+			writer.writerow([int(size), f"{min_time * 1e6:.1f}", f"{median_time * 1e6:.1f}",
+							 f"{p99_time * 1e6:.1f}", int(lost_count), repetitions, int(warmup_lost_count)])
+
+def save_plot(path: str, sizes: np.ndarray, minimum: np.ndarray, median: np.ndarray, p99: np.ndarray):
+	plt.fill_between(sizes, minimum * 1e6, p99 * 1e6, alpha=0.3, label="min - p99")
+	plt.plot(sizes, median * 1e6, marker='.', label="median")
+	plt.xlabel("datagram size [B]")
+	plt.ylabel("round trip time [us]")
+	plt.legend()
+	plt.savefig(path)
 
 def main():
-	if len(sys.argv) < 2: 
-		print("no HOST, using localhost")
-		print("no port, using 8888")
-		host = '127.0.0.1'
-		port=8888
-	elif len(sys.argv) < 3:
-		print("no port, using 8888")
-		host = sys.argv[1]
-		port=8888
-	else:
-		host = sys.argv[1]
-		port = int( sys.argv[2] )
-
-	print("Will send to ", host, ":", port)
-
-	max_datagram_size, datagram_sizes, times_measured = find_max_datagram_size(host, port, 2)
+	parser = argparse.ArgumentParser(description='Measure UDP server round trip time against datagram size')
+	parser.add_argument('host', nargs='?', default=DEFAULT_HOST)
+	parser.add_argument('port', nargs='?', type=int, default=DEFAULT_PORT)
+	parser.add_argument('--repetitions', type=int, default=REPETITIONS, help='Timed probes per datagram size')
+	parser.add_argument('--warmup', type=int, default=WARMUP_ROUNDS, help='Untimed probes sent before the timed ones')
+	parser.add_argument('--timeout', type=float, default=RESPONSE_TIMEOUT_S, help='Seconds to wait for a reply')
+	parser.add_argument('--output-dir', default=OUTPUT_DIR, help='Directory for the plot and the CSV file')
+	parser.add_argument('--sweep', action='store_true',
+						help='Measure throughput instead: stream datagrams of each size and count the replies')
+	parser.add_argument('--sizes', nargs='+', type=int, help='Datagram sizes for --sweep (default powers of two up to the maximum)')
+	parser.add_argument('--duration', type=float, default=STREAM_DURATION_S, help='Seconds of sending per size in --sweep')
+	parser.add_argument('--sndbuf', type=int, default=0, help='SO_SNDBUF in bytes (0 - system default)')
+	parser.add_argument('--rcvbuf', type=int, default=0, help='SO_RCVBUF in bytes (0 - system default)')
+	args = parser.parse_args()
+
+	print("Will send to ", args.host, ":", args.port)
+
+	engine = MeasurementEngine(args.host, args.port, args.repetitions, args.warmup, args.timeout, args.sndbuf,
+							   args.rcvbuf)
+	if args.sweep:
+		try:
+			rows = sweep_throughput(engine, args.sizes or get_sweep_sizes(), args.duration)
+		finally:
+			engine.close()
+		best = max(rows, key=lambda row: row[5])
+		print(f"Best goodput: {best[5]:.2f} MB/s with {best[0]} byte datagrams")
+		write_throughput_csv(os.path.join(args.output_dir, "datagram_size_vs_throughput.csv"), rows, args.duration)
+		save_throughput_plot(os.path.join(args.output_dir, "datagram_size_vs_throughput.png"), rows)
+		print('Client finished.')
+		return
+
+	try:
+		max_datagram_size = find_max_datagram_size(engine, 2)
+	finally:
+		engine.close()
 	print(f"Max datagram size is: {max_datagram_size}")
 
-	if (len(datagram_sizes) != len(times_measured)):
-		raise Exception(f"Datagram sizes is of size: {len(datagram_sizes)} but times measured is of size {len(times_measured)}")
-	plt.plot(datagram_sizes, times_measured)
-	plt.xlabel("datagram size")
-	plt.ylabel("time measured")
-	plt.savefig("/images_saved/datagram_size_vs_time_measured.png")
+	sizes, times, lost, warmup_lost = engine.results()
+	if len(sizes) == 0:
+		raise Exception("No datagram size was measured")
+	minimum, median, p99 = summarize(times)
+	write_csv(os.path.join(args.output_dir, "datagram_size_vs_time_measured.csv"), sizes, minimum, median, p99, lost,
+			  warmup_lost, args.repetitions)
+	save_plot(os.path.join(args.output_dir, "datagram_size_vs_time_measured.png"), sizes, minimum, median, p99)
 
 	print('Client finished.')
- 
+
 if __name__ == "__main__":
     main()
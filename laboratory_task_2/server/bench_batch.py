@@ -0,0 +1,121 @@
+import argparse
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from tcp_server import (CALC_STRUCT, FRAME_HEADER_STRUCT, FRAME_HEADER_SIZE, BATCH_COUNT_STRUCT, BATCH_VALUE_DTYPE,
+                        BATCH_VALUE_SIZE, MSG_CALC, MSG_BATCH, MSG_RESULT, MSG_BATCH_RESULT, RESULT_FORMAT, PORT)
+
+OPERATORS = np.frombuffer(b"+-*/^", dtype=np.uint8)
+RESULT_STRUCT = struct.Struct(RESULT_FORMAT)
+RECV_SIZE = 1 << 20
+
+def generate_expressions(count, seed):
+    rng = np.random.default_rng(seed)
+    a = rng.uniform(-1000, 1000, count)
+    b = rng.uniform(-10, 10, count)
+    b[rng.random(count) < 0.01] = 0.0
+    op_codes = OPERATORS[rng.integers(0, len(OPERATORS), count)]
+    return a, op_codes, b
+
+def encode_single(a, op_codes, b):
+    """One expression per CALC frame, request id = expression index"""
+    frame_size = FRAME_HEADER_SIZE + CALC_STRUCT.size
+    buffer = bytearray(len(a) * frame_size)
+    for index, (x, op_code, y) in enumerate(zip(a.tolist(), op_codes.tolist(), b.tolist())):
+        offset = index * frame_size
+        FRAME_HEADER_STRUCT.pack_into(buffer, offset, CALC_STRUCT.size, MSG_CALC, index)
+        CALC_STRUCT.pack_into(buffer, offset + FRAME_HEADER_SIZE, x, op_code, y)
+    return [bytes(buffer)]
+
+def encode_batches(a, op_codes, b, batch_size):
+    frames = []
+    for request_id, start in enumerate(range(0, len(a), batch_size)):
+        end = min(start + batch_size, len(a))
+        count = end - start
+        payload_size = BATCH_COUNT_STRUCT.size + count * (2 * BATCH_VALUE_SIZE + 1)
+        frames.append(b"".join((FRAME_HEADER_STRUCT.pack(payload_size, MSG_BATCH, request_id),
+                                BATCH_COUNT_STRUCT.pack(count),
+                                a[start:end].astype(BATCH_VALUE_DTYPE).tobytes(),
+                                b[start:end].astype(BATCH_VALUE_DTYPE).tobytes(),
+                                op_codes[start:end].tobytes())))
+    return frames
+
+def decode_replies(data, count):
+    """Results and statuses in expression order, whether they came as RESULT or BATCH_RESULT frames"""
+    values = np.empty(count)
+    statuses = np.empty(count, dtype=np.uint8)
+    offset = 0
+    position = 0
+    while offset < len(data):
+        length, msg_type, request_id = FRAME_HEADER_STRUCT.unpack_from(data, offset)
+        payload = offset + FRAME_HEADER_SIZE
+        if msg_type == MSG_RESULT:
+            statuses[request_id], values[request_id] = RESULT_STRUCT.unpack_from(data, payload)
+        elif msg_type == MSG_BATCH_RESULT:
+            batch_count, = BATCH_COUNT_STRUCT.unpack_from(data, payload)
+            payload += BATCH_COUNT_STRUCT.size
+            values[position:position + batch_count] = np.frombuffer(data, BATCH_VALUE_DTYPE, batch_count, payload)
+            statuses[position:position + batch_count] = np.frombuffer(data, np.uint8, batch_count,
+                                                                      payload + batch_count * BATCH_VALUE_SIZE)
+            position += batch_count
+        else:
+            raise RuntimeError(f"Unexpected reply type {msg_type} for request {request_id}")
+        offset += FRAME_HEADER_SIZE + length
+    return values, statuses
+
+def get_reply_size(count, batch_size):
+    if batch_size == 0:
+        return count * (FRAME_HEADER_SIZE + RESULT_STRUCT.size)
+    batches = -(-count // batch_size)
+    return batches * (FRAME_HEADER_SIZE + BATCH_COUNT_STRUCT.size) + count * (BATCH_VALUE_SIZE + 1)
+
+def run(host, port, frames, reply_size):
+    """Sends all frames from a separate thread while reading the replies; returns the replies and the elapsed time"""
+    with socket.create_connection((host, port)) as sock:
+        sender = threading.Thread(target=sock.sendall, args=(b"".join(frames),))
+        data = bytearray()
+        start_time = time.perf_counter()
+        sender.start()
+        while len(data) < reply_size:
+            chunk = sock.recv(RECV_SIZE)
+            if not chunk:
+                raise RuntimeError("Server closed the connection")
+            data += chunk
+        elapsed_time = time.perf_counter() - start_time
+        sender.join()
+    return bytes(data), elapsed_time
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of single CALC frames against BATCH frames (framed mode)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--count', type=int, default=200000, help='Number of expressions')
+    parser.add_argument('--batch-size', nargs='+', type=int, default=[100, 1000, 10000],
+                        help='Expressions per BATCH frame')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    a, op_codes, b = generate_expressions(args.count, args.seed)
+    data, elapsed_time = run(args.host, args.port, encode_single(a, op_codes, b), get_reply_size(args.count, 0))
+    reference_values, reference_statuses = decode_replies(data, args.count)
+    single_rate = args.count / elapsed_time
+    print(f"{'batch size':>10} {'expressions/s':>14} {'speedup':>8}")
+    print(f"{'single':>10} {single_rate:>14.0f} {1.0:>7.1f}x")
+
+    for batch_size in args.batch_size:
+        data, elapsed_time = run(args.host, args.port, encode_batches(a, op_codes, b, batch_size),
+                                 get_reply_size(args.count, batch_size))
+        values, statuses = decode_replies(data, args.count)
+        # NumPy's vectorised pow may differ from libm in the last bit, so values are compared with a tolerance
+        if not (np.array_equal(statuses, reference_statuses) and
+                np.allclose(values, reference_values, rtol=1e-12, atol=0.0, equal_nan=True)):
+            raise RuntimeError(f"Batch of {batch_size} returned different results than single frames")
+        rate = args.count / elapsed_time
+        print(f"{batch_size:>10} {rate:>14.0f} {rate / single_rate:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
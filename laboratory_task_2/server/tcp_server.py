@@ -1,76 +1,307 @@
-import socket
-
-HOST = "0.0.0.0"
-PORT = 8888
-
-def calculate(a, op, b):
-    if op == "+":
-        return a + b
-    elif op == "-":
-        return a - b
-    elif op == "*":
-        return a * b
-    elif op == "/":
-        if b == 0:
-            return "ERROR: division by zero"
-        return a / b
-    elif op == "^":
-        return a ** b
-    else:
-        return "ERROR: unknown operator"
-
-def handle_client(conn, addr):
-    print(f"Connected with {addr}")
-    try:
-        while True:
-            data1 = conn.recv(1024)
-            if not data1:
-                print(f"Client {addr} closed connection (first packet).")
-                break
-
-            op_data = conn.recv(1)
-            if not op_data:
-                print(f"Client {addr} closed connection (operator).")
-                break
-
-            data2 = conn.recv(1024)
-            if not data2:
-                print(f"Client {addr} closed connection (third packet).")
-                break
-
-            try:
-                a_str = data1.decode("utf-8").strip()
-                op = op_data.decode("utf-8").strip()
-                b_str = data2.decode("utf-8").strip()
-
-                a = float(a_str)
-                b = float(b_str)
-            except Exception as e:
-                result = f"ERROR: invalid data ({e})"
-                conn.sendall(result.encode("utf-8"))
-                continue
-
-            result = calculate(a, op, b)
-
-            if isinstance(result, (int, float)):
-                result_str = str(result)
-            else:
-                result_str = result
-
-            conn.sendall(result_str.encode("utf-8"))
-            print(f"{addr}: {a_str} {op} {b_str} = {result_str}")
-    finally:
-        conn.close()
-        print(f"Connection with {addr} closed.")
-
-def main():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((HOST, PORT))
-        s.listen(1)
-        print(f"Server listening on {HOST}:{PORT}")
-        while True:
-            conn, addr = s.accept()
-            handle_client(conn, addr)
-
-if __name__ == "__main__":
-    main()
+import argparse
+import asyncio
+import math
+import operator
+import socket
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HOST = "0.0.0.0"
+PORT = 8888
+
+# Framed mode: every message is a FRAME_HEADER followed by `length` bytes of payload.
+# The request id is copied into the reply, so a client can pipeline requests and match replies by id.
+FRAME_HEADER_FORMAT = ">IBI"  # payload length, message type, request id
+CALC_FORMAT = ">dBd"          # operand a, operator (ASCII code of + - * / ^), operand b
+RESULT_FORMAT = ">Bd"         # status, result (NaN unless status is STATUS_OK)
+ERROR_FORMAT = ">B"           # status
+BATCH_COUNT_FORMAT = ">I"     # number of expressions; then a[count] and b[count] as >f8, operators[count] as u1
+                              # the reply has the same count, then results[count] as >f8 and statuses[count] as u1
+FRAME_HEADER_STRUCT = struct.Struct(FRAME_HEADER_FORMAT)
+CALC_STRUCT = struct.Struct(CALC_FORMAT)
+RESULT_FRAME_STRUCT = struct.Struct(FRAME_HEADER_FORMAT + RESULT_FORMAT[1:])
+ERROR_FRAME_STRUCT = struct.Struct(FRAME_HEADER_FORMAT + ERROR_FORMAT[1:])
+BATCH_COUNT_STRUCT = struct.Struct(BATCH_COUNT_FORMAT)
+BATCH_RESULT_HEADER_STRUCT = struct.Struct(FRAME_HEADER_FORMAT + BATCH_COUNT_FORMAT[1:])
+BATCH_VALUE_DTYPE = ">f8"
+BATCH_VALUE_SIZE = 8
+BATCH_ELEMENT_SIZE = 2 * BATCH_VALUE_SIZE + 1
+BATCH_RESULT_ELEMENT_SIZE = BATCH_VALUE_SIZE + 1
+FRAME_HEADER_SIZE = FRAME_HEADER_STRUCT.size
+RESULT_PAYLOAD_SIZE = struct.calcsize(RESULT_FORMAT)
+ERROR_PAYLOAD_SIZE = struct.calcsize(ERROR_FORMAT)
+MAX_FRAME_PAYLOAD = 16 * 1024 * 1024
+
+MSG_CALC = 1
+MSG_RESULT = 2
+MSG_ERROR = 3
+MSG_BATCH = 4
+MSG_BATCH_RESULT = 5
+
+STATUS_OK = 0
+STATUS_DIVISION_BY_ZERO = 1
+STATUS_UNKNOWN_OPERATOR = 2
+STATUS_OVERFLOW = 3
+STATUS_INVALID_RESULT = 4
+STATUS_BAD_REQUEST = 5
+
+OPERATIONS = {
+    ord("+"): operator.add,
+    ord("-"): operator.sub,
+    ord("*"): operator.mul,
+    ord("/"): operator.truediv,
+    ord("^"): operator.pow,
+}
+NUMPY_OPERATIONS = {
+    ord("+"): np.add,
+    ord("-"): np.subtract,
+    ord("*"): np.multiply,
+    ord("/"): np.true_divide,
+    ord("^"): np.power,
+} if np is not None else {}
+
+def calculate(a, op, b):
+    if op == "+":
+        return a + b
+    elif op == "-":
+        return a - b
+    elif op == "*":
+        return a * b
+    elif op == "/":
+        if b == 0:
+            return "ERROR: division by zero"
+        return a / b
+    elif op == "^":
+        return a ** b
+    else:
+        return "ERROR: unknown operator"
+
+def evaluate(a, op_code, b):
+    """Framed-mode counterpart of calculate: returns (status, value) instead of an error string"""
+    function = OPERATIONS.get(op_code)
+    if function is None:
+        return STATUS_UNKNOWN_OPERATOR, math.nan
+    if op_code == ord("/") and b == 0:
+        return STATUS_DIVISION_BY_ZERO, math.nan
+    try:
+        value = function(a, b)
+    except ZeroDivisionError:
+        # 0 ^ negative
+        return STATUS_DIVISION_BY_ZERO, math.nan
+    except OverflowError:
+        return STATUS_OVERFLOW, math.nan
+    if isinstance(value, complex):
+        # negative base with a fractional exponent
+        return STATUS_INVALID_RESULT, math.nan
+    if math.isinf(value) and math.isfinite(a) and math.isfinite(b):
+        return STATUS_OVERFLOW, math.nan
+    return STATUS_OK, value
+
+def handle_calc_frame(request_id, buffer, start, end, verbose):
+    if end - start != CALC_STRUCT.size:
+        return ERROR_FRAME_STRUCT.pack(ERROR_PAYLOAD_SIZE, MSG_ERROR, request_id, STATUS_BAD_REQUEST)
+    a, op_code, b = CALC_STRUCT.unpack_from(buffer, start)
+    status, value = evaluate(a, op_code, b)
+    if verbose:
+        print(f"#{request_id}: {a} {chr(op_code)} {b} = {value if status == STATUS_OK else f'status {status}'}")
+    return RESULT_FRAME_STRUCT.pack(RESULT_PAYLOAD_SIZE, MSG_RESULT, request_id, status, value)
+
+def evaluate_batch(a, op_codes, b):
+    """Vectorised evaluate: one NumPy pass per operator present in the batch, same statuses as evaluate"""
+    results = np.full(len(a), np.nan)
+    statuses = np.full(len(a), STATUS_UNKNOWN_OPERATOR, dtype=np.uint8)
+    with np.errstate(all="ignore"):
+        for op_code, function in NUMPY_OPERATIONS.items():
+            mask = op_codes == op_code
+            if not mask.any():
+                continue
+            x = a[mask]
+            y = b[mask]
+            values = function(x, y)
+            status = np.zeros(len(values), dtype=np.uint8)
+            finite = np.isfinite(x) & np.isfinite(y)
+            status[finite & np.isinf(values)] = STATUS_OVERFLOW
+            status[finite & np.isnan(values)] = STATUS_INVALID_RESULT
+            if op_code == ord("/"):
+                status[y == 0] = STATUS_DIVISION_BY_ZERO
+            elif op_code == ord("^"):
+                status[(x == 0) & (y < 0)] = STATUS_DIVISION_BY_ZERO
+            values[status != STATUS_OK] = np.nan
+            results[mask] = values
+            statuses[mask] = status
+    return results, statuses
+
+def evaluate_batch_scalar(buffer, offset, count):
+    """Fallback without NumPy: evaluate for every expression, packed like the vectorised results"""
+    a = struct.unpack_from(f">{count}d", buffer, offset)
+    b = struct.unpack_from(f">{count}d", buffer, offset + count * BATCH_VALUE_SIZE)
+    op_codes = buffer[offset + 2 * count * BATCH_VALUE_SIZE:offset + count * BATCH_ELEMENT_SIZE]
+    statuses, results = zip(*map(evaluate, a, op_codes, b)) if count else ((), ())
+    return struct.pack(f">{count}d", *results), bytes(statuses)
+
+def handle_batch_frame(request_id, buffer, start, end, verbose):
+    if end - start < BATCH_COUNT_STRUCT.size:
+        return ERROR_FRAME_STRUCT.pack(ERROR_PAYLOAD_SIZE, MSG_ERROR, request_id, STATUS_BAD_REQUEST)
+    count, = BATCH_COUNT_STRUCT.unpack_from(buffer, start)
+    if end - start != BATCH_COUNT_STRUCT.size + count * BATCH_ELEMENT_SIZE:
+        return ERROR_FRAME_STRUCT.pack(ERROR_PAYLOAD_SIZE, MSG_ERROR, request_id, STATUS_BAD_REQUEST)
+
+    offset = start + BATCH_COUNT_STRUCT.size
+    if np is not None:
+        a = np.frombuffer(buffer, BATCH_VALUE_DTYPE, count, offset)
+        b = np.frombuffer(buffer, BATCH_VALUE_DTYPE, count, offset + count * BATCH_VALUE_SIZE)
+        op_codes = np.frombuffer(buffer, np.uint8, count, offset + 2 * count * BATCH_VALUE_SIZE)
+        results, statuses = evaluate_batch(a, op_codes, b)
+        results = results.astype(BATCH_VALUE_DTYPE).tobytes()
+        statuses = statuses.tobytes()
+    else:
+        results, statuses = evaluate_batch_scalar(buffer, offset, count)
+    if verbose:
+        print(f"#{request_id}: batch of {count} expressions, {count - statuses.count(STATUS_OK)} failed")
+
+    payload_size = BATCH_COUNT_STRUCT.size + count * BATCH_RESULT_ELEMENT_SIZE
+    header = BATCH_RESULT_HEADER_STRUCT.pack(payload_size, MSG_BATCH_RESULT, request_id, count)
+    return b"".join((header, results, statuses))
+
+FRAME_HANDLERS = {
+    MSG_CALC: handle_calc_frame,
+    MSG_BATCH: handle_batch_frame,
+}
+
+class FramedCalculatorProtocol(asyncio.Protocol):
+    """One client connection in framed mode.
+
+    data_received answers every complete frame in the buffer and sends all the replies with one writelines,
+    so a client that pipelines requests gets its replies in batches. When the client stops reading and the
+    transport's write buffer fills up, reading from it is paused until the buffer drains.
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.buffer = bytearray()
+        self.transport = None
+        self.addr = None
+        self.requests = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.addr = transport.get_extra_info("peername")
+        print(f"Connected with {self.addr}")
+
+    def data_received(self, data):
+        buffer = self.buffer
+        buffer += data
+        offset = 0
+        responses = []
+        while len(buffer) - offset >= FRAME_HEADER_SIZE:
+            length, msg_type, request_id = FRAME_HEADER_STRUCT.unpack_from(buffer, offset)
+            if length > MAX_FRAME_PAYLOAD:
+                print(f"Client {self.addr} sent a {length} byte frame, closing connection.")
+                self.transport.writelines(responses)
+                self.transport.close()
+                return
+            end = offset + FRAME_HEADER_SIZE + length
+            if len(buffer) < end:
+                break
+            handler = FRAME_HANDLERS.get(msg_type)
+            if handler is None:
+                responses.append(ERROR_FRAME_STRUCT.pack(ERROR_PAYLOAD_SIZE, MSG_ERROR, request_id, STATUS_BAD_REQUEST))
+            else:
+                responses.append(handler(request_id, buffer, offset + FRAME_HEADER_SIZE, end, self.verbose))
+            offset = end
+        del buffer[:offset]
+        if responses:
+            self.requests += len(responses)
+            self.transport.writelines(responses)
+
+    def pause_writing(self):
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        print(f"Connection with {self.addr} closed after {self.requests} requests.")
+
+async def serve_framed(verbose):
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(lambda: FramedCalculatorProtocol(verbose), HOST, PORT, reuse_address=True)
+    print(f"Server listening on {HOST}:{PORT} (framed mode)")
+    async with server:
+        await server.serve_forever()
+
+def handle_client(conn, addr):
+    print(f"Connected with {addr}")
+    try:
+        while True:
+            data1 = conn.recv(1024)
+            if not data1:
+                print(f"Client {addr} closed connection (first packet).")
+                break
+
+            op_data = conn.recv(1)
+            if not op_data:
+                print(f"Client {addr} closed connection (operator).")
+                break
+
+            data2 = conn.recv(1024)
+            if not data2:
+                print(f"Client {addr} closed connection (third packet).")
+                break
+
+            try:
+                a_str = data1.decode("utf-8").strip()
+                op = op_data.decode("utf-8").strip()
+                b_str = data2.decode("utf-8").strip()
+
+                a = float(a_str)
+                b = float(b_str)
+            except Exception as e:
+                result = f"ERROR: invalid data ({e})"
+                conn.sendall(result.encode("utf-8"))
+                continue
+
+            result = calculate(a, op, b)
+
+            if isinstance(result, (int, float)):
+                result_str = str(result)
+            else:
+                result_str = result
+
+            conn.sendall(result_str.encode("utf-8"))
+            print(f"{addr}: {a_str} {op} {b_str} = {result_str}")
+    finally:
+        conn.close()
+        print(f"Connection with {addr} closed.")
+
+def serve_classic():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((HOST, PORT))
+        s.listen(1)
+        print(f"Server listening on {HOST}:{PORT}")
+        while True:
+            conn, addr = s.accept()
+            handle_client(conn, addr)
+
+def main():
+    parser = argparse.ArgumentParser(description="TCP calculator server")
+    parser.add_argument("--mode", choices=["classic", "framed"], default="classic",
+                        help="classic - one client at a time, operands and operator as separate text sends; "
+                             "framed - length-prefixed binary frames with request ids, many clients at once")
+    parser.add_argument("--verbose", action="store_true", help="Print every calculation in framed mode")
+    args = parser.parse_args()
+
+    if args.mode == "framed":
+        try:
+            asyncio.run(serve_framed(args.verbose))
+        except KeyboardInterrupt:
+            pass
+    else:
+        serve_classic()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import argparse
+import csv
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from impairment_proxy import ImpairmentProxy, impairment_from_args, LISTEN_HOST, LISTEN_PORT, SERVER_PORT
+
+LAB_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_SCRIPT = os.path.join(LAB_DIR, "server", "udp_server.py")
+CLIENT_BINARY = os.path.join(LAB_DIR, "client", "udp_client")
+
+SERVER_STARTUP_S = 0.5
+RUN_TIMEOUT_S = 120.0
+LEGACY_FILE_SIZE = 10000
+LEGACY_PACKETS = 100
+RESEND_LINE = "Timeout occurred! Resending packet"
+STATS_PREFIX = "STATS "
+
+CSV_FIELDS = [
+    'protocol', 'loss', 'delay_ms', 'jitter_ms', 'reorder', 'duplicate', 'window', 'fec_group', 'run', 'seed',
+    'status', 'bytes', 'completion_s', 'goodput_kbps', 'transmissions', 'retransmissions', 'parity',
+    'client_elapsed_ms', 'proxy_dropped', 'proxy_duplicated', 'proxy_reordered',
+]
+
+def parse_stats_line(output):
+    """Pola key=value z linii STATS wypisywanej przez klienta po selective repeat"""
+    for line in output.splitlines():
+        if line.startswith(STATS_PREFIX):
+            return dict(field.split("=", 1) for field in line[len(STATS_PREFIX):].split())
+    return {}
+
+def build_client_command(client, protocol, window, fec_group, args):
+    command = [client, "-d", "0", "-t", str(args.rto_ms)]
+    if protocol == 'sr':
+        command += ["-w", str(window)]
+    elif protocol == 'x':
+        command += ["-x", "-w", str(window), "-s", str(args.size), "-c", str(args.chunk)]
+        if fec_group:
+            command += ["-f", str(fec_group)]
+    return command + [LISTEN_HOST, str(args.proxy_port)]
+
+def start_server(protocol):
+    mode = 'saw' if protocol == 'saw' else 'sr'
+    server = subprocess.Popen([sys.executable, SERVER_SCRIPT, "--mode", mode],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(SERVER_STARTUP_S)
+    if server.poll() is not None:
+        raise RuntimeError(f"Serwer zakończył się od razu (kod {server.returncode}), czy port {SERVER_PORT} jest wolny?")
+    return server
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+def run_once(client, protocol, point, run, seed, args):
+    """Jeden przebieg klienta przez świeżego pośrednika; zwraca wiersz CSV"""
+    loss, delay_ms, jitter_ms, reorder, duplicate, window, fec_group = point
+    impairment = impairment_from_args(loss, delay_ms, jitter_ms, reorder, args.reorder_delay_ms, duplicate)
+    proxy = ImpairmentProxy((LISTEN_HOST, args.proxy_port), (LISTEN_HOST, SERVER_PORT), impairment, seed=seed)
+    proxy_thread = threading.Thread(target=proxy.serve_forever)
+    proxy_thread.daemon = True
+    proxy_thread.start()
+
+    command = build_client_command(client, protocol, window, fec_group, args)
+    start_time = time.perf_counter()
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=args.run_timeout)
+        output = completed.stdout
+        status = 'ok' if completed.returncode == 0 else f"exit {completed.returncode}"
+    except subprocess.TimeoutExpired as error:
+        output = error.stdout.decode() if error.stdout else ""
+        status = 'timeout'
+    completion_time = time.perf_counter() - start_time
+
+    proxy.stop()
+    proxy_thread.join()
+    proxy.close()
+
+    size = args.size if protocol == 'x' else LEGACY_FILE_SIZE
+    stats = parse_stats_line(output)
+    if stats:
+        transmissions = int(stats['transmissions'])
+        retransmissions = int(stats['retransmissions'])
+        parity = int(stats['parity'])
+        client_elapsed_ms = stats['elapsed_ms']
+    else:
+        # stop-and-wait nie wypisuje STATS - retransmisje liczymy z komunikatów o timeoutach
+        retransmissions = output.count(RESEND_LINE)
+        transmissions = LEGACY_PACKETS + retransmissions
+        parity = 0
+        client_elapsed_ms = ""
+
+    return {
+        'protocol': protocol,
+        'loss': loss,
+        'delay_ms': delay_ms,
+        'jitter_ms': jitter_ms,
+        'reorder': reorder,
+        'duplicate': duplicate,
+        'window': window if protocol != 'saw' else 1,
+        'fec_group': fec_group,
+        'run': run,
+        'seed': seed,
+        'status': status,
+        'bytes': size,
+        'completion_s': f"{completion_time:.4f}",
+        'goodput_kbps': f"{size * 8 / completion_time / 1000:.1f}" if status == 'ok' else "",
+        'transmissions': transmissions,
+        'retransmissions': retransmissions,
+        'parity': parity,
+        'client_elapsed_ms': client_elapsed_ms,
+        'proxy_dropped': proxy.stats.dropped,
+        'proxy_duplicated': proxy.stats.duplicated,
+        'proxy_reordered': proxy.stats.reordered,
+    }
+
+def get_sweep_points(protocol, args):
+    """Kombinacje parametrów dla protokołu; okno i FEC mają sens tylko tam, gdzie klient ich używa"""
+    windows = [1] if protocol == 'saw' else args.window
+    fec_groups = args.fec if protocol == 'x' else [0]
+    return itertools.product(args.loss, args.delay_ms, args.jitter_ms, args.reorder, args.duplicate, windows,
+                             fec_groups)
+
+def main():
+    parser = argparse.ArgumentParser(description='Pomiar goodputu klienta lab 3 przez pośrednika psującego ruch')
+    parser.add_argument('--protocol', nargs='+', choices=['saw', 'sr', 'x'], default=['x'],
+                        help='saw - stop-and-wait, sr - selective repeat bez XSTR, x - protokół rozszerzony')
+    parser.add_argument('--loss', nargs='+', type=float, default=[0.0, 0.01, 0.05, 0.1])
+    parser.add_argument('--delay-ms', nargs='+', type=float, default=[0.0])
+    parser.add_argument('--jitter-ms', nargs='+', type=float, default=[0.0])
+    parser.add_argument('--reorder', nargs='+', type=float, default=[0.0])
+    parser.add_argument('--reorder-delay-ms', type=float, default=20.0,
+                        help='O ile dłużej pośrednik przetrzymuje datagram wybrany do zmiany kolejności')
+    parser.add_argument('--duplicate', nargs='+', type=float, default=[0.0])
+    parser.add_argument('--window', nargs='+', type=int, default=[16], help='Okna selective repeat (sr i x)')
+    parser.add_argument('--fec', nargs='+', type=int, default=[0],
+                        help='Rozmiary grup FEC dla x (0 - bez FEC), np. --fec 0 4 8')
+    parser.add_argument('--size', type=int, default=1024 * 1024, help='Rozmiar pliku dla x w bajtach')
+    parser.add_argument('--chunk', type=int, default=1024, help='Rozmiar fragmentu dla x w bajtach')
+    parser.add_argument('--rto-ms', type=int, default=100, help='Limit czasu retransmisji klienta (-t)')
+    parser.add_argument('--repeat', type=int, default=3, help='Liczba przebiegów dla każdej kombinacji')
+    parser.add_argument('--seed', type=int, default=1, help='Ziarno pośrednika w pierwszym przebiegu, dalej kolejne')
+    parser.add_argument('--proxy-port', type=int, default=LISTEN_PORT)
+    parser.add_argument('--run-timeout', type=float, default=RUN_TIMEOUT_S,
+                        help='Przebieg dłuższy niż tyle sekund jest przerywany i zapisywany jako timeout')
+    parser.add_argument('--client', default=CLIENT_BINARY,
+                        help='Skompilowany klient: gcc client/udp_client.c -o client/udp_client -lssl -lcrypto')
+    parser.add_argument('--output', default='goodput.csv', help='Plik wynikowy CSV')
+    args = parser.parse_args()
+
+    if not os.access(args.client, os.X_OK):
+        parser.error(f"brak klienta {args.client}; skompiluj: gcc client/udp_client.c -o client/udp_client "
+                     f"-lssl -lcrypto")
+
+    seed = args.seed
+    with open(args.output, 'w', newline='') as output_file:
+        writer = csv.DictWriter(output_file, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for protocol in args.protocol:
+            server = start_server(protocol)
+            try:
+                for point in get_sweep_points(protocol, args):
+                    for run in range(args.repeat):
+                        row = run_once(args.client, protocol, point, run, seed, args)
+                        seed += 1
+                        writer.writerow(row)
+                        output_file.flush()
+                        print(f"{protocol} loss={row['loss']} delay={row['delay_ms']}ms jitter={row['jitter_ms']}ms "
+                              f"reorder={row['reorder']} dup={row['duplicate']} window={row['window']} "
+                              f"fec={row['fec_group']} run={run}: {row['status']}, {row['completion_s']} s, "
+                              f"{row['goodput_kbps'] or '-'} kbit/s, {row['retransmissions']} retransmissions")
+            finally:
+                stop_server(server)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,147 +1,676 @@
-#include <stdio.h>
-#include <string.h>
-#include <stdlib.h>
-#include <unistd.h>
-#include <arpa/inet.h>
-#include <sys/socket.h>
-#include <sys/types.h>
-#include <netinet/in.h>
-#include <err.h>
-#include <netdb.h>
-#include <errno.h>
-#include <openssl/sha.h>
-
-#define DEFAULT_SRV_IP "127.0.0.1"
-#define DEFAULT_PORT 8888
-
-#define BSIZE 1000
-#define DATA_SIZE 10000
-#define DATA_PER_PACKET 100
-#define PACKET_COUNT DATA_SIZE / DATA_PER_PACKET
-#define HEADER_SIZE sizeof(int)
-
-#define TIMEOUT_S 100 // ms
-
-#define bailout(s) { perror( s ); exit(1);  }
-
-
-int main(int argc, char *argv[]) {
-    int sock = 0;
-    struct sockaddr_in server;
-    struct hostent *hp = NULL;
-    char buf[BSIZE];
-    char recv_buf[BSIZE];
-
-    socklen_t slen = sizeof(server);
-
-    char *server_ip = DEFAULT_SRV_IP;
-    int server_port = DEFAULT_PORT;
-
-    const char RANDOM_LETTER_POOL[] = {'R','E','G','G','I','N'};
-    char data[DATA_SIZE];
-    char is_packet_sent[PACKET_COUNT];
-
-    struct timeval tv;
-    tv.tv_sec = 0;
-    tv.tv_usec = TIMEOUT_S * 1000;
-
-    printf("Sleeping for 10 seconds...\n");
-    sleep(10);
-
-    sock = socket(AF_INET, SOCK_DGRAM, 0);
-    if (sock == -1)
-        bailout("opening stream socket");
-
-    if (setsockopt(sock, SOL_SOCKET, SO_RCVTIMEO, &tv, sizeof(tv)) < 0)
-        bailout("Error setting socket timeout");
-
-    if (argc >= 2)
-        server_ip = argv[1];
-    if (argc >= 3)
-        server_port = atoi(argv[2]);
-
-    server.sin_family = AF_INET;
-    server.sin_port = htons(server_port);
-
-    if (inet_aton(server_ip, &server.sin_addr) == 0) {
-        hp = gethostbyname2( server_ip, AF_INET);
-        if (hp == NULL) {
-            fprintf(stderr, "%s: unknown host\n", server_ip);
-            exit(2);
-        } 
-        memcpy( (char *) &server.sin_addr, (char *) hp->h_addr, hp->h_length);
-    }
-
-    printf("UDP Client started. Sending to %s:%d\n", server_ip, server_port);
-
-    memset(is_packet_sent, '0', PACKET_COUNT);
-    for (int i = 0; i < DATA_SIZE; ++i) {
-        data[i] = RANDOM_LETTER_POOL[rand() % sizeof(RANDOM_LETTER_POOL)];
-    }
-    data[DATA_SIZE-1] = '\0';
-
-    int current_pkt = 0;
-
-    // printf("\n<<< PRESS ENTER TO START PACKET TRANSMISSION >>>\n");
-    // while (getchar() != '\n');
-
-    while(current_pkt < PACKET_COUNT) {
-        memset(buf, 0, BSIZE);
-        memset(recv_buf, 0, BSIZE);
-
-        int offset = current_pkt * DATA_PER_PACKET;
-        uint32_t pkt_net = htonl((uint32_t)current_pkt);
-
-        memcpy(buf, &pkt_net, sizeof(int));
-        memcpy(buf + HEADER_SIZE, data + offset, DATA_PER_PACKET);
-        
-        int total_len = HEADER_SIZE + DATA_PER_PACKET;
-
-        printf("Sending Packet %d/%d (%d bytes)...\n", current_pkt, PACKET_COUNT, total_len);
-        //printf("Packet content: %.*s", DATA_PER_PACKET+1, buf);
-        printf("Packet content: %.*s\n", DATA_PER_PACKET + 1 - 4, buf + 4);
-
-        if (sendto(sock, buf, total_len, 0, (struct sockaddr*) &server, slen) == -1) {
-            bailout("sendto()");
-        }
-
-        int recv_len = recvfrom(sock, recv_buf, BSIZE, 0, (struct sockaddr*) &server, &slen);
-
-        if (recv_len > 0) {
-            recv_buf[recv_len] = '\0';
-            
-
-            uint32_t ack_net;
-            memcpy(&ack_net, recv_buf, sizeof(ack_net));
-            int ack = (int)ntohl(ack_net);
-            printf("Received ACK: %d \n", ack);
-
-            if (memcmp(&ack, &current_pkt, sizeof(int)) == 0) {
-                is_packet_sent[current_pkt] = 1;
-                ++current_pkt; 
-            }
-        } 
-        else {
-            if (errno == EAGAIN || errno == EWOULDBLOCK) {
-                printf("Timeout occurred! Resending packet %d...\n", current_pkt);
-            } else {
-                bailout("recvfrom error");
-            }
-        }
-    }
-
-    unsigned char hash_digest[SHA256_DIGEST_LENGTH];
-    if (SHA256((const unsigned char *)data, DATA_SIZE, hash_digest) == NULL) {
-        fprintf(stderr, "SHA256 calculation failed.\n");
-        return 1;
-    }
-
-    for (int i = 0; i < SHA256_DIGEST_LENGTH; ++i) {
-        printf("%02x", hash_digest[i]);
-    }
-    printf("\n");
-    printf("Done\n");
-
-    close(sock);
-    return 0;
-}
+#include <stdio.h>
+#include <string.h>
+#include <stdlib.h>
+#include <stdint.h>
+#include <unistd.h>
+#include <time.h>
+#include <arpa/inet.h>
+#include <sys/socket.h>
+#include <sys/select.h>
+#include <sys/types.h>
+#include <netinet/in.h>
+#include <err.h>
+#include <netdb.h>
+#include <errno.h>
+#include <openssl/sha.h>
+
+#define DEFAULT_SRV_IP "127.0.0.1"
+#define DEFAULT_PORT 8888
+
+#define BSIZE 1000
+#define DATA_SIZE 10000
+#define DATA_PER_PACKET 100
+#define PACKET_COUNT DATA_SIZE / DATA_PER_PACKET
+#define HEADER_SIZE sizeof(int)
+
+#define TIMEOUT_S 100 // ms
+#define DEFAULT_STARTUP_DELAY_S 10
+
+#define SACK_BITMAP_BITS 64
+#define MAX_WINDOW SACK_BITMAP_BITS
+#define DEFAULT_WINDOW 16
+#define SR_ACK_SIZE (sizeof(int32_t) + sizeof(uint64_t))
+
+/* Protokol rozszerzony: XSTR negocjuje rozmiar pliku i fragmentu, XDAT/XACK niosa id przesylania */
+#define MAX_DATAGRAM_SIZE 65507
+#define MAGIC_SIZE 4
+#define XSTR_SIZE (MAGIC_SIZE + 4 + 8 + 2 + 2)
+#define FLAG_DIGEST 0x0001
+#define FLAG_FEC 0x0002
+#define MIN_FEC_GROUP 2
+#define MAX_FEC_GROUP 64
+#define XSOK_SIZE (MAGIC_SIZE + 4 + 4 + 4 + 2)
+#define XERR_SIZE (MAGIC_SIZE + 4 + 2)
+#define XDAT_HEADER_SIZE (MAGIC_SIZE + 4 + 4)
+#define XACK_SIZE (MAGIC_SIZE + 4 + SR_ACK_SIZE)
+#define XMAP_HEADER_SIZE (MAGIC_SIZE + 4 + 4)
+#define XFIN_REQUEST_SIZE (MAGIC_SIZE + 4 + 4)
+#define XFIN_SIZE (MAGIC_SIZE + 4 + 1 + SHA256_DIGEST_LENGTH)
+#define MAX_CHUNK_SIZE (MAX_DATAGRAM_SIZE - XDAT_HEADER_SIZE)
+#define MAX_START_ATTEMPTS 50
+#define MAX_RESYNCS 10
+
+/* XSOK niesie liczbe brakujacych pakietow; gdy serwer ma juz czesc pliku (wznowienie po restarcie),
+   klient pobiera bitmape odebranych pakietow stronami po BITMAP_PAGE_SIZE bajtow (XMAP) */
+#define BITMAP_PAGE_SIZE 1024
+#define BITMAP_PAGE_PACKETS (BITMAP_PAGE_SIZE * 8)
+
+#define ERROR_UNKNOWN_TRANSFER 3
+
+/* Wynik weryfikacji SHA-256 w XFIN */
+#define FIN_OK 0
+#define FIN_MISMATCH 1
+#define FIN_UNCHECKED 2
+
+struct transfer {
+    const char *data;
+    size_t size;
+    int chunk_size;
+    int packet_count;
+    int extended;
+    uint32_t id;
+    const unsigned char *digest;
+    int fec_group;
+};
+
+#define bailout(s) { perror( s ); exit(1);  }
+
+static double now_ms(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000.0 + ts.tv_nsec / 1e6;
+}
+
+static void put_u16(char *buf, uint16_t value) {
+    uint16_t value_net = htons(value);
+    memcpy(buf, &value_net, sizeof(value_net));
+}
+
+static void put_u32(char *buf, uint32_t value) {
+    uint32_t value_net = htonl(value);
+    memcpy(buf, &value_net, sizeof(value_net));
+}
+
+static uint32_t get_u32(const char *buf) {
+    uint32_t value_net;
+    memcpy(&value_net, buf, sizeof(value_net));
+    return ntohl(value_net);
+}
+
+static void send_packet(int sock, struct sockaddr_in *server, const struct transfer *t, int pkt) {
+    char buf[MAX_DATAGRAM_SIZE];
+    size_t offset = (size_t)pkt * t->chunk_size;
+    size_t len = t->size - offset < (size_t)t->chunk_size ? t->size - offset : (size_t)t->chunk_size;
+    size_t header_size;
+
+    if (t->extended) {
+        memcpy(buf, "XDAT", MAGIC_SIZE);
+        put_u32(buf + MAGIC_SIZE, t->id);
+        put_u32(buf + MAGIC_SIZE + 4, (uint32_t)pkt);
+        header_size = XDAT_HEADER_SIZE;
+    } else {
+        put_u32(buf, (uint32_t)pkt);
+        header_size = HEADER_SIZE;
+    }
+    memcpy(buf + header_size, t->data + offset, len);
+
+    if (sendto(sock, buf, header_size + len, 0, (struct sockaddr*) server, sizeof(*server)) == -1) {
+        bailout("sendto()");
+    }
+}
+
+/* XPAR: XOR fragmentow grupy FEC (krotszy ostatni fragment dopelniony zerami) - serwer odtworzy z niego
+   jeden zgubiony fragment grupy bez czekania na retransmisje */
+static void send_parity(int sock, struct sockaddr_in *server, const struct transfer *t, int group) {
+    char buf[MAX_DATAGRAM_SIZE];
+    char *parity = buf + XDAT_HEADER_SIZE;
+    int first = group * t->fec_group;
+    int last = first + t->fec_group < t->packet_count ? first + t->fec_group : t->packet_count;
+
+    memcpy(buf, "XPAR", MAGIC_SIZE);
+    put_u32(buf + MAGIC_SIZE, t->id);
+    put_u32(buf + MAGIC_SIZE + 4, (uint32_t)group);
+    memset(parity, 0, t->chunk_size);
+    for (int pkt = first; pkt < last; ++pkt) {
+        size_t offset = (size_t)pkt * t->chunk_size;
+        size_t len = t->size - offset < (size_t)t->chunk_size ? t->size - offset : (size_t)t->chunk_size;
+        for (size_t i = 0; i < len; ++i) {
+            parity[i] ^= t->data[offset + i];
+        }
+    }
+
+    if (sendto(sock, buf, XDAT_HEADER_SIZE + t->chunk_size, 0, (struct sockaddr*) server, sizeof(*server)) == -1) {
+        bailout("sendto()");
+    }
+}
+
+/* Kod bledu z XERR dla tego przesylania albo 0, gdy datagram nie jest bledem */
+static int get_transfer_error(const struct transfer *t, const char *buf, int len) {
+    if (len == XERR_SIZE && memcmp(buf, "XERR", MAGIC_SIZE) == 0 && get_u32(buf + MAGIC_SIZE) == t->id) {
+        return ((unsigned char)buf[MAGIC_SIZE + 4] << 8) | (unsigned char)buf[MAGIC_SIZE + 5];
+    }
+    return 0;
+}
+
+static void fail_transfer(const struct transfer *t, int code) {
+    fprintf(stderr, "Server rejected transfer %u (error %d)\n", t->id, code);
+    exit(1);
+}
+
+/* Wysyla zapytanie i czeka na odpowiedz zaczynajaca sie od prefix; ponawia co rto_ms.
+   Zwraca dlugosc odpowiedzi w reply */
+static int exchange(int sock, struct sockaddr_in *server, const struct transfer *t, const char *request, size_t request_len,
+                    const char *prefix, size_t prefix_len, char *reply, size_t reply_size, int rto_ms) {
+    for (int attempt = 0; attempt < MAX_START_ATTEMPTS; ++attempt) {
+        if (sendto(sock, request, request_len, 0, (struct sockaddr*) server, sizeof(*server)) == -1) {
+            bailout("sendto()");
+        }
+
+        double deadline = now_ms() + rto_ms;
+        double wait_ms;
+        while ((wait_ms = deadline - now_ms()) > 0) {
+            fd_set read_fds;
+            FD_ZERO(&read_fds);
+            FD_SET(sock, &read_fds);
+            struct timeval tv;
+            tv.tv_sec = (long)(wait_ms / 1000);
+            tv.tv_usec = (long)((wait_ms - tv.tv_sec * 1000) * 1000);
+
+            int ready = select(sock + 1, &read_fds, NULL, NULL, &tv);
+            if (ready < 0 && errno != EINTR) {
+                bailout("select()");
+            }
+            if (ready <= 0) {
+                continue;
+            }
+            int recv_len = recv(sock, reply, reply_size, 0);
+            if (recv_len < 0) {
+                bailout("recv()");
+            }
+            /* XERR o nieznanym przesylaniu to odpowiedzi na XDAT wyslane jeszcze przed uzgodnieniem */
+            int code = get_transfer_error(t, reply, recv_len);
+            if (code != 0 && code != ERROR_UNKNOWN_TRANSFER) {
+                fail_transfer(t, code);
+            }
+            if ((size_t)recv_len >= prefix_len && memcmp(reply, prefix, prefix_len) == 0) {
+                return recv_len;
+            }
+        }
+        printf("Timeout occurred! Resending %.4s for transfer %u...\n", request, t->id);
+    }
+    fprintf(stderr, "No answer to %.4s after %d attempts\n", request, MAX_START_ATTEMPTS);
+    exit(1);
+}
+
+/* XSTR: magia, id, rozmiar pliku, rozmiar fragmentu, flagi, dalej SHA-256 i (z FLAG_FEC) proponowana
+   grupa FEC; serwer odpowiada XSOK z liczba pakietow, liczba brakujacych i przyjeta grupa FEC */
+static int start_transfer(int sock, struct sockaddr_in *server, struct transfer *t, int rto_ms) {
+    char buf[XSTR_SIZE + SHA256_DIGEST_LENGTH + 2];
+    size_t len = XSTR_SIZE + SHA256_DIGEST_LENGTH;
+    char prefix[MAGIC_SIZE + 4];
+    char reply[BSIZE];
+    uint32_t size_high = (uint32_t)((uint64_t)t->size >> 32);
+
+    memcpy(buf, "XSTR", MAGIC_SIZE);
+    put_u32(buf + MAGIC_SIZE, t->id);
+    put_u32(buf + MAGIC_SIZE + 4, size_high);
+    put_u32(buf + MAGIC_SIZE + 8, (uint32_t)t->size);
+    put_u16(buf + MAGIC_SIZE + 12, (uint16_t)t->chunk_size);
+    put_u16(buf + MAGIC_SIZE + 14, FLAG_DIGEST | (t->fec_group ? FLAG_FEC : 0));
+    memcpy(buf + XSTR_SIZE, t->digest, SHA256_DIGEST_LENGTH);
+    if (t->fec_group) {
+        put_u16(buf + len, (uint16_t)t->fec_group);
+        len += 2;
+    }
+
+    memcpy(prefix, "XSOK", MAGIC_SIZE);
+    put_u32(prefix + MAGIC_SIZE, t->id);
+    exchange(sock, server, t, buf, len, prefix, sizeof(prefix), reply, sizeof(reply), rto_ms);
+
+    int missing = (int)get_u32(reply + MAGIC_SIZE + 8);
+    t->fec_group = ((unsigned char)reply[MAGIC_SIZE + 12] << 8) | (unsigned char)reply[MAGIC_SIZE + 13];
+    printf("Transfer %u accepted: %zu bytes in %d packets of %d bytes, %d missing, FEC group %d\n",
+           t->id, t->size, (int)get_u32(reply + MAGIC_SIZE + 4), t->chunk_size, missing, t->fec_group);
+    return missing;
+}
+
+/* Pobiera bitmape odebranych pakietow (bit i & 7 bajtu i >> 3) i oznacza je jako potwierdzone */
+static void fetch_received_bitmap(int sock, struct sockaddr_in *server, const struct transfer *t, int rto_ms, char *is_acked) {
+    char request[XMAP_HEADER_SIZE];
+    char reply[XMAP_HEADER_SIZE + BITMAP_PAGE_SIZE];
+    int pages = (t->packet_count + BITMAP_PAGE_PACKETS - 1) / BITMAP_PAGE_PACKETS;
+
+    for (int page = 0; page < pages; ++page) {
+        memcpy(request, "XMAP", MAGIC_SIZE);
+        put_u32(request + MAGIC_SIZE, t->id);
+        put_u32(request + MAGIC_SIZE + 4, (uint32_t)page);
+
+        int len = exchange(sock, server, t, request, sizeof(request), request, sizeof(request), reply, sizeof(reply), rto_ms);
+        int first_pkt = page * BITMAP_PAGE_PACKETS;
+        for (int i = 0; i < (len - XMAP_HEADER_SIZE) * 8 && first_pkt + i < t->packet_count; ++i) {
+            if ((unsigned char)reply[XMAP_HEADER_SIZE + (i >> 3)] >> (i & 7) & 1) {
+                is_acked[first_pkt + i] = 1;
+            }
+        }
+    }
+}
+
+static void print_digest(const unsigned char *digest) {
+    for (int i = 0; i < SHA256_DIGEST_LENGTH; ++i) {
+        printf("%02x", digest[i]);
+    }
+    printf("\n");
+}
+
+/* XFIN: po potwierdzeniu wszystkich pakietow pyta serwer o wynik porownania SHA-256 wyslanego w XSTR */
+static int query_finish(int sock, struct sockaddr_in *server, const struct transfer *t, int rto_ms) {
+    char request[XFIN_REQUEST_SIZE];
+    char reply[BSIZE];
+
+    memcpy(request, "XFIN", MAGIC_SIZE);
+    put_u32(request + MAGIC_SIZE, t->id);
+    put_u32(request + MAGIC_SIZE + 4, 0);
+
+    int len = exchange(sock, server, t, request, sizeof(request), request, MAGIC_SIZE + 4, reply, sizeof(reply), rto_ms);
+    if (len < XFIN_SIZE) {
+        fprintf(stderr, "Malformed XFIN for transfer %u\n", t->id);
+        exit(1);
+    }
+    int status = (unsigned char)reply[MAGIC_SIZE + 4];
+    printf("Server verification: %s, server SHA-256: ",
+           status == FIN_OK ? "OK" : status == FIN_MISMATCH ? "MISMATCH" : "not checked");
+    print_digest((const unsigned char *)reply + MAGIC_SIZE + 5);
+    return status;
+}
+
+/* Uzgadnia stan z serwerem: is_acked po powrocie odpowiada temu, co serwer juz ma */
+static void sync_transfer(int sock, struct sockaddr_in *server, struct transfer *t, int rto_ms, char *is_acked) {
+    memset(is_acked, 0, t->packet_count);
+    int missing = start_transfer(sock, server, t, rto_ms);
+    if (missing < t->packet_count) {
+        fetch_received_bitmap(sock, server, t, rto_ms, is_acked);
+        printf("Resuming transfer %u: %d of %d packets already on server\n", t->id, t->packet_count - missing, t->packet_count);
+    }
+}
+
+static void send_stop_and_wait(int sock, struct sockaddr_in *server, const char *data) {
+    char buf[BSIZE];
+    char recv_buf[BSIZE];
+    socklen_t slen = sizeof(*server);
+    char is_packet_sent[PACKET_COUNT];
+
+    struct timeval tv;
+    tv.tv_sec = 0;
+    tv.tv_usec = TIMEOUT_S * 1000;
+
+    if (setsockopt(sock, SOL_SOCKET, SO_RCVTIMEO, &tv, sizeof(tv)) < 0)
+        bailout("Error setting socket timeout");
+
+    memset(is_packet_sent, '0', PACKET_COUNT);
+
+    int current_pkt = 0;
+
+    // printf("\n<<< PRESS ENTER TO START PACKET TRANSMISSION >>>\n");
+    // while (getchar() != '\n');
+
+    while(current_pkt < PACKET_COUNT) {
+        memset(buf, 0, BSIZE);
+        memset(recv_buf, 0, BSIZE);
+
+        int offset = current_pkt * DATA_PER_PACKET;
+        uint32_t pkt_net = htonl((uint32_t)current_pkt);
+
+        memcpy(buf, &pkt_net, sizeof(int));
+        memcpy(buf + HEADER_SIZE, data + offset, DATA_PER_PACKET);
+
+        int total_len = HEADER_SIZE + DATA_PER_PACKET;
+
+        printf("Sending Packet %d/%d (%d bytes)...\n", current_pkt, PACKET_COUNT, total_len);
+        //printf("Packet content: %.*s", DATA_PER_PACKET+1, buf);
+        printf("Packet content: %.*s\n", DATA_PER_PACKET + 1 - 4, buf + 4);
+
+        if (sendto(sock, buf, total_len, 0, (struct sockaddr*) server, slen) == -1) {
+            bailout("sendto()");
+        }
+
+        int recv_len = recvfrom(sock, recv_buf, BSIZE, 0, (struct sockaddr*) server, &slen);
+
+        if (recv_len > 0) {
+            recv_buf[recv_len] = '\0';
+
+
+            uint32_t ack_net;
+            memcpy(&ack_net, recv_buf, sizeof(ack_net));
+            int ack = (int)ntohl(ack_net);
+            printf("Received ACK: %d \n", ack);
+
+            if (memcmp(&ack, &current_pkt, sizeof(int)) == 0) {
+                is_packet_sent[current_pkt] = 1;
+                ++current_pkt;
+            }
+        }
+        else {
+            if (errno == EAGAIN || errno == EWOULDBLOCK) {
+                printf("Timeout occurred! Resending packet %d...\n", current_pkt);
+            } else {
+                bailout("recvfrom error");
+            }
+        }
+    }
+}
+
+/* ACK selective repeat: >iQ - skumulowany indeks i bitmapa SACK (bit k = pakiet cumulative + 1 + k);
+   w protokole rozszerzonym poprzedzone magia XACK i id przesylania.
+   Zwraca -1, gdy serwer nie zna juz przesylania (restart albo eviction) i trzeba uzgodnic stan od nowa */
+static int apply_sack(const struct transfer *t, const char *ack_buf, int len, char *is_acked) {
+    uint64_t bitmap = 0;
+
+    if (t->extended) {
+        int code = get_transfer_error(t, ack_buf, len);
+        if (code == ERROR_UNKNOWN_TRANSFER) {
+            return -1;
+        }
+        if (code != 0) {
+            fail_transfer(t, code);
+        }
+        if (len != XACK_SIZE || memcmp(ack_buf, "XACK", MAGIC_SIZE) != 0 || get_u32(ack_buf + MAGIC_SIZE) != t->id) {
+            return 0;
+        }
+        ack_buf += MAGIC_SIZE + 4;
+    } else if (len != SR_ACK_SIZE) {
+        return 0;
+    }
+
+    int cumulative = (int)get_u32(ack_buf);
+    for (size_t i = 0; i < sizeof(bitmap); ++i) {
+        bitmap = (bitmap << 8) | (unsigned char)ack_buf[sizeof(uint32_t) + i];
+    }
+
+    for (int pkt = 0; pkt <= cumulative && pkt < t->packet_count; ++pkt) {
+        is_acked[pkt] = 1;
+    }
+    for (int k = 0; k < SACK_BITMAP_BITS; ++k) {
+        int pkt = cumulative + 1 + k;
+        if (pkt >= 0 && pkt < t->packet_count && (bitmap >> k) & 1) {
+            is_acked[pkt] = 1;
+        }
+    }
+    return 0;
+}
+
+static int is_group_acked(const struct transfer *t, const char *is_acked, int group) {
+    for (int pkt = group * t->fec_group; pkt < (group + 1) * t->fec_group && pkt < t->packet_count; ++pkt) {
+        if (!is_acked[pkt]) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+static void send_selective_repeat(int sock, struct sockaddr_in *server, struct transfer *t, int window, int rto_ms) {
+    char recv_buf[BSIZE];
+    char *is_acked = calloc(t->packet_count, 1);
+    double *sent_at = malloc(t->packet_count * sizeof(double));
+    int transmissions = 0;
+    int parity_packets = 0;
+    int retransmissions = 0;
+    int resyncs = 0;
+    int base = 0;
+    int next_pkt = 0;
+    double start_ms = now_ms();
+
+    if (is_acked == NULL || sent_at == NULL)
+        bailout("malloc()");
+
+    if (t->extended) {
+        sync_transfer(sock, server, t, rto_ms, is_acked);
+    }
+    while (base < t->packet_count && is_acked[base]) {
+        ++base;
+    }
+    next_pkt = base;
+
+    while (base < t->packet_count) {
+        while (next_pkt < t->packet_count && next_pkt < base + window) {
+            if (!is_acked[next_pkt]) {
+                send_packet(sock, server, t, next_pkt);
+                sent_at[next_pkt] = now_ms();
+                ++transmissions;
+            }
+            /* Parzystosc idzie zaraz za ostatnim fragmentem grupy, tylko przy pierwszym wyslaniu */
+            if (t->fec_group && ((next_pkt + 1) % t->fec_group == 0 || next_pkt + 1 == t->packet_count)
+                    && !is_group_acked(t, is_acked, next_pkt / t->fec_group)) {
+                send_parity(sock, server, t, next_pkt / t->fec_group);
+                ++parity_packets;
+            }
+            ++next_pkt;
+        }
+
+        double now = now_ms();
+        double wait_ms = rto_ms;
+        for (int pkt = base; pkt < next_pkt; ++pkt) {
+            if (!is_acked[pkt] && sent_at[pkt] + rto_ms - now < wait_ms) {
+                wait_ms = sent_at[pkt] + rto_ms - now;
+            }
+        }
+        if (wait_ms < 0) {
+            wait_ms = 0;
+        }
+
+        fd_set read_fds;
+        FD_ZERO(&read_fds);
+        FD_SET(sock, &read_fds);
+        struct timeval tv;
+        tv.tv_sec = (long)(wait_ms / 1000);
+        tv.tv_usec = (long)((wait_ms - tv.tv_sec * 1000) * 1000);
+
+        int ready = select(sock + 1, &read_fds, NULL, NULL, &tv);
+        if (ready < 0 && errno != EINTR) {
+            bailout("select()");
+        }
+        if (ready > 0) {
+            int recv_len;
+            int lost = 0;
+            while ((recv_len = recv(sock, recv_buf, BSIZE, MSG_DONTWAIT)) > 0) {
+                if (apply_sack(t, recv_buf, recv_len, is_acked) < 0) {
+                    lost = 1;
+                }
+            }
+            if (recv_len < 0 && errno != EAGAIN && errno != EWOULDBLOCK) {
+                bailout("recv()");
+            }
+            if (lost) {
+                if (++resyncs > MAX_RESYNCS) {
+                    fprintf(stderr, "Server lost transfer %u %d times, giving up\n", t->id, MAX_RESYNCS);
+                    exit(1);
+                }
+                printf("Server does not know transfer %u, negotiating it again...\n", t->id);
+                sync_transfer(sock, server, t, rto_ms, is_acked);
+                base = 0;
+                next_pkt = 0;
+            }
+            while (base < t->packet_count && is_acked[base]) {
+                ++base;
+            }
+            if (lost) {
+                next_pkt = base;
+                continue;
+            }
+        }
+
+        now = now_ms();
+        for (int pkt = base; pkt < next_pkt; ++pkt) {
+            if (!is_acked[pkt] && now - sent_at[pkt] >= rto_ms) {
+                printf("Timeout occurred! Resending packet %d...\n", pkt);
+                send_packet(sock, server, t, pkt);
+                sent_at[pkt] = now;
+                ++transmissions;
+                ++retransmissions;
+            }
+        }
+    }
+
+    double elapsed_ms = now_ms() - start_ms;
+    printf("Selective repeat: window %d, %d packets, %d transmissions (%d retransmissions), %.1f ms, %.1f KB/s\n",
+           window, t->packet_count, transmissions, retransmissions, elapsed_ms,
+           t->size / elapsed_ms);
+    printf("STATS bytes=%zu packets=%d window=%d fec_group=%d transmissions=%d retransmissions=%d parity=%d "
+           "elapsed_ms=%.1f goodput_kbps=%.1f\n",
+           t->size, t->packet_count, window, t->fec_group, transmissions, retransmissions, parity_packets,
+           elapsed_ms, t->size * 8 / elapsed_ms);
+    free(is_acked);
+    free(sent_at);
+}
+
+static void usage(const char *prog) {
+    fprintf(stderr, "Usage: %s [-w window] [-t rto_ms] [-d startup_delay_s] [-x [-s size] [-c chunk] [-i id] [-f group]] [server_ip] [port]\n", prog);
+    fprintf(stderr, "  -w N  selective repeat with window N (1..%d); without -w stop-and-wait is used\n", MAX_WINDOW);
+    fprintf(stderr, "  -x    extended protocol: negotiate size with XSTR, then selective repeat (default window %d)\n", DEFAULT_WINDOW);
+    fprintf(stderr, "  -s N  file size in bytes for -x (default %d)\n", DATA_SIZE);
+    fprintf(stderr, "  -c N  chunk size in bytes for -x (1..%d, default %d)\n", MAX_CHUNK_SIZE, DATA_PER_PACKET);
+    fprintf(stderr, "  -i N  transfer id for -x (default derived from pid and time)\n");
+    fprintf(stderr, "  -f K  FEC for -x: XOR parity after every K chunks (%d..%d, server may lower it)\n", MIN_FEC_GROUP, MAX_FEC_GROUP);
+    exit(2);
+}
+
+int main(int argc, char *argv[]) {
+    int sock = 0;
+    struct sockaddr_in server;
+    struct hostent *hp = NULL;
+
+    char *server_ip = DEFAULT_SRV_IP;
+    int server_port = DEFAULT_PORT;
+    int window = 0;
+    int rto_ms = TIMEOUT_S;
+    int startup_delay_s = DEFAULT_STARTUP_DELAY_S;
+    int extended = 0;
+    int fec_group = 0;
+    long long file_size = DATA_SIZE;
+    int chunk_size = DATA_PER_PACKET;
+    uint32_t transfer_id = (uint32_t)getpid() ^ (uint32_t)time(NULL);
+
+    const char RANDOM_LETTER_POOL[] = {'R','E','G','G','I','N'};
+    char *data;
+
+    int opt;
+    while ((opt = getopt(argc, argv, "w:t:d:xs:c:i:f:")) != -1) {
+        switch (opt) {
+        case 'w':
+            window = atoi(optarg);
+            if (window < 1 || window > MAX_WINDOW)
+                usage(argv[0]);
+            break;
+        case 't':
+            rto_ms = atoi(optarg);
+            if (rto_ms < 1)
+                usage(argv[0]);
+            break;
+        case 'd':
+            startup_delay_s = atoi(optarg);
+            break;
+        case 'x':
+            extended = 1;
+            break;
+        case 's':
+            file_size = atoll(optarg);
+            if (file_size < 1)
+                usage(argv[0]);
+            break;
+        case 'c':
+            chunk_size = atoi(optarg);
+            if (chunk_size < 1 || chunk_size > MAX_CHUNK_SIZE)
+                usage(argv[0]);
+            break;
+        case 'i':
+            transfer_id = (uint32_t)strtoul(optarg, NULL, 10);
+            break;
+        case 'f':
+            fec_group = atoi(optarg);
+            if (fec_group < MIN_FEC_GROUP || fec_group > MAX_FEC_GROUP)
+                usage(argv[0]);
+            break;
+        default:
+            usage(argv[0]);
+        }
+    }
+
+    if (startup_delay_s > 0) {
+        printf("Sleeping for %d seconds...\n", startup_delay_s);
+        sleep(startup_delay_s);
+    }
+
+    sock = socket(AF_INET, SOCK_DGRAM, 0);
+    if (sock == -1)
+        bailout("opening stream socket");
+
+    if (optind < argc)
+        server_ip = argv[optind];
+    if (optind + 1 < argc)
+        server_port = atoi(argv[optind + 1]);
+
+    memset(&server, 0, sizeof(server));
+    server.sin_family = AF_INET;
+    server.sin_port = htons(server_port);
+
+    if (inet_aton(server_ip, &server.sin_addr) == 0) {
+        hp = gethostbyname2( server_ip, AF_INET);
+        if (hp == NULL) {
+            fprintf(stderr, "%s: unknown host\n", server_ip);
+            exit(2);
+        }
+        memcpy( (char *) &server.sin_addr, (char *) hp->h_addr, hp->h_length);
+    }
+
+    printf("UDP Client started. Sending to %s:%d\n", server_ip, server_port);
+
+    if (!extended) {
+        file_size = DATA_SIZE;
+        chunk_size = DATA_PER_PACKET;
+    } else if (window == 0) {
+        window = DEFAULT_WINDOW;
+    }
+
+    data = malloc(file_size);
+    if (data == NULL)
+        bailout("malloc()");
+    for (long long i = 0; i < file_size; ++i) {
+        data[i] = RANDOM_LETTER_POOL[rand() % sizeof(RANDOM_LETTER_POOL)];
+    }
+    if (!extended) {
+        data[DATA_SIZE-1] = '\0';
+    }
+
+    unsigned char hash_digest[SHA256_DIGEST_LENGTH];
+    if (SHA256((const unsigned char *)data, (size_t)file_size, hash_digest) == NULL) {
+        fprintf(stderr, "SHA256 calculation failed.\n");
+        return 1;
+    }
+
+    struct transfer t = {
+        .data = data,
+        .size = (size_t)file_size,
+        .chunk_size = chunk_size,
+        .packet_count = (int)((file_size + chunk_size - 1) / chunk_size),
+        .extended = extended,
+        .id = transfer_id,
+        .digest = hash_digest,
+        .fec_group = extended ? fec_group : 0,
+    };
+
+    int status = FIN_OK;
+    if (window > 0) {
+        send_selective_repeat(sock, &server, &t, window, rto_ms);
+        if (extended) {
+            status = query_finish(sock, &server, &t, rto_ms);
+        }
+    } else {
+        send_stop_and_wait(sock, &server, data);
+    }
+
+    print_digest(hash_digest);
+    printf("Done\n");
+
+    free(data);
+    close(sock);
+    return status == FIN_MISMATCH ? 1 : 0;
+}
@@ -0,0 +1,234 @@
+import argparse
+import heapq
+import random
+import selectors
+import signal
+import socket
+import time
+
+LISTEN_HOST = "127.0.0.1"
+LISTEN_PORT = 9999
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8888
+
+MAX_DATAGRAM_SIZE = 65507
+SESSION_TIMEOUT_S = 60.0
+SWEEP_INTERVAL_S = 1.0
+
+class Impairment:
+    """Parametry psucia ruchu w jednym kierunku; prawdopodobieństwa z przedziału 0..1, czasy w sekundach"""
+
+    __slots__ = ('loss', 'delay', 'jitter', 'reorder', 'reorder_delay', 'duplicate')
+
+    def __init__(self, loss=0.0, delay=0.0, jitter=0.0, reorder=0.0, reorder_delay=0.0, duplicate=0.0):
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.duplicate = duplicate
+
+NO_IMPAIRMENT = Impairment()
+
+class ProxyStats:
+    __slots__ = ('received', 'forwarded', 'dropped', 'duplicated', 'reordered', 'sessions')
+
+    def __init__(self):
+        self.received = 0
+        self.forwarded = 0
+        self.dropped = 0
+        self.duplicated = 0
+        self.reordered = 0
+        self.sessions = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class Session:
+    """Klient widziany przez pośrednika: własne gniazdo do serwera, więc serwer rozróżnia klientów po porcie"""
+
+    __slots__ = ('client_addr', 'upstream', 'last_seen')
+
+    def __init__(self, client_addr, upstream, now):
+        self.client_addr = client_addr
+        self.upstream = upstream
+        self.last_seen = now
+
+class ImpairmentProxy:
+    """Pośrednik UDP między klientem a serwerem lab 3.
+
+    Każdy datagram jest losowo gubiony, opóźniany (z jitterem), przetrzymywany dłużej (zmiana kolejności)
+    albo powielany. Losowanie idzie z random.Random(seed), więc przebieg z tym samym ziarnem i tym samym
+    ruchem jest powtarzalny. Datagramy czekające na wysłanie leżą w kopcu uporządkowanym po czasie wysłania.
+    """
+
+    def __init__(self, listen_addr, server_addr, upstream_impairment, downstream_impairment=None, seed=None,
+                 session_timeout=SESSION_TIMEOUT_S):
+        self.server_addr = server_addr
+        self.upstream_impairment = upstream_impairment
+        self.downstream_impairment = downstream_impairment or upstream_impairment
+        self.random = random.Random(seed)
+        self.session_timeout = session_timeout
+        self.stats = ProxyStats()
+        self.sessions = {}
+        self.queue = []
+        self.sequence = 0
+        self.running = False
+        self.buffer = bytearray(MAX_DATAGRAM_SIZE)
+        self.selector = selectors.DefaultSelector()
+        self.listen_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listen_sock.bind(listen_addr)
+        self.listen_sock.setblocking(False)
+        self.selector.register(self.listen_sock, selectors.EVENT_READ, None)
+
+    @property
+    def address(self):
+        return self.listen_sock.getsockname()
+
+    def get_session(self, client_addr, now):
+        session = self.sessions.get(client_addr)
+        if session is None:
+            upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            upstream.connect(self.server_addr)
+            upstream.setblocking(False)
+            session = Session(client_addr, upstream, now)
+            self.sessions[client_addr] = session
+            self.selector.register(upstream, selectors.EVENT_READ, session)
+            self.stats.sessions += 1
+        session.last_seen = now
+        return session
+
+    def schedule(self, sock, addr, data, impairment, now):
+        """Losuje los datagramu i wstawia jego kopie do kolejki wysyłania"""
+        stats = self.stats
+        rng = self.random
+        stats.received += 1
+        if impairment.loss and rng.random() < impairment.loss:
+            stats.dropped += 1
+            return
+        copies = 1
+        if impairment.duplicate and rng.random() < impairment.duplicate:
+            copies = 2
+            stats.duplicated += 1
+        for _ in range(copies):
+            delay = impairment.delay
+            if impairment.jitter:
+                delay = max(0.0, delay + rng.uniform(-impairment.jitter, impairment.jitter))
+            if impairment.reorder and rng.random() < impairment.reorder:
+                delay += impairment.reorder_delay
+                stats.reordered += 1
+            self.sequence += 1
+            heapq.heappush(self.queue, (now + delay, self.sequence, sock, addr, data))
+
+    def flush(self, now):
+        """Wysyła datagramy, których czas już minął; zwraca czas do następnego albo None"""
+        queue = self.queue
+        while queue and queue[0][0] <= now:
+            _, _, sock, addr, data = heapq.heappop(queue)
+            try:
+                if addr is None:
+                    sock.send(data)
+                else:
+                    sock.sendto(data, addr)
+                self.stats.forwarded += 1
+            except OSError:
+                self.stats.dropped += 1
+        if queue:
+            return queue[0][0] - now
+        return None
+
+    def receive(self, sock, session, now):
+        try:
+            nbytes, addr = sock.recvfrom_into(self.buffer)
+        except (BlockingIOError, ConnectionRefusedError):
+            # ICMP port unreachable z serwera, który jeszcze nie wstał - pakiet i tak przepadł
+            return
+        data = bytes(self.buffer[:nbytes])
+        if session is None:
+            session = self.get_session(addr, now)
+            self.schedule(session.upstream, None, data, self.upstream_impairment, now)
+        else:
+            session.last_seen = now
+            self.schedule(self.listen_sock, session.client_addr, data, self.downstream_impairment, now)
+
+    def sweep(self, now):
+        """Zamyka gniazda klientów, od których dawno nic nie przyszło"""
+        for client_addr, session in list(self.sessions.items()):
+            if now - session.last_seen >= self.session_timeout:
+                self.close_session(client_addr)
+
+    def close_session(self, client_addr):
+        session = self.sessions.pop(client_addr)
+        self.selector.unregister(session.upstream)
+        session.upstream.close()
+
+    def serve_forever(self):
+        self.running = True
+        last_sweep = time.monotonic()
+        while self.running:
+            now = time.monotonic()
+            timeout = self.flush(now)
+            if timeout is None or timeout > SWEEP_INTERVAL_S:
+                timeout = SWEEP_INTERVAL_S
+            for key, _ in self.selector.select(timeout):
+                self.receive(key.fileobj, key.data, time.monotonic())
+            if now - last_sweep >= SWEEP_INTERVAL_S:
+                self.sweep(now)
+                last_sweep = now
+
+    def stop(self):
+        """Bezpieczne z innego wątku: pętla kończy się najpóźniej po SWEEP_INTERVAL_S"""
+        self.running = False
+
+    def close(self):
+        for client_addr in list(self.sessions):
+            self.close_session(client_addr)
+        self.selector.close()
+        self.listen_sock.close()
+
+def add_impairment_arguments(parser):
+    parser.add_argument('--loss', type=float, default=0.0, help='Prawdopodobieństwo zgubienia datagramu (0..1)')
+    parser.add_argument('--delay-ms', type=float, default=0.0, help='Stałe opóźnienie datagramu w ms')
+    parser.add_argument('--jitter-ms', type=float, default=0.0,
+                        help='Opóźnienie losowane równomiernie z delay-ms +/- jitter-ms')
+    parser.add_argument('--reorder', type=float, default=0.0,
+                        help='Prawdopodobieństwo przetrzymania datagramu dłużej, żeby wyprzedziły go następne')
+    parser.add_argument('--reorder-delay-ms', type=float, default=20.0,
+                        help='O ile dłużej jest przetrzymywany datagram wybrany do zmiany kolejności')
+    parser.add_argument('--duplicate', type=float, default=0.0, help='Prawdopodobieństwo wysłania datagramu dwa razy')
+
+def impairment_from_args(loss, delay_ms, jitter_ms, reorder, reorder_delay_ms, duplicate):
+    return Impairment(loss, delay_ms / 1000, jitter_ms / 1000, reorder, reorder_delay_ms / 1000, duplicate)
+
+def main():
+    parser = argparse.ArgumentParser(description='Pośrednik UDP psujący ruch między klientem a serwerem')
+    parser.add_argument('--listen-port', type=int, default=LISTEN_PORT, help='Port, na który łączą się klienci')
+    parser.add_argument('--server-host', default=SERVER_HOST)
+    parser.add_argument('--server-port', type=int, default=SERVER_PORT)
+    add_impairment_arguments(parser)
+    parser.add_argument('--direction', choices=['both', 'up', 'down'], default='both',
+                        help='Kierunek psucia: up - klient do serwera, down - serwer do klienta')
+    parser.add_argument('--seed', type=int, help='Ziarno losowania (domyślnie losowe)')
+    args = parser.parse_args()
+
+    impairment = impairment_from_args(args.loss, args.delay_ms, args.jitter_ms, args.reorder, args.reorder_delay_ms,
+                                      args.duplicate)
+    upstream = impairment if args.direction in ('both', 'up') else NO_IMPAIRMENT
+    downstream = impairment if args.direction in ('both', 'down') else NO_IMPAIRMENT
+    proxy = ImpairmentProxy((LISTEN_HOST, args.listen_port), (args.server_host, args.server_port), upstream,
+                            downstream, args.seed)
+    print(f"Impairment proxy listening on {LISTEN_HOST}:{args.listen_port}, forwarding to "
+          f"{args.server_host}:{args.server_port}")
+    signal.signal(signal.SIGTERM, lambda signum, frame: proxy.stop())
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.close()
+        print("Proxy stats: " + " ".join(f"{name}={value}" for name, value in proxy.stats.as_dict().items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from udp_server import (FEC_GROUP_STRUCT, FIN_OK, FLAG_DIGEST, FLAG_FEC, HASH_BLOCK_SIZE, XDAT_MAGIC, XDAT_STRUCT,
+                        XFIN_MAGIC, XFIN_STRUCT, XMAP_STRUCT, XPAR_MAGIC, XPAR_STRUCT, XSOK_MAGIC, XSOK_STRUCT,
+                        XSTR_MAGIC, XSTR_STRUCT, TransferTable, advance_hashing, handle_bitmap_request, handle_data,
+                        handle_finish_request, handle_start)
+
+ADDR = ("127.0.0.1", 40000)
+TRANSFER_ID = 7
+CHUNK_SIZE = 1000
+MEMORY_BUDGET = 1024 * 1024
+IDLE_TIMEOUT_S = 30.0
+
+class FakeSocket:
+    """Zbiera odpowiedzi serwera zamiast wysyłać je w sieć"""
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append(bytes(data))
+
+def make_chunks(file_bytes):
+    return [file_bytes[i:i + CHUNK_SIZE] for i in range(0, len(file_bytes), CHUNK_SIZE)]
+
+def make_parity(chunks):
+    value = 0
+    for chunk in chunks:
+        value ^= int.from_bytes(chunk, 'little')
+    return value.to_bytes(CHUNK_SIZE, 'little')
+
+class Client:
+    """Buduje datagramy protokołu rozszerzonego i podaje je prosto do funkcji obsługi serwera"""
+
+    def __init__(self, transfers):
+        self.sock = FakeSocket()
+        self.transfers = transfers
+
+    def start(self, file_size, fec_group=0, digest=None):
+        flags = (FLAG_FEC if fec_group else 0) | (FLAG_DIGEST if digest else 0)
+        datagram = XSTR_STRUCT.pack(XSTR_MAGIC, TRANSFER_ID, file_size, CHUNK_SIZE, flags)
+        if digest:
+            datagram += digest
+        if fec_group:
+            datagram += FEC_GROUP_STRUCT.pack(fec_group)
+        handle_start(self.sock, ADDR, memoryview(datagram), len(datagram), self.transfers)
+        return self.sock.sent[-1][:4] == XSOK_MAGIC
+
+    def send_data(self, packet_id, chunk):
+        datagram = XDAT_STRUCT.pack(XDAT_MAGIC, TRANSFER_ID, packet_id) + chunk
+        handle_data(self.sock, ADDR, memoryview(datagram), len(datagram), TRANSFER_ID, packet_id, self.transfers, 0)
+
+    def send_parity(self, group, parity):
+        datagram = XPAR_STRUCT.pack(XPAR_MAGIC, TRANSFER_ID, group) + parity
+        handle_data(self.sock, ADDR, memoryview(datagram), len(datagram), TRANSFER_ID, group, self.transfers, 0,
+                    True)
+
+    def fetch_bitmap(self):
+        handle_bitmap_request(self.sock, ADDR, TRANSFER_ID, 0, self.transfers, 0)
+        return self.sock.sent[-1][XMAP_STRUCT.size:]
+
+    def finish(self):
+        """Wynik XFIN albo None, gdy serwer jeszcze milczy"""
+        sent = len(self.sock.sent)
+        handle_finish_request(self.sock, ADDR, TRANSFER_ID, self.transfers)
+        if len(self.sock.sent) == sent:
+            return None
+        return XFIN_STRUCT.unpack(self.sock.sent[-1])
+
+class FecTest(unittest.TestCase):
+    def setUp(self):
+        self.transfers = TransferTable(MEMORY_BUDGET, IDLE_TIMEOUT_S)
+        self.client = Client(self.transfers)
+        # Ostatni fragment krótszy - parzystość liczona z dopełnieniem zerami
+        self.file_bytes = os.urandom(7 * CHUNK_SIZE + 300)
+        self.chunks = make_chunks(self.file_bytes)
+
+    def get_transfer(self):
+        return self.transfers.active[(ADDR, TRANSFER_ID)]
+
+    def test_parity_recovers_single_missing_chunk(self):
+        self.assertTrue(self.client.start(len(self.file_bytes), fec_group=4))
+        transfer = self.get_transfer()
+        for packet_id in (0, 1, 3, 5):
+            self.client.send_data(packet_id, self.chunks[packet_id])
+        self.client.send_parity(0, make_parity(self.chunks[0:4]))
+        self.assertEqual(transfer.fec_recovered, 1)
+        # Przy trzech dziurach parzystość czeka, aż zostanie jedna
+        self.client.send_parity(1, make_parity(self.chunks[4:8]))
+        self.client.send_data(6, self.chunks[6])
+        self.assertIn(1, transfer.pending_parity)
+        self.client.send_data(4, self.chunks[4])
+        self.assertEqual(transfer.fec_recovered, 2)
+        self.assertNotIn((ADDR, TRANSFER_ID), self.transfers.active)
+        self.assertEqual(bytes(transfer.file_bytes), self.file_bytes)
+
+    def test_parity_recovers_short_last_chunk(self):
+        self.assertTrue(self.client.start(len(self.file_bytes), fec_group=4))
+        transfer = self.get_transfer()
+        for packet_id in range(7):
+            self.client.send_data(packet_id, self.chunks[packet_id])
+        self.client.send_parity(1, make_parity(self.chunks[4:8]))
+        self.assertEqual(transfer.fec_recovered, 1)
+        self.assertNotIn((ADDR, TRANSFER_ID), self.transfers.active)
+        self.assertEqual(bytes(transfer.file_bytes), self.file_bytes)
+
+    def test_resent_start_without_fec_drops_pending_parity(self):
+        self.assertTrue(self.client.start(len(self.file_bytes), fec_group=4))
+        self.client.send_parity(0, make_parity(self.chunks[0:4]))
+        self.assertTrue(self.client.start(len(self.file_bytes)))
+        transfer = self.get_transfer()
+        self.assertEqual(transfer.fec_group, 0)
+        self.assertFalse(transfer.pending_parity)
+        self.client.send_data(0, self.chunks[0])
+        self.assertEqual(transfer.missing, len(self.chunks) - 1)
+
+    def test_resent_start_with_other_group_drops_pending_parity(self):
+        self.assertTrue(self.client.start(len(self.file_bytes), fec_group=4))
+        self.client.send_parity(0, make_parity(self.chunks[0:4]))
+        self.assertTrue(self.client.start(len(self.file_bytes), fec_group=2))
+        for packet_id in (0, 2):
+            self.client.send_data(packet_id, self.chunks[packet_id])
+        # Stara parzystość grupy 0 (fragmenty 0-3) nie może odtworzyć fragmentu 1 z grupy 0 o rozmiarze 2
+        transfer = self.get_transfer()
+        self.assertEqual(transfer.fec_recovered, 0)
+        self.client.send_parity(0, make_parity(self.chunks[0:2]))
+        self.assertEqual(transfer.fec_recovered, 1)
+        self.assertEqual(bytes(transfer.file_bytes[:3 * CHUNK_SIZE]), self.file_bytes[:3 * CHUNK_SIZE])
+
+    def test_resent_start_with_same_group_keeps_pending_parity(self):
+        self.assertTrue(self.client.start(len(self.file_bytes), fec_group=4))
+        self.client.send_parity(0, make_parity(self.chunks[0:4]))
+        self.assertTrue(self.client.start(len(self.file_bytes), fec_group=4))
+        self.assertIn(0, self.get_transfer().pending_parity)
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = tempfile.TemporaryDirectory()
+        self.file_bytes = os.urandom(5 * HASH_BLOCK_SIZE + 123)
+        self.chunks = make_chunks(self.file_bytes)
+        self.digest = hashlib.sha256(self.file_bytes).digest()
+
+    def tearDown(self):
+        self.storage.cleanup()
+
+    def restart_server(self):
+        return Client(TransferTable(MEMORY_BUDGET, IDLE_TIMEOUT_S, self.storage.name))
+
+    def test_resume_sends_bitmap_and_hashes_prefix_between_datagrams(self):
+        client = self.restart_server()
+        self.assertTrue(client.start(len(self.file_bytes), digest=self.digest))
+        for packet_id in range(len(self.chunks) - 1):
+            if packet_id != 3:
+                client.send_data(packet_id, self.chunks[packet_id])
+        client.transfers.evict((ADDR, TRANSFER_ID), "server restart")
+
+        client = self.restart_server()
+        self.assertTrue(client.start(len(self.file_bytes), digest=self.digest))
+        missing = XSOK_STRUCT.unpack(client.sock.sent[-1])[3]
+        self.assertEqual(missing, 2)
+        bitmap = client.fetch_bitmap()
+        received = [packet_id for packet_id in range(len(self.chunks)) if bitmap[packet_id >> 3] >> (packet_id & 7) & 1]
+        self.assertEqual(received, [packet_id for packet_id in range(len(self.chunks) - 1) if packet_id != 3])
+
+        client.send_data(3, self.chunks[3])
+        # Gotowy początek pliku to kilka bloków SHA-256 - nie haszujemy go w jednym kroku
+        self.assertIn((ADDR, TRANSFER_ID), client.transfers.lagging)
+        client.send_data(len(self.chunks) - 1, self.chunks[-1])
+        self.assertIsNone(client.finish())
+        steps = 0
+        while client.transfers.lagging:
+            advance_hashing(client.transfers)
+            steps += 1
+        self.assertGreater(steps, 1)
+        self.assertEqual(client.finish(), (XFIN_MAGIC, TRANSFER_ID, FIN_OK, self.digest))
+        with open(os.path.join(self.storage.name, f"{ADDR[0]}_{TRANSFER_ID}"), 'rb') as received_file:
+            self.assertEqual(received_file.read(), self.file_bytes)
+
+if __name__ == "__main__":
+    unittest.main()
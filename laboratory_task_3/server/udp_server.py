@@ -1,66 +1,677 @@
-import socket
-import struct
-import hashlib
-
-HOST = "0.0.0.0"
-PORT = 8888
-
-PAYLOAD_SIZE = 100
-PACKETS_NUM = 100
-FILE_SIZE = PAYLOAD_SIZE * PACKETS_NUM
-
-ACK_TEXT = "OK"
-ACK_BYTES = ACK_TEXT.encode("ascii")
-
-def process_packet(data):
-    if len(data) != 4 + PAYLOAD_SIZE:
-        print("Invalid packet length: ", len(data))
-        return None
-    number = struct.unpack(">i", data[:4])[0]
-    payload = data[4:4+PAYLOAD_SIZE]
-    if (number < 0 or number >= PACKETS_NUM):
-        print("Incorrect file index: ", number)
-        return None
-    
-    print("Packet recived #", number)
-    return number, payload
-
-def send_ok_response(sock, addr, packet_id):
-    response = struct.pack(">i", packet_id) + ACK_BYTES
-    sock.sendto(response, addr)
-
-def reconstruct_file_and_verify(file_bytes):
-    sha256_hash = hashlib.sha256(file_bytes).hexdigest()
-    print("SHA-256:", sha256_hash)
-
-def main():
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-        s.bind((HOST, PORT))
-        print(f"UDP server listening on {HOST}:{PORT}")
-
-        is_received = [False] * PACKETS_NUM
-        file_bytes = bytearray(FILE_SIZE)
-        while True:
-            data, addr = s.recvfrom(4 + PAYLOAD_SIZE)
-            if not data:
-                continue
-
-            result =  process_packet(data)
-            if result is None:
-                continue
-            packet_id, payload = result
-            start_i = PAYLOAD_SIZE*(packet_id)
-            end_i = start_i + PAYLOAD_SIZE
-            file_bytes[start_i:end_i] = payload
-            is_received[packet_id] = True
-
-            send_ok_response(s, addr, packet_id)
-
-            if all(is_received):
-                break
-        
-        reconstruct_file_and_verify(file_bytes)
-
-
-if __name__ == "__main__":
-    main()
+import argparse
+import mmap
+import os
+import socket
+import struct
+import hashlib
+import time
+from collections import OrderedDict
+
+HOST = "0.0.0.0"
+PORT = 8888
+
+PAYLOAD_SIZE = 100
+PACKETS_NUM = 100
+FILE_SIZE = PAYLOAD_SIZE * PACKETS_NUM
+
+ACK_TEXT = "OK"
+ACK_BYTES = ACK_TEXT.encode("ascii")
+
+SR_ACK_FORMAT = ">iQ"
+SACK_BITMAP_BITS = 64
+SR_LINGER_S = 2.0
+
+# Protokół rozszerzony: wiele przesyłań naraz przez jedno gniazdo, rozmiar negocjowany w XSTR
+MAX_DATAGRAM_SIZE = 65507
+XSTR_FORMAT = ">4sIQHH"  # magia, id przesyłania, rozmiar pliku, rozmiar fragmentu, flagi
+XSOK_FORMAT = ">4sIiiH"  # magia, id przesyłania, liczba pakietów, liczba brakujących, przyjęta grupa FEC
+XERR_FORMAT = ">4sIH"    # magia, id przesyłania, kod błędu
+XDAT_FORMAT = ">4sIi"    # magia, id przesyłania, indeks pakietu; dalej dane
+XACK_FORMAT = ">4sIiQ"   # magia, id przesyłania, skumulowany indeks, bitmapa SACK
+XMAP_FORMAT = ">4sIi"    # magia, id przesyłania, numer strony bitmapy; w odpowiedzi dalej strona
+XFIN_FORMAT = ">4sIB32s" # magia, id przesyłania, wynik weryfikacji, SHA-256 odebranego pliku
+XPAR_FORMAT = ">4sIi"    # magia, id przesyłania, numer grupy FEC; dalej XOR fragmentów grupy
+XSTR_MAGIC = b"XSTR"
+XSOK_MAGIC = b"XSOK"
+XERR_MAGIC = b"XERR"
+XDAT_MAGIC = b"XDAT"
+XACK_MAGIC = b"XACK"
+XMAP_MAGIC = b"XMAP"
+XFIN_MAGIC = b"XFIN"
+XPAR_MAGIC = b"XPAR"
+XSTR_STRUCT = struct.Struct(XSTR_FORMAT)
+XSOK_STRUCT = struct.Struct(XSOK_FORMAT)
+XERR_STRUCT = struct.Struct(XERR_FORMAT)
+XDAT_STRUCT = struct.Struct(XDAT_FORMAT)
+XACK_STRUCT = struct.Struct(XACK_FORMAT)
+XMAP_STRUCT = struct.Struct(XMAP_FORMAT)
+XFIN_STRUCT = struct.Struct(XFIN_FORMAT)
+XPAR_STRUCT = struct.Struct(XPAR_FORMAT)
+FEC_GROUP_STRUCT = struct.Struct(">H")
+SR_ACK_STRUCT = struct.Struct(SR_ACK_FORMAT)
+OK_ACK_STRUCT = struct.Struct(">i" + str(len(ACK_BYTES)) + "s")
+LEGACY_HEADER_STRUCT = struct.Struct(">i")
+XDAT_HEADER_SIZE = XDAT_STRUCT.size
+MAX_CHUNK_SIZE = MAX_DATAGRAM_SIZE - XDAT_HEADER_SIZE
+MAX_PACKETS_NUM = 2**31 - 1
+SACK_BITMAP_MASK = (1 << SACK_BITMAP_BITS) - 1
+SACK_WINDOW_BYTES = SACK_BITMAP_BITS // 8 + 1
+
+ERROR_INVALID_PARAMS = 1
+ERROR_NO_MEMORY = 2
+ERROR_UNKNOWN_TRANSFER = 3
+ERROR_NO_SPACE = 4
+
+# Flagi XSTR; FLAG_DIGEST - po nagłówku SHA-256 pliku, który serwer sprawdzi po ostatnim pakiecie
+FLAG_DIGEST = 0x0001
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+# FLAG_FEC - dalej (po skrócie) rozmiar grupy K: klient po każdych K fragmentach wysyła XPAR z ich XOR,
+# a serwer odtwarza z niego jeden zgubiony fragment grupy bez retransmisji
+FLAG_FEC = 0x0002
+MIN_FEC_GROUP_SIZE = 2
+MAX_FEC_GROUP_SIZE = 64
+MAX_PENDING_PARITY = 256  # parzystości grup z więcej niż jedną dziurą czekające na retransmisję
+
+# Wynik w XFIN - klient pyta o niego (XFIN z zarezerwowanym polem 0) po potwierdzeniu wszystkich pakietów
+FIN_OK = 0
+FIN_MISMATCH = 1
+FIN_UNCHECKED = 2
+
+# Przesyłania z --storage-dir: plik .part mapowany w pamięć i bitmapa odebranych pakietów w pliku .bitmap
+SIDECAR_STRUCT = struct.Struct(">4sQH")  # magia, rozmiar pliku, rozmiar fragmentu; dalej bitmapa
+SIDECAR_MAGIC = b"XBMP"
+PART_SUFFIX = ".part"
+BITMAP_SUFFIX = ".bitmap"
+BITMAP_PAGE_SIZE = 1024  # strona bitmapy w XMAP mieści się w jednym datagramie bez fragmentacji IP
+HASH_BLOCK_SIZE = 1024 * 1024
+
+TRANSFER_TIMEOUT_S = 30.0
+MEMORY_BUDGET_MB = 256
+SWEEP_INTERVAL_S = 1.0
+EVICTION_MIN_IDLE_S = 1.0
+
+# Bufory potwierdzeń wypełniane przez pack_into - serwer jest jednowątkowy
+sr_ack_buffer = bytearray(SR_ACK_STRUCT.size)
+xack_buffer = bytearray(XACK_STRUCT.size)
+ok_ack_buffer = bytearray(OK_ACK_STRUCT.size)
+
+def process_packet(view, nbytes, verbose):
+    if nbytes != 4 + PAYLOAD_SIZE:
+        print("Invalid packet length: ", nbytes)
+        return None
+    number = LEGACY_HEADER_STRUCT.unpack_from(view)[0]
+    if (number < 0 or number >= PACKETS_NUM):
+        print("Incorrect file index: ", number)
+        return None
+
+    if verbose:
+        print("Packet recived #", number)
+    return number
+
+def send_ok_response(sock, addr, packet_id):
+    OK_ACK_STRUCT.pack_into(ok_ack_buffer, 0, packet_id, ACK_BYTES)
+    sock.sendto(ok_ack_buffer, addr)
+
+def is_bit_set(bits, index):
+    return bits[index >> 3] >> (index & 7) & 1
+
+def get_cumulative_index(is_received, cumulative_index, packets_num):
+    """Ostatni indeks, do którego (włącznie) odebrano wszystkie pakiety; -1, gdy brak pierwszego"""
+    while cumulative_index + 1 < packets_num and is_bit_set(is_received, cumulative_index + 1):
+        cumulative_index += 1
+    return cumulative_index
+
+def get_sack_bitmap(is_received, cumulative_index):
+    """Bit k oznacza, że odebrano pakiet cumulative_index + 1 + k (spoza kolejności).
+
+    is_received to bitmapa little-endian (pakiet i - bit i & 7 bajtu i >> 3), więc okno 64 pakietów
+    wycinamy jednym int.from_bytes zamiast pętli po pakietach.
+    """
+    first = cumulative_index + 1
+    first_byte = first >> 3
+    window = int.from_bytes(is_received[first_byte:first_byte + SACK_WINDOW_BYTES], 'little')
+    return window >> (first & 7) & SACK_BITMAP_MASK
+
+def build_sack_response(transfer):
+    bitmap = get_sack_bitmap(transfer.is_received, transfer.cumulative_index)
+    if transfer.transfer_id is None:
+        SR_ACK_STRUCT.pack_into(sr_ack_buffer, 0, transfer.cumulative_index, bitmap)
+        return sr_ack_buffer
+    XACK_STRUCT.pack_into(xack_buffer, 0, XACK_MAGIC, transfer.transfer_id, transfer.cumulative_index, bitmap)
+    return xack_buffer
+
+def send_error_response(sock, addr, transfer_id, code):
+    sock.sendto(XERR_STRUCT.pack(XERR_MAGIC, transfer_id, code), addr)
+
+def reconstruct_file_and_verify(transfer):
+    """Dokańcza SHA-256 liczony w trakcie odbioru i porównuje z oczekiwanym; zwraca (wynik FIN_*, skrót)"""
+    tail_size = transfer.file_size - transfer.hashed_size
+    digest = transfer.finish_hash()
+    print("SHA-256:", digest.hex(), f"({tail_size} bytes hashed after the last packet)")
+    if transfer.expected_digest is None:
+        return FIN_UNCHECKED, digest
+    if digest != transfer.expected_digest:
+        print("SHA-256 mismatch, client expected:", transfer.expected_digest.hex())
+        return FIN_MISMATCH, digest
+    return FIN_OK, digest
+
+def describe_transfer(key):
+    (host, port), transfer_id = key
+    if transfer_id is None:
+        return f"{host}:{port}"
+    return f"{host}:{port} #{transfer_id}"
+
+class Transfer:
+    """Stan jednego przesyłania - bufor pliku, odebrane pakiety i skumulowany indeks.
+
+    transfer_id None oznacza klienta bez XSTR (stały rozmiar PACKETS_NUM x PAYLOAD_SIZE).
+    """
+
+    __slots__ = ('transfer_id', 'file_size', 'chunk_size', 'packets_num', 'is_received', 'file_bytes',
+                 'file_view', 'missing', 'cumulative_index', 'last_activity', 'hasher', 'hashed_size',
+                 'expected_digest', 'fec_group', 'pending_parity', 'fec_recovered')
+
+    def __init__(self, transfer_id, file_size, chunk_size):
+        self.transfer_id = transfer_id
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.packets_num = get_packets_num(file_size, chunk_size)
+        self.missing = self.packets_num
+        self.cumulative_index = -1
+        self.last_activity = time.monotonic()
+        self.hasher = hashlib.sha256()
+        self.hashed_size = 0
+        self.expected_digest = None
+        self.fec_group = 0
+        self.pending_parity = OrderedDict()
+        self.fec_recovered = 0
+        self.open_storage()
+
+    def open_storage(self):
+        self.is_received = bytearray(get_bitmap_size(self.packets_num))
+        self.file_bytes = bytearray(self.file_size)
+        self.file_view = memoryview(self.file_bytes)
+
+    @property
+    def memory_size(self):
+        return self.file_size + len(self.is_received)
+
+    @property
+    def complete(self):
+        return self.missing == 0
+
+    def store(self, packet_id, view, start, end):
+        """Kopiuje fragment view[start:end] do pliku; False, gdy indeks albo długość nie pasują"""
+        if packet_id < 0 or packet_id >= self.packets_num:
+            return False
+        start_i = packet_id * self.chunk_size
+        end_i = start_i + self.chunk_size
+        if end_i > self.file_size:
+            end_i = self.file_size
+        if end - start != end_i - start_i:
+            return False
+        mask = 1 << (packet_id & 7)
+        if not self.is_received[packet_id >> 3] & mask:
+            self.file_view[start_i:end_i] = view[start:end]
+            self.is_received[packet_id >> 3] |= mask
+            self.missing -= 1
+            if packet_id == self.cumulative_index + 1:
+                self.cumulative_index = get_cumulative_index(self.is_received, packet_id, self.packets_num)
+            self.update_hash()
+            if self.pending_parity and self.fec_group:
+                self.try_recover(packet_id // self.fec_group)
+        return True
+
+    def store_parity(self, group, view, start, end):
+        """XPAR: XOR fragmentów grupy (krótszy ostatni dopełniony zerami); False, gdy nie pasuje do przesyłania"""
+        if self.fec_group == 0 or group < 0 or group * self.fec_group >= self.packets_num:
+            return False
+        if end - start != self.chunk_size:
+            return False
+        self.pending_parity[group] = bytes(view[start:end])
+        if len(self.pending_parity) > MAX_PENDING_PARITY:
+            self.pending_parity.popitem(last=False)
+        self.try_recover(group)
+        return True
+
+    def try_recover(self, group):
+        """Odtwarza jedyny brakujący fragment grupy z parzystości; przy dwóch i więcej czeka na retransmisję"""
+        parity = self.pending_parity.get(group)
+        if parity is None:
+            return
+        first = group * self.fec_group
+        last = min(first + self.fec_group, self.packets_num)
+        missing = [packet_id for packet_id in range(first, last) if not is_bit_set(self.is_received, packet_id)]
+        if len(missing) > 1:
+            return
+        del self.pending_parity[group]
+        if not missing:
+            return
+
+        # XOR na liczbach little-endian - krótszy fragment to liczba z zerowymi starszymi bajtami
+        value = int.from_bytes(parity, 'little')
+        for packet_id in range(first, last):
+            if packet_id != missing[0]:
+                start_i = packet_id * self.chunk_size
+                value ^= int.from_bytes(self.file_view[start_i:min(start_i + self.chunk_size, self.file_size)], 'little')
+        start_i = missing[0] * self.chunk_size
+        size = min(start_i + self.chunk_size, self.file_size) - start_i
+        self.fec_recovered += 1
+        self.store(missing[0], value.to_bytes(self.chunk_size, 'little'), 0, size)
+
+    @property
+    def hash_backlog(self):
+        """Bajty ciągłego początku pliku, które jeszcze nie trafiły do SHA-256"""
+        return min((self.cumulative_index + 1) * self.chunk_size, self.file_size) - self.hashed_size
+
+    def update_hash(self):
+        """Dokłada do SHA-256 kolejny blok ciągłego początku pliku (bez dziur), gdy taki już jest.
+
+        Najwyżej jeden blok na pakiet - po wznowieniu długi gotowy początek dogania się stopniowo,
+        a resztę dokłada pętla serwera między datagramami (TransferTable.hash_step).
+        """
+        if self.hash_backlog >= HASH_BLOCK_SIZE:
+            self.hasher.update(self.file_view[self.hashed_size:self.hashed_size + HASH_BLOCK_SIZE])
+            self.hashed_size += HASH_BLOCK_SIZE
+
+    def finish_hash(self):
+        self.hasher.update(self.file_view[self.hashed_size:])
+        self.hashed_size = self.file_size
+        return self.hasher.digest()
+
+    def close(self, complete):
+        pass
+
+class MappedTransfer(Transfer):
+    """Przesyłanie zapisywane przez mmap prosto do pliku <path>.part, bitmapa odebranych pakietów w <path>.bitmap.
+
+    Oba pliki przetrwają restart serwera - kolejny XSTR z tymi samymi parametrami wznawia przesyłanie,
+    a klient dopytuje o bitmapę (XMAP) i wysyła tylko brakujące pakiety.
+    """
+
+    __slots__ = ('path', 'bitmap_map')
+
+    def __init__(self, transfer_id, file_size, chunk_size, path):
+        self.path = path
+        super().__init__(transfer_id, file_size, chunk_size)
+
+    def open_storage(self):
+        header = SIDECAR_STRUCT.pack(SIDECAR_MAGIC, self.file_size, self.chunk_size)
+        bitmap_size = get_bitmap_size(self.packets_num)
+        self.bitmap_map = open_mapped_file(self.path + BITMAP_SUFFIX, len(header) + bitmap_size)
+        if self.bitmap_map[:len(header)] != header:
+            # Najpierw zerujemy bitmapę, dopiero potem nagłówek - przerwana inicjalizacja nie udaje wznowienia
+            self.bitmap_map[:len(header)] = bytes(len(header))
+            self.bitmap_map[len(header):] = bytes(bitmap_size)
+            self.bitmap_map[:len(header)] = header
+        try:
+            self.file_bytes = open_mapped_file(self.path + PART_SUFFIX, self.file_size)
+        except OSError:
+            self.bitmap_map.close()
+            raise
+        self.file_view = memoryview(self.file_bytes)
+        self.is_received = memoryview(self.bitmap_map)[len(header):]
+
+        bitmap = bytes(self.is_received)
+        self.missing = self.packets_num - int.from_bytes(bitmap, 'little').bit_count()
+        full_bytes = len(bitmap) - len(bitmap.lstrip(b"\xff"))
+        self.cumulative_index = get_cumulative_index(self.is_received, min(full_bytes * 8, self.packets_num) - 1,
+                                                     self.packets_num)
+
+    @property
+    def memory_size(self):
+        return len(self.is_received)
+
+    def close(self, complete):
+        self.file_view.release()
+        self.is_received.release()
+        self.file_bytes.flush()
+        self.file_bytes.close()
+        self.bitmap_map.flush()
+        self.bitmap_map.close()
+        if complete:
+            os.replace(self.path + PART_SUFFIX, self.path)
+            os.remove(self.path + BITMAP_SUFFIX)
+
+def open_mapped_file(path, size):
+    """Otwiera (albo tworzy) plik o podanym rozmiarze z zarezerwowanym miejscem na dysku i mapuje go w pamięć"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, size)
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+def get_packets_num(file_size, chunk_size):
+    return (file_size + chunk_size - 1) // chunk_size
+
+def get_bitmap_size(packets_num):
+    return (packets_num + 7) // 8
+
+class TransferTable:
+    """Przesyłania w toku kluczowane (adres klienta, id przesyłania).
+
+    Kolejność w OrderedDict to kolejność ostatniej aktywności, więc przy przekroczeniu budżetu
+    pamięci i przy przeglądzie bezczynnych usuwamy od początku. Zakończone przesyłania pamiętamy
+    jeszcze przez SR_LINGER_S z ostatnim potwierdzeniem - to mogło zaginąć. W lagging są przesyłania
+    z zaległym SHA-256 (wznowione z długim gotowym początkiem), haszowane po bloku między datagramami.
+    """
+
+    def __init__(self, memory_budget, idle_timeout, storage_dir=None):
+        self.memory_budget = memory_budget
+        self.idle_timeout = idle_timeout
+        self.storage_dir = storage_dir
+        self.memory_used = 0
+        self.active = OrderedDict()
+        self.finished = OrderedDict()
+        self.lagging = OrderedDict()
+
+    def get(self, key, now):
+        transfer = self.active.get(key)
+        if transfer is not None:
+            transfer.last_activity = now
+            self.active.move_to_end(key)
+        return transfer
+
+    def get_storage_path(self, key):
+        """Plik przesyłania zależy od hosta i id, nie od portu - klient uruchomiony ponownie może wznowić"""
+        (host, _), transfer_id = key
+        return os.path.join(self.storage_dir, f"{host}_{transfer_id}")
+
+    def start(self, key, file_size, chunk_size, expected_digest=None, fec_group=0):
+        """Zwraca nowe (albo powtórnie zgłoszone) przesyłanie; None, gdy nie zmieści się w budżecie.
+
+        Z storage_dir przesyłania z XSTR trafiają do plików (MappedTransfer); OSError, gdy plików nie da się utworzyć.
+        """
+        transfer = self.get(key, time.monotonic())
+        if transfer is not None:
+            if transfer.file_size == file_size and transfer.chunk_size == chunk_size:
+                transfer.expected_digest = expected_digest
+                if transfer.fec_group != fec_group:
+                    # Parzystości zebrane przy innym podziale na grupy XOR-owałyby nie te fragmenty
+                    transfer.pending_parity.clear()
+                    transfer.fec_group = fec_group
+                return transfer
+            self.evict(key, "restarted with different parameters")
+
+        self.finished.pop(key, None)
+        storage_path = None
+        bitmap_size = get_bitmap_size(get_packets_num(file_size, chunk_size))
+        memory_size = file_size + bitmap_size
+        if self.storage_dir is not None and key[1] is not None:
+            storage_path = self.get_storage_path(key)
+            memory_size = bitmap_size
+            for other_key, other in list(self.active.items()):
+                if isinstance(other, MappedTransfer) and other.path == storage_path:
+                    self.evict(other_key, "taken over by a new client port")
+        if memory_size > self.memory_budget:
+            return None
+        # Budżet zwalniamy kosztem przesyłań bezczynnych od EVICTION_MIN_IDLE_S; aktywnych nie wywłaszczamy,
+        # bo usunięty klient od razu zgłosiłby się ponownie i przesyłania wypychałyby się nawzajem
+        now = time.monotonic()
+        while self.memory_used + memory_size > self.memory_budget:
+            oldest_key, oldest = next(iter(self.active.items()))
+            if now - oldest.last_activity < EVICTION_MIN_IDLE_S:
+                return None
+            self.evict(oldest_key, "memory budget exceeded")
+
+        if storage_path is not None:
+            transfer = MappedTransfer(key[1], file_size, chunk_size, storage_path)
+        else:
+            transfer = Transfer(key[1], file_size, chunk_size)
+        transfer.expected_digest = expected_digest
+        transfer.fec_group = fec_group
+        self.active[key] = transfer
+        self.memory_used += memory_size
+        if transfer.hash_backlog >= HASH_BLOCK_SIZE:
+            self.lagging[key] = transfer
+        if transfer.missing < transfer.packets_num:
+            print(f"Transfer {describe_transfer(key)} resumed: {transfer.missing}/{transfer.packets_num} packets missing")
+        else:
+            print(f"Transfer {describe_transfer(key)} started: {file_size} bytes in {transfer.packets_num} packets "
+                  f"({len(self.active)} active, {self.memory_used} bytes buffered)")
+        return transfer
+
+    def evict(self, key, reason):
+        transfer = self.active.pop(key)
+        self.lagging.pop(key, None)
+        self.memory_used -= transfer.memory_size
+        transfer.close(False)
+        print(f"Transfer {describe_transfer(key)} evicted: {reason} "
+              f"({transfer.packets_num - transfer.missing}/{transfer.packets_num} packets received)")
+
+    def finish(self, key, response, fin_response):
+        transfer = self.active.pop(key)
+        self.lagging.pop(key, None)
+        self.memory_used -= transfer.memory_size
+        transfer.close(True)
+        self.finished[key] = (time.monotonic(), bytes(response) if response is not None else None, fin_response)
+
+    def hash_step(self):
+        """Jeden blok SHA-256 dla pierwszego przesyłania z lagging; zwraca (klucz, przesyłanie, czy dogoniło)"""
+        key, transfer = next(iter(self.lagging.items()))
+        self.get(key, time.monotonic())
+        transfer.update_hash()
+        if transfer.hash_backlog < HASH_BLOCK_SIZE:
+            del self.lagging[key]
+            return key, transfer, True
+        self.lagging.move_to_end(key)
+        return key, transfer, False
+
+    def sweep(self, now):
+        while self.active:
+            key, transfer = next(iter(self.active.items()))
+            if now - transfer.last_activity < self.idle_timeout:
+                break
+            self.evict(key, "idle timeout")
+        while self.finished:
+            key, (finished_at, _, _) = next(iter(self.finished.items()))
+            if now - finished_at < SR_LINGER_S:
+                break
+            del self.finished[key]
+
+def complete_transfer(transfers, key, transfer, response):
+    if transfer.hash_backlog >= HASH_BLOCK_SIZE:
+        # Zaległy SHA-256 dokańcza pętla serwera po bloku (advance_hashing); XFIN do tego czasu milczy
+        transfers.lagging[key] = transfer
+        return
+    print(f"Transfer {describe_transfer(key)} complete: {transfer.file_size} bytes in {transfer.packets_num} packets"
+          + (f", {transfer.fec_recovered} recovered by FEC" if transfer.fec_group else ""))
+    status, digest = reconstruct_file_and_verify(transfer)
+    fin_response = None
+    if transfer.transfer_id is not None:
+        fin_response = XFIN_STRUCT.pack(XFIN_MAGIC, transfer.transfer_id, status, digest)
+    transfers.finish(key, response, fin_response)
+
+def advance_hashing(transfers):
+    """Krok zaległego haszowania; przesyłanie kompletne, które właśnie dogoniło, jest zamykane"""
+    key, transfer, caught_up = transfers.hash_step()
+    if caught_up and transfer.complete:
+        complete_transfer(transfers, key, transfer, build_sack_response(transfer))
+
+def handle_start(sock, addr, view, nbytes, transfers):
+    if nbytes < XSTR_STRUCT.size:
+        return
+    _, transfer_id, file_size, chunk_size, flags = XSTR_STRUCT.unpack_from(view)
+    if (file_size == 0 or chunk_size == 0 or chunk_size > MAX_CHUNK_SIZE
+            or get_packets_num(file_size, chunk_size) > MAX_PACKETS_NUM):
+        send_error_response(sock, addr, transfer_id, ERROR_INVALID_PARAMS)
+        return
+    # Opcje po nagłówku w kolejności flag: skrót SHA-256, rozmiar grupy FEC
+    options_end = XSTR_STRUCT.size + (DIGEST_SIZE if flags & FLAG_DIGEST else 0) \
+        + (FEC_GROUP_STRUCT.size if flags & FLAG_FEC else 0)
+    if nbytes < options_end:
+        send_error_response(sock, addr, transfer_id, ERROR_INVALID_PARAMS)
+        return
+    offset = XSTR_STRUCT.size
+    expected_digest = None
+    if flags & FLAG_DIGEST:
+        expected_digest = bytes(view[offset:offset + DIGEST_SIZE])
+        offset += DIGEST_SIZE
+    fec_group = 0
+    if flags & FLAG_FEC:
+        fec_group = min(FEC_GROUP_STRUCT.unpack_from(view, offset)[0], MAX_FEC_GROUP_SIZE)
+        if fec_group < MIN_FEC_GROUP_SIZE:
+            send_error_response(sock, addr, transfer_id, ERROR_INVALID_PARAMS)
+            return
+
+    try:
+        transfer = transfers.start((addr, transfer_id), file_size, chunk_size, expected_digest, fec_group)
+    except OSError as e:
+        print(f"Transfer {describe_transfer((addr, transfer_id))} rejected: cannot create storage ({e})")
+        send_error_response(sock, addr, transfer_id, ERROR_NO_SPACE)
+        return
+    if transfer is None:
+        print(f"Transfer {describe_transfer((addr, transfer_id))} rejected: {file_size} bytes exceed memory budget")
+        send_error_response(sock, addr, transfer_id, ERROR_NO_MEMORY)
+        return
+    sock.sendto(XSOK_STRUCT.pack(XSOK_MAGIC, transfer_id, transfer.packets_num, transfer.missing, fec_group), addr)
+    if transfer.complete:
+        # Wszystkie pakiety były już na dysku - serwer przerwano przed zamknięciem przesyłania
+        complete_transfer(transfers, (addr, transfer_id), transfer, build_sack_response(transfer))
+
+def handle_bitmap_request(sock, addr, transfer_id, page, transfers, now):
+    """XMAP: strona bitmapy odebranych pakietów, żeby wznawiający klient wysłał tylko brakujące"""
+    transfer = transfers.get((addr, transfer_id), now)
+    if transfer is None:
+        send_error_response(sock, addr, transfer_id, ERROR_UNKNOWN_TRANSFER)
+        return
+    start_i = page * BITMAP_PAGE_SIZE
+    if page < 0 or start_i >= len(transfer.is_received):
+        send_error_response(sock, addr, transfer_id, ERROR_INVALID_PARAMS)
+        return
+    page_bytes = transfer.is_received[start_i:start_i + BITMAP_PAGE_SIZE]
+    sock.sendto(XMAP_STRUCT.pack(XMAP_MAGIC, transfer_id, page) + page_bytes, addr)
+
+def handle_finish_request(sock, addr, transfer_id, transfers):
+    """XFIN: wynik weryfikacji SHA-256; przesyłanie w toku jeszcze go nie ma, więc wtedy milczymy"""
+    finished = transfers.finished.get((addr, transfer_id))
+    if finished is not None:
+        sock.sendto(finished[2], addr)
+    elif (addr, transfer_id) not in transfers.active:
+        send_error_response(sock, addr, transfer_id, ERROR_UNKNOWN_TRANSFER)
+
+def handle_data(sock, addr, view, nbytes, transfer_id, packet_id, transfers, now, is_parity=False):
+    """Selective repeat: każdy pakiet (także duplikat i XPAR) potwierdzamy skumulowanym indeksem i bitmapą SACK"""
+    key = (addr, transfer_id)
+    transfer = transfers.get(key, now)
+    if transfer is None:
+        finished = transfers.finished.get(key)
+        if finished is not None:
+            sock.sendto(finished[1], addr)
+        else:
+            send_error_response(sock, addr, transfer_id, ERROR_UNKNOWN_TRANSFER)
+        return
+
+    if is_parity:
+        stored = transfer.store_parity(packet_id, view, XPAR_STRUCT.size, nbytes)
+    else:
+        stored = transfer.store(packet_id, view, XDAT_HEADER_SIZE, nbytes)
+    if not stored:
+        return
+    if transfer.hash_backlog >= HASH_BLOCK_SIZE:
+        # Zapełniona dziura odsłoniła długi gotowy początek pliku
+        transfers.lagging[key] = transfer
+    response = build_sack_response(transfer)
+    sock.sendto(response, addr)
+    if transfer.complete:
+        complete_transfer(transfers, key, transfer, response)
+
+def handle_legacy_packet(sock, addr, view, nbytes, mode, transfers, now, verbose):
+    """Pakiet klienta bez XSTR - jedno przesyłanie PACKETS_NUM x PAYLOAD_SIZE na adres"""
+    packet_id = process_packet(view, nbytes, verbose)
+    if packet_id is None:
+        return
+    key = (addr, None)
+    transfer = transfers.get(key, now)
+    if transfer is None:
+        finished = transfers.finished.get(key)
+        if finished is not None:
+            if mode == 'sr':
+                sock.sendto(finished[1], addr)
+            else:
+                send_ok_response(sock, addr, packet_id)
+            return
+        transfer = transfers.start(key, FILE_SIZE, PAYLOAD_SIZE)
+        if transfer is None:
+            return
+
+    transfer.store(packet_id, view, LEGACY_HEADER_STRUCT.size, nbytes)
+    if mode == 'sr':
+        response = build_sack_response(transfer)
+        sock.sendto(response, addr)
+    else:
+        response = None
+        send_ok_response(sock, addr, packet_id)
+    if transfer.complete:
+        complete_transfer(transfers, key, transfer, response)
+
+def serve(sock, mode, transfers, verbose=False):
+    """Pętla odbioru: datagram trafia do stałego bufora, a treść prosto do file_bytes przesyłania"""
+    buffer = bytearray(MAX_DATAGRAM_SIZE)
+    view = memoryview(buffer)
+    last_sweep = time.monotonic()
+    while True:
+        # Z zaległym haszowaniem nie czekamy na datagramy - blok SHA-256 wypełnia przerwy w ruchu
+        timeout = 0.0 if transfers.lagging else SWEEP_INTERVAL_S
+        if sock.gettimeout() != timeout:
+            sock.settimeout(timeout)
+        try:
+            nbytes, addr = sock.recvfrom_into(buffer)
+        except (socket.timeout, BlockingIOError):
+            nbytes = 0
+        now = time.monotonic()
+
+        if nbytes >= XDAT_HEADER_SIZE:
+            magic, transfer_id, packet_id = XDAT_STRUCT.unpack_from(buffer)
+            if magic == XDAT_MAGIC:
+                handle_data(sock, addr, view, nbytes, transfer_id, packet_id, transfers, now)
+            elif magic == XPAR_MAGIC:
+                handle_data(sock, addr, view, nbytes, transfer_id, packet_id, transfers, now, True)
+            elif magic == XSTR_MAGIC:
+                handle_start(sock, addr, view, nbytes, transfers)
+            elif magic == XMAP_MAGIC:
+                handle_bitmap_request(sock, addr, transfer_id, packet_id, transfers, now)
+            elif magic == XFIN_MAGIC:
+                handle_finish_request(sock, addr, transfer_id, transfers)
+            else:
+                handle_legacy_packet(sock, addr, view, nbytes, mode, transfers, now, verbose)
+        elif nbytes:
+            handle_legacy_packet(sock, addr, view, nbytes, mode, transfers, now, verbose)
+        if transfers.lagging:
+            advance_hashing(transfers)
+
+        if now - last_sweep >= SWEEP_INTERVAL_S:
+            transfers.sweep(now)
+            last_sweep = now
+
+def main():
+    parser = argparse.ArgumentParser(description='UDP file transfer server')
+    parser.add_argument('--mode', choices=['saw', 'sr'], default='saw',
+                        help='Potwierdzenia klientów bez XSTR: saw - stop-and-wait (ACK: indeks + "OK"), '
+                             'sr - selective repeat (ACK: >iQ z bitmapą SACK)')
+    parser.add_argument('--transfer-timeout', type=float, default=TRANSFER_TIMEOUT_S,
+                        help='Po tylu sekundach bez pakietu przesyłanie jest porzucane')
+    parser.add_argument('--memory-budget', type=int, default=MEMORY_BUDGET_MB,
+                        help='Łączny rozmiar buforów przesyłań w MiB; nowe przesyłanie wypiera najdłużej bezczynne, '
+                             'a gdy wszystkie są aktywne - jest odrzucane')
+    parser.add_argument('--storage-dir',
+                        help='Zapisuj przesyłania z XSTR do plików w tym katalogu (mmap); przerwane można wznowić po restarcie')
+    parser.add_argument('--verbose', action='store_true', help='Wypisuj każdy odebrany pakiet')
+    args = parser.parse_args()
+
+    if args.storage_dir is not None:
+        os.makedirs(args.storage_dir, exist_ok=True)
+    transfers = TransferTable(args.memory_budget * 1024 * 1024, args.transfer_timeout, args.storage_dir)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind((HOST, PORT))
+        print(f"UDP server listening on {HOST}:{PORT}")
+        serve(s, args.mode, transfers, args.verbose)
+
+
+if __name__ == "__main__":
+    main()
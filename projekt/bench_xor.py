@@ -0,0 +1,76 @@
+import argparse
+import os
+import random
+import time
+
+import proj_lib
+from proj_lib import xor_bytes, ShakeKeystream
+
+MIN_SIZE = 64
+MAX_SIZE = 64 * 1024 * 1024
+MIN_MEASURE_TIME_S = 0.2
+
+def xor_bytes_legacy(data, keystream):
+    return bytes(a ^ b for a, b in zip(data, keystream))
+
+def measure_mb_per_s(xor_function, data, keystream):
+    repetitions = 0
+    start_time = time.perf_counter()
+    elapsed_time = 0.0
+    while elapsed_time < MIN_MEASURE_TIME_S:
+        xor_function(data, keystream)
+        repetitions += 1
+        elapsed_time = time.perf_counter() - start_time
+    return len(data) * repetitions / elapsed_time / 1e6
+
+def get_sizes(max_size):
+    size = MIN_SIZE
+    while size <= max_size:
+        yield size
+        size *= 4
+
+def print_keystream_table(max_size):
+    """Generowanie strumienia klucza: random.Random (domyślny) i SHAKE-256 w trybie licznika (caps shake)"""
+    print(f"{'rozmiar [B]':>12} {'random [MB/s]':>14} {'shake [MB/s]':>13}")
+    random_keystream = random.Random(1)
+    shake_keystream = ShakeKeystream(1)
+    for size in get_sizes(max_size):
+        data = bytes(size)
+        random_speed = measure_mb_per_s(lambda data, keystream: random_keystream.randbytes(len(data)), data, data)
+        shake_speed = measure_mb_per_s(lambda data, keystream: shake_keystream.randbytes(len(data)), data, data)
+        print(f"{size:>12} {random_speed:>14.1f} {shake_speed:>13.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Mikrobenchmark szyfrowania XOR z proj_lib')
+    parser.add_argument('--max-size', type=int, default=MAX_SIZE, help='Największy rozmiar wiadomości w bajtach')
+    parser.add_argument('--skip-legacy-above', type=int, default=MAX_SIZE,
+                        help='Nie mierz starej wersji dla większych wiadomości (jest bardzo wolna)')
+    parser.add_argument('--no-numpy', action='store_true', help='Wymuś XOR na dużych liczbach całkowitych')
+    parser.add_argument('--keystream', action='store_true',
+                        help='Zamiast XOR zmierz generowanie strumienia klucza (random.Random i SHAKE-256)')
+    args = parser.parse_args()
+
+    if args.keystream:
+        print_keystream_table(args.max_size)
+        return
+
+    if args.no_numpy:
+        proj_lib.np = None
+
+    engine = "numpy" if proj_lib.np is not None else "int"
+    print(f"Silnik XOR: {engine} (numpy od {proj_lib.NUMPY_XOR_MIN_SIZE} B)")
+    print(f"{'rozmiar [B]':>12} {'przed [MB/s]':>14} {'po [MB/s]':>12} {'przyspieszenie':>15}")
+
+    for size in get_sizes(args.max_size):
+        data = os.urandom(size)
+        keystream = os.urandom(size)
+        after = measure_mb_per_s(xor_bytes, data, keystream)
+        if size <= args.skip_legacy_above:
+            assert xor_bytes(data, keystream) == xor_bytes_legacy(data, keystream)
+            before = measure_mb_per_s(xor_bytes_legacy, data, keystream)
+            print(f"{size:>12} {before:>14.1f} {after:>12.1f} {after / before:>14.1f}x")
+        else:
+            print(f"{size:>12} {'-':>14} {after:>12.1f} {'-':>15}")
+
+if __name__ == "__main__":
+    main()
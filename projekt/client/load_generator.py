@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from proj_lib import *
+from tcp_client import perform_handshake
+
+class SessionStats:
+    __slots__ = ('handshake_times', 'resumed_handshake_times', 'rtt_times', 'messages', 'bytes_sent',
+                 'bytes_received', 'errors')
+
+    def __init__(self):
+        self.handshake_times = []
+        self.resumed_handshake_times = []
+        self.rtt_times = []
+        self.messages = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.errors = {}
+
+    def add_error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+def summarize_ms(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) * 1000,
+        'p50': percentile(values, 0.50) * 1000,
+        'p99': percentile(values, 0.99) * 1000,
+        'p999': percentile(values, 0.999) * 1000,
+        'max': values[-1] * 1000,
+    }
+
+def open_session(host, port, timeout, stats, ticket=None, caps=0):
+    try:
+        sock = socket.create_connection((host, port), timeout=timeout)
+    except OSError:
+        stats.add_error('connect')
+        return None
+
+    handshake_start = time.perf_counter()
+    try:
+        session = perform_handshake(sock, ticket, caps)
+    except (RuntimeError, OSError):
+        stats.add_error('handshake')
+        sock.close()
+        return None
+    handshake_time = time.perf_counter() - handshake_start
+    if session.resumed:
+        stats.resumed_handshake_times.append(handshake_time)
+    else:
+        stats.handshake_times.append(handshake_time)
+    return session
+
+def generate_payload(kind, size):
+    if kind == 'text':
+        text = b"Hej, co slychac? Spotykamy sie o 18:00 przy wejsciu do biblioteki. "
+        return (text * (size // len(text) + 1))[:size]
+    return os.urandom(size)
+
+def exchange_messages(session, rate, size, deadline, stats, max_messages=0, payload_kind='random'):
+    """Wysyła ECHO_REQUEST do upływu deadline albo max_messages wiadomości (0 - bez limitu).
+
+    Zwraca True, gdy sesję zakończono poprawnie, False po błędzie.
+    """
+    interval = 1.0 / rate if rate > 0 else 0.0
+    next_send_time = time.perf_counter()
+    payload = generate_payload(payload_kind, size)
+    messages_sent = 0
+
+    while time.perf_counter() < deadline[0] and (max_messages == 0 or messages_sent < max_messages):
+        if interval:
+            delay = next_send_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_send_time += interval
+
+        send_time = time.perf_counter()
+        try:
+            send_encrypted_message(session, TYPE_ECHO_REQUEST, payload)
+            message = read_encrypted_message(session)
+        except socket.timeout:
+            stats.add_error('timeout')
+            return False
+        except OSError:
+            stats.add_error('connection')
+            return False
+        if message is None:
+            stats.add_error('closed_or_integrity')
+            return False
+        messages_sent += 1
+
+        msg_type, content = message
+        if msg_type != TYPE_ECHO_REPLY or content != payload:
+            stats.add_error('bad_reply')
+            continue
+
+        stats.rtt_times.append(time.perf_counter() - send_time)
+        stats.messages += 1
+        stats.bytes_sent += MESSAGE_HEADER_SIZE + size
+        stats.bytes_received += MESSAGE_HEADER_SIZE + len(content)
+
+    try:
+        send_encrypted_message(session, TYPE_END_SESSION, CONTENT_END_SESSION.encode())
+    except OSError:
+        pass
+    return True
+
+def run_session(host, port, args, start_barrier, deadline, stats):
+    caps = KEYSTREAM_CAPS[args.keystream] | COMPRESSION_CAPS[args.compression]
+    session = open_session(host, port, args.timeout, stats, caps=caps)
+    try:
+        start_barrier.wait()
+        while session is not None:
+            finished = exchange_messages(session, args.rate, args.size, deadline, stats, args.reconnect_after,
+                                         args.payload)
+            if not finished or time.perf_counter() >= deadline[0]:
+                break
+            ticket = session.ticket if args.resume else None
+            session.sock.close()
+            session = open_session(host, port, args.timeout, stats, ticket, caps)
+    finally:
+        if session is not None:
+            session.sock.close()
+
+def run_load(host, port, args):
+    all_stats = [SessionStats() for _ in range(args.sessions)]
+    deadline = [0.0]
+    measurement_start = [0.0]
+
+    def start_measurement():
+        measurement_start[0] = time.perf_counter()
+        deadline[0] = measurement_start[0] + args.duration
+
+    start_barrier = threading.Barrier(args.sessions, action=start_measurement)
+    threads = []
+    for stats in all_stats:
+        thread = threading.Thread(target=run_session, args=(host, port, args, start_barrier, deadline, stats))
+        thread.daemon = True
+        threads.append(thread)
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed_time = time.perf_counter() - measurement_start[0]
+
+    return build_report(args, all_stats, elapsed_time)
+
+def build_report(args, all_stats, elapsed_time):
+    handshake_times = []
+    resumed_handshake_times = []
+    rtt_times = []
+    errors = {}
+    messages = 0
+    bytes_sent = 0
+    bytes_received = 0
+    for stats in all_stats:
+        handshake_times.extend(stats.handshake_times)
+        resumed_handshake_times.extend(stats.resumed_handshake_times)
+        rtt_times.extend(stats.rtt_times)
+        messages += stats.messages
+        bytes_sent += stats.bytes_sent
+        bytes_received += stats.bytes_received
+        for kind, count in stats.errors.items():
+            errors[kind] = errors.get(kind, 0) + count
+
+    return {
+        'config': {
+            'sessions': args.sessions,
+            'rate_per_session': args.rate,
+            'message_size': args.size,
+            'duration_s': args.duration,
+            'reconnect_after': args.reconnect_after,
+            'resume': args.resume,
+            'keystream': args.keystream,
+            'compression': args.compression,
+            'payload': args.payload,
+        },
+        'elapsed_s': elapsed_time,
+        'established_sessions': len(handshake_times) + len(resumed_handshake_times),
+        'handshake_ms': summarize_ms(handshake_times),
+        'resumed_handshake_ms': summarize_ms(resumed_handshake_times),
+        'rtt_ms': summarize_ms(rtt_times),
+        'throughput': {
+            'messages': messages,
+            'messages_per_s': messages / elapsed_time if elapsed_time > 0 else 0.0,
+            'mb_per_s_sent': bytes_sent / elapsed_time / 1e6 if elapsed_time > 0 else 0.0,
+            'mb_per_s_received': bytes_received / elapsed_time / 1e6 if elapsed_time > 0 else 0.0,
+        },
+        'errors': errors,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generator obciążenia dla serwera czatu')
+    parser.add_argument('port', type=int)
+    parser.add_argument('--sessions', type=int, default=10, help='Liczba równoległych sesji')
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help='Wiadomości na sekundę na sesję (0 - tak szybko, jak się da)')
+    parser.add_argument('--size', type=int, default=64, help='Rozmiar treści wiadomości w bajtach')
+    parser.add_argument('--duration', type=float, default=10.0, help='Czas pomiaru w sekundach')
+    parser.add_argument('--timeout', type=float, default=5.0, help='Limit czasu operacji na gnieździe [s]')
+    parser.add_argument('--reconnect-after', type=int, default=0,
+                        help='Po tylu wiadomościach sesja łączy się ponownie (0 - jedno połączenie na cały pomiar)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Przy ponownym połączeniu wznów sesję ticketem zamiast pełnego handshake')
+    parser.add_argument('--keystream', choices=list(KEYSTREAM_CAPS), default='random',
+                        help='Strumień klucza negocjowany w handshake (shake wymaga serwera z HEL2)')
+    parser.add_argument('--compression', choices=list(COMPRESSION_CAPS), default='none',
+                        help='Kompresja treści negocjowana w handshake')
+    parser.add_argument('--payload', choices=['random', 'text'], default='random',
+                        help='random - losowe bajty (nieściśliwe), text - powtarzany tekst czatu')
+    parser.add_argument('--output', help='Plik wynikowy JSON (domyślnie standardowe wyjście)')
+    args = parser.parse_args()
+
+    host = os.getenv('SERVER_HOST', '127.0.0.1')
+    report = run_load(host, args.port, args)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -1,100 +1,175 @@
-import socket
-import struct
-import random
-import threading
-import argparse
-import os
-
-from proj_lib import *
-
-running = True
-
-def receive_loop(sock, prng_decoder, K):
-    """Wątek nasłuchujący wiadomości od serwera"""
-    global running
-    addr = "SERWER"
-    while running:
-        try:
-            if not recive_encrypted_message(sock, prng_decoder, K, addr):
-                log("\n[Info] Serwer zamknął połączenie lub błąd integralności.")
-                running = False
-                break
-        except Exception as e:
-            if running:
-                log(f"\n[Błąd Odbioru]: {e}")
-            break
-
-def simple_tcp_client(host: str, port: int):
-    global running
-
-    p = generate_cryptographically_safe_randint()
-    g = generate_cryptographically_safe_randint()
-    a_priv = generate_cryptographically_safe_randint()
-    A = pow(g, a_priv, p)
-
-    sock = None
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((host, port))
-        log(f"[Klient] Połączono z {host}:{port}")
-
-        packet = struct.pack('!4sQQQ', CLIENT_HELLO_SIGNATURE.encode(), p, g, A)
-        sock.sendall(packet)
-
-        expected_length = SERVER_HELLO_BYTE_SIZE
-        response_data = sock.recv(expected_length)
-        if len(response_data) < expected_length:
-            log("[Błąd] Niekompletny handshake")
-            return
-
-        resp_string, B = struct.unpack('!4sQ', response_data)
-        K = pow(B, a_priv, p)
-        log(f"[Klient] Wspólny klucz K={K}")
-        
-        seed_enc = get_derived_seed(K, "C2S")
-        seed_dec = get_derived_seed(K, "S2C")
-        
-        prng_encoder = random.Random(seed_enc)
-        prng_decoder = random.Random(seed_dec)
-
-        recv_thread = threading.Thread(target=receive_loop, args=(sock, prng_decoder, K))
-        recv_thread.daemon = True
-        recv_thread.start()
-
-        log("--- Rozpoczęto czat (wpisz ENDSSION aby wyjść) ---")
-
-        while running:
-            try:
-                message_text = input()
-                if not running: break
-
-                if message_text == CONTENT_END_SESSION:
-                    send_encrypted_message(sock, K, prng_encoder, TYPE_END_SESSION, CONTENT_END_SESSION.encode()) 
-                    running = False
-                    break
-                else:
-                    send_encrypted_message(sock, K, prng_encoder, TYPE_STANDARD_ENCRYPTED, message_text.encode())
-            except EOFError:
-                break
-
-    except ConnectionRefusedError:
-        log("[Błąd] Nie można połączyć się z serwerem.")
-    except Exception as e:
-        if "Errno 104" in str(e):
-            log(f"[Błąd] Serwer osiągął maksymalną liczbę połączeń.")
-        else:
-            log(f"[Błąd] Wyjątek: {e}")
-    finally:
-        running = False
-        if sock:
-            sock.close()
-        log("[Klient] Zakończono.")
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='TCP Client')
-    parser.add_argument('port', type=int)
-    args = parser.parse_args()
-    
-    host = os.getenv('SERVER_HOST', 'tcp_server')
-    
-    simple_tcp_client(host=host, port=args.port)
\ No newline at end of file
+import socket
+import struct
+import random
+import threading
+import argparse
+import os
+import secrets
+
+from proj_lib import *
+
+running = True
+
+FILE_COMMAND_PREFIX = "/file "
+
+def receive_loop(session):
+    """Wątek nasłuchujący wiadomości od serwera"""
+    global running
+    while running:
+        try:
+            if not recive_encrypted_message(session):
+                log("\n[Info] Serwer zamknął połączenie lub błąd integralności.")
+                running = False
+                break
+        except Exception as e:
+            if running:
+                log(f"\n[Błąd Odbioru]: {e}")
+            break
+
+def resume_handshake(sock, reader, ticket):
+    """Próba wznowienia sesji z ticketu (RSUM); zwraca sesję albo None, gdy serwer odpowie RSNO"""
+    ticket_id, ticket_K, ticket_caps = ticket
+    client_nonce = secrets.randbits(64)
+    sock.sendall(struct.pack(RESUME_HELLO_FORMAT, RESUME_HELLO_SIGNATURE.encode(), ticket_id, client_nonce))
+
+    resp_string, server_nonce = struct.unpack('!4sQ', reader.read_exactly(SERVER_HELLO_BYTE_SIZE))
+    if resp_string != RESUME_OK_SIGNATURE.encode():
+        return None
+
+    session_K = derive_resumed_key(ticket_K, client_nonce, server_nonce)
+    session = Session(sock, "SERWER", session_K, "C2S", "S2C", reader, ticket_caps)
+    session.ticket = ticket
+    session.resumed = True
+    return session
+
+def perform_handshake(sock, ticket=None, caps=0):
+    """Wymiana HELO/EHLO na połączonym gnieździe, zwraca gotową sesję.
+
+    Z podanym ticketem (ticket_id, K, caps) najpierw próbuje wznowić sesję bez Diffiego-Hellmana.
+    Niezerowe caps wysyła HEL2 z listą żądanych rozszerzeń, serwer odpowiada EHL2 z ich częścią wspólną.
+    """
+    reader = FrameReader(sock)
+    if ticket is not None:
+        session = resume_handshake(sock, reader, ticket)
+        if session is not None:
+            return session
+
+    p = generate_cryptographically_safe_randint()
+    g = generate_cryptographically_safe_randint()
+    a_priv = generate_cryptographically_safe_randint()
+    A = pow(g, a_priv, p)
+
+    if caps:
+        packet = struct.pack('!4sQQQI', CLIENT_HELLO_V2_SIGNATURE.encode(), p, g, A, caps | CAP_TICKET)
+        sock.sendall(packet)
+        response_data = reader.read_exactly(SERVER_HELLO_V2_BYTE_SIZE)
+        resp_string, B, caps = struct.unpack('!4sQI', response_data)
+        ticket_follows = caps & CAP_TICKET
+    else:
+        packet = struct.pack('!4sQQQ', CLIENT_HELLO_SIGNATURE.encode(), p, g, A)
+        sock.sendall(packet)
+        response_data = reader.read_exactly(SERVER_HELLO_BYTE_SIZE)
+        resp_string, B = struct.unpack('!4sQ', response_data)
+        ticket_follows = resp_string == SERVER_HELLO_TICKET_SIGNATURE.encode()
+
+    K = pow(B, a_priv, p)
+    session = Session(sock, "SERWER", K, "C2S", "S2C", reader, caps)
+
+    if ticket_follows:
+        message = read_encrypted_message(session)
+        if message is None:
+            raise RuntimeError("Ticket lost or corrupted")
+        msg_type, content = message
+        if msg_type == TYPE_TICKET:
+            session.ticket = (bytes(content), K, caps)
+    return session
+
+def open_client_session(host, port, caps=0, ticket=None, timeout=None):
+    """Łączy się i wykonuje handshake; serwer bez HEL2 zamyka połączenie, wtedy ponawia zwykłym HELO"""
+    sock = socket.create_connection((host, port), timeout=timeout)
+    try:
+        return perform_handshake(sock, ticket, caps)
+    except (RuntimeError, ConnectionError):
+        sock.close()
+        if not caps or ticket is not None:
+            raise
+    log("[Klient] Serwer nie obsługuje HEL2, ponawiam zwykłym HELO")
+    sock = socket.create_connection((host, port), timeout=timeout)
+    try:
+        return perform_handshake(sock)
+    except (RuntimeError, OSError):
+        sock.close()
+        raise
+
+def send_file(session, path):
+    try:
+        with open(path, 'rb') as source:
+            sent_size = send_chunked_message(session, TYPE_STANDARD_ENCRYPTED, source)
+    except OSError as e:
+        log(f"[Błąd] Nie można wysłać pliku {path}: {e}")
+        return
+    log(f"[Klient] Wysłano plik {path}: {sent_size} B")
+
+def simple_tcp_client(host: str, port: int, caps: int = 0):
+    global running
+
+    sock = None
+    try:
+        try:
+            session = open_client_session(host, port, caps)
+        except RuntimeError:
+            log("[Błąd] Niekompletny handshake")
+            return
+        sock = session.sock
+        log(f"[Klient] Połączono z {host}:{port}")
+        log(f"[Klient] Wspólny klucz K={session.K}")
+
+        recv_thread = threading.Thread(target=receive_loop, args=(session,))
+        recv_thread.daemon = True
+        recv_thread.start()
+
+        log("--- Rozpoczęto czat (wpisz ENDSSION aby wyjść, /file <ścieżka> aby wysłać plik strumieniowo) ---")
+
+        while running:
+            try:
+                message_text = input()
+                if not running: break
+
+                if message_text == CONTENT_END_SESSION:
+                    send_encrypted_message(session, TYPE_END_SESSION, CONTENT_END_SESSION.encode()) 
+                    running = False
+                    break
+                elif message_text.startswith(FILE_COMMAND_PREFIX):
+                    send_file(session, message_text[len(FILE_COMMAND_PREFIX):].strip())
+                else:
+                    send_encrypted_message(session, TYPE_STANDARD_ENCRYPTED, message_text.encode())
+            except EOFError:
+                break
+
+    except ConnectionRefusedError:
+        log("[Błąd] Nie można połączyć się z serwerem.")
+    except Exception as e:
+        if "Errno 104" in str(e):
+            log(f"[Błąd] Serwer osiągął maksymalną liczbę połączeń.")
+        else:
+            log(f"[Błąd] Wyjątek: {e}")
+    finally:
+        running = False
+        if sock:
+            sock.close()
+        log("[Klient] Zakończono.")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='TCP Client')
+    parser.add_argument('port', type=int)
+    parser.add_argument('--keystream', choices=list(KEYSTREAM_CAPS), default='random',
+                        help='random - random.Random (zgodny ze starym serwerem), '
+                             'shake - SHAKE-256 w trybie licznika, negocjowany przez HEL2')
+    parser.add_argument('--compression', choices=list(COMPRESSION_CAPS), default='none',
+                        help=f'Kompresja treści od {COMPRESSION_MIN_SIZE} B, negocjowana przez HEL2')
+    args = parser.parse_args()
+    
+    host = os.getenv('SERVER_HOST', 'tcp_server')
+    
+    caps = KEYSTREAM_CAPS[args.keystream] | COMPRESSION_CAPS[args.compression]
+    simple_tcp_client(host=host, port=args.port, caps=caps)
\ No newline at end of file
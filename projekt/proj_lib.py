@@ -1,107 +1,719 @@
-import struct
-import hashlib
-import hmac
-import sys
-import secrets
-
-MESSAGE_HMAC_SIZE = 28
-MESSAGE_TYPE_SIZE = 4
-MESSAGE_SIZE_SIZE = 8
-MESSAGE_HEADER_SIZE = MESSAGE_HMAC_SIZE + MESSAGE_TYPE_SIZE + MESSAGE_SIZE_SIZE
-
-TYPE_STANDARD_ENCRYPTED = 1
-TYPE_END_SESSION = 3
-TYPE_OK = 2
-
-CONTENT_END_SESSION = "ENDSSION"
-
-CLIENT_HELLO_BYTE_SIZE = 28
-SERVER_HELLO_BYTE_SIZE = 12
-CLIENT_HELLO_SIGNATURE = "HELO"
-SEVER_HELLO_SIGNATURE = "EHLO"
-
-MAX_RANDINT_EXCLUSIVE = 1_000_000
-
-def get_derived_seed(K, suffix):
-    raw = f"{K}_{suffix}".encode()
-    return int(hashlib.sha256(raw).hexdigest(), 16)
-
-def recv_exactly(conn, bytes_to_receive_count: int):
-    if bytes_to_receive_count == 0:
-        raise RuntimeError("Tried receiving 0 bytes")
-    data = b''
-    while len(data) < bytes_to_receive_count:
-        packet = conn.recv(bytes_to_receive_count - len(data))
-        if not packet:
-            raise RuntimeError("Connection lost; returned 0 bytes")
-        data += packet
-    return data
-
-def send_encrypted_message(sock, K, prng_encoder, message_type, encoded_message):
-    keystream_header = prng_encoder.randbytes(MESSAGE_HEADER_SIZE)
-    msg_size = len(encoded_message)
-    keystream_content = prng_encoder.randbytes(msg_size)
-    
-    encrypted_message = bytes(a ^ b for a, b in zip(encoded_message, keystream_content))
-    k_bytes = K.to_bytes((K.bit_length() + 7) // 8 or 1, byteorder='big')
-            
-    calculated_hmac = hmac.new(k_bytes, encrypted_message, hashlib.sha224).digest()
-    msg_header = struct.pack('!28sIQ', calculated_hmac, message_type, msg_size)
-    encrypted_header = bytes(a ^ b for a, b in zip(msg_header, keystream_header))
-    msg = encrypted_header + encrypted_message
-    
-    sock.sendall(msg)
-    
-def recive_encrypted_message(conn, prng_decoder, K, addr):
-    try:
-        encrypted_header = recv_exactly(conn, MESSAGE_HEADER_SIZE)
-    except RuntimeError:
-        return False
-        
-    if not encrypted_header:
-        return False
-
-    keystream_header = prng_decoder.randbytes(MESSAGE_HEADER_SIZE)
-    decrypted_header = bytes(a ^ b for a, b in zip(encrypted_header, keystream_header))
-
-    recv_hmac, msg_type, msg_size = struct.unpack('!28sIQ', decrypted_header)
-
-    if msg_size > 0:
-        encrypted_content = recv_exactly(conn, msg_size)
-        if not encrypted_content:
-            return False
-        
-        keystream_content = prng_decoder.randbytes(msg_size)
-        decrypted_content = bytes(a ^ b for a, b in zip(encrypted_content, keystream_content))
-    else:
-        decrypted_content = b''
-    
-    k_bytes = K.to_bytes((K.bit_length() + 7) // 8 or 1, byteorder='big')    
-    calculated_hmac = hmac.new(k_bytes, encrypted_content, hashlib.sha224).digest()
-
-    if hmac.compare_digest(calculated_hmac, recv_hmac):
-        if msg_type == TYPE_END_SESSION:
-            print(f"\n[{addr}] Otrzymano ENDSSION. Zamykanie.")
-            return False
-        elif msg_type == TYPE_STANDARD_ENCRYPTED:
-            try:
-                msg_text = decrypted_content.decode('utf-8').rstrip(chr(0))
-                print(f"\n[{addr}]: {msg_text}")
-            except BaseException as e:
-                print(f"\n[{addr}] Błąd dekodowania: {e}")
-            finally:
-                return True
-        elif msg_type == TYPE_OK:
-            print(f"[{addr}] Otrzymano potwierdzenie.")
-            return True
-    else:
-        print(f"\n[{addr}] BŁĄD INTEGRALNOŚCI! Odrzucono wiadomość.")
-        return False
-    return True
-
-def log(message):
-    sys.stdout.write(f"\r{message}\n> ")
-    sys.stdout.flush()
-    
-def generate_cryptographically_safe_randint() -> int:
+import asyncio
+import socket
+import struct
+import hashlib
+import hmac
+import sys
+import secrets
+import random
+import threading
+import time
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from proj_metrics import counter, histogram, timed
+
+MESSAGE_HMAC_SIZE = 28
+MESSAGE_TYPE_SIZE = 4
+MESSAGE_SIZE_SIZE = 8
+MESSAGE_HEADER_SIZE = MESSAGE_HMAC_SIZE + MESSAGE_TYPE_SIZE + MESSAGE_SIZE_SIZE
+
+TYPE_STANDARD_ENCRYPTED = 1
+TYPE_END_SESSION = 3
+TYPE_OK = 2
+TYPE_ECHO_REQUEST = 4
+TYPE_ECHO_REPLY = 5
+TYPE_TICKET = 6
+TYPE_CHUNKED = 7
+
+FLAG_COMPRESSED = 0x80000000
+
+CONTENT_END_SESSION = "ENDSSION"
+
+CLIENT_HELLO_BYTE_SIZE = 28
+SERVER_HELLO_BYTE_SIZE = 12
+CLIENT_HELLO_SIGNATURE = "HELO"
+SEVER_HELLO_SIGNATURE = "EHLO"
+SERVER_HELLO_TICKET_SIGNATURE = "EHLT"
+
+CLIENT_HELLO_V2_BYTE_SIZE = 32
+SERVER_HELLO_V2_BYTE_SIZE = 16
+CLIENT_HELLO_V2_SIGNATURE = "HEL2"
+SERVER_HELLO_V2_SIGNATURE = "EHL2"
+
+CAP_KEYSTREAM_SHAKE = 1 << 0
+CAP_TICKET = 1 << 1
+CAP_COMPRESS_ZLIB = 1 << 2
+CAP_COMPRESS_LZMA = 1 << 3
+KEYSTREAM_CAPS = {'random': 0, 'shake': CAP_KEYSTREAM_SHAKE}
+COMPRESSION_CAPS = {'none': 0, 'zlib': CAP_COMPRESS_ZLIB}
+if lzma is not None:
+    COMPRESSION_CAPS['lzma'] = CAP_COMPRESS_LZMA
+SUPPORTED_CAPS = CAP_KEYSTREAM_SHAKE | CAP_TICKET
+for compression_cap in COMPRESSION_CAPS.values():
+    SUPPORTED_CAPS |= compression_cap
+
+COMPRESSION_MIN_SIZE = 512
+LZMA_PRESET = 0
+COMPRESSION_ERRORS = (zlib.error, lzma.LZMAError) if lzma is not None else (zlib.error,)
+MAX_DECOMPRESSED_SIZE = 16 * 1024 * 1024
+
+RESUME_HELLO_SIGNATURE = "RSUM"
+RESUME_OK_SIGNATURE = "RSOK"
+RESUME_REJECT_SIGNATURE = "RSNO"
+RESUME_HELLO_FORMAT = '!4s16sQ'
+TICKET_ID_SIZE = 16
+
+MAX_RANDINT_EXCLUSIVE = 1_000_000
+
+NUMPY_XOR_MIN_SIZE = 1024
+SHAKE_KEYSTREAM_BLOCK_SIZE = 16 * 1024
+
+CHUNK_LENGTH_SIZE = 4
+CHUNKED_TRANSFER_CHUNK_SIZE = 64 * 1024
+CHUNKED_TRANSFER_MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+FRAME_READER_INITIAL_SIZE = 16 * 1024
+# Rozmiar z nagłówka jest odszyfrowany, ale jeszcze nieuwierzytelniony - większe ramki traktujemy jak błąd protokołu
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024
+FRAME_READER_MAX_IDLE_SIZE = 1024 * 1024
+
+SENDMSG_MAX_BUFFERS = 1024
+WRITE_QUEUE_FLUSH_THRESHOLD = 64 * 1024
+WRITE_QUEUE_MAX_DELAY_S = 0.0
+WRITE_QUEUE_MAX_BYTES = 1024 * 1024
+WRITE_QUEUE_BLOCK_TIMEOUT_S = 1.0
+
+OVERFLOW_DROP = "drop"
+OVERFLOW_DISCONNECT = "disconnect"
+OVERFLOW_BLOCK = "block"
+OVERFLOW_POLICIES = [OVERFLOW_DROP, OVERFLOW_DISCONNECT, OVERFLOW_BLOCK]
+
+XOR_TIME = histogram('projekt_xor_seconds', 'Czas szyfrowania XOR jednego bufora')
+HMAC_TIME = histogram('projekt_hmac_seconds', 'Czas liczenia HMAC jednej wiadomości')
+BYTES_IN = counter('projekt_bytes_received_total', 'Bajty odebrane we wszystkich sesjach')
+BYTES_OUT = counter('projekt_bytes_sent_total', 'Bajty wysłane (zakolejkowane) we wszystkich sesjach')
+INTEGRITY_FAILURES = counter('projekt_integrity_failures_total', 'Wiadomości odrzucone z powodu błędnego HMAC')
+DROPPED_FRAMES = counter('projekt_dropped_frames_total', 'Ramki pominięte przez politykę wolnego klienta')
+COMPRESSED_FRAMES = counter('projekt_compressed_frames_total', 'Ramki wysłane po kompresji')
+COMPRESSION_SAVED_BYTES = counter('projekt_compression_saved_bytes_total', 'Bajty zaoszczędzone przez kompresję')
+SLOW_CLIENT_DISCONNECTS = counter('projekt_slow_client_disconnects_total', 'Klienci rozłączeni przez politykę wolnego klienta')
+
+def get_derived_seed(K, suffix):
+    raw = f"{K}_{suffix}".encode()
+    return int(hashlib.sha256(raw).hexdigest(), 16)
+
+def derive_resumed_key(K, client_nonce, server_nonce):
+    """Klucz wznowionej sesji: K z ticketu wymieszany z nonce obu stron, bez potęgowania modularnego"""
+    return get_derived_seed(K, f"RSUM_{client_nonce}_{server_nonce}")
+
+def xor_bytes(data, keystream):
+    """XOR całych buforów naraz - wynik identyczny z bytes(a ^ b for a, b in zip(...))"""
+    size = min(len(data), len(keystream))
+    if size == 0:
+        return b''
+    with timed(XOR_TIME):
+        if np is not None and size >= NUMPY_XOR_MIN_SIZE:
+            return np.bitwise_xor(
+                np.frombuffer(data, dtype=np.uint8, count=size),
+                np.frombuffer(keystream, dtype=np.uint8, count=size)
+            ).tobytes()
+        if len(data) != size:
+            data = data[:size]
+        if len(keystream) != size:
+            keystream = keystream[:size]
+        return (int.from_bytes(data, 'big') ^ int.from_bytes(keystream, 'big')).to_bytes(size, 'big')
+
+class ShakeKeystream:
+    """Strumień klucza w trybie licznika: blok i = SHAKE-256(seed || i).
+
+    Ma ten sam interfejs randbytes co random.Random, ale dowolny fragment można policzyć od razu przez read_at.
+    """
+
+    __slots__ = ('seed_bytes', 'offset', 'cached_index', 'cached_block')
+
+    def __init__(self, seed):
+        self.seed_bytes = seed.to_bytes(32, 'big')
+        self.offset = 0
+        self.cached_index = -1
+        self.cached_block = b''
+
+    def _block(self, index):
+        if index != self.cached_index:
+            self.cached_block = hashlib.shake_256(self.seed_bytes + index.to_bytes(8, 'big')).digest(SHAKE_KEYSTREAM_BLOCK_SIZE)
+            self.cached_index = index
+        return self.cached_block
+
+    def read_at(self, offset, size):
+        if size == 0:
+            return b''
+        first_index, start = divmod(offset, SHAKE_KEYSTREAM_BLOCK_SIZE)
+        last_index = (offset + size - 1) // SHAKE_KEYSTREAM_BLOCK_SIZE
+        if first_index == last_index:
+            return self._block(first_index)[start:start + size]
+        blocks = b''.join([self._block(index) for index in range(first_index, last_index + 1)])
+        return blocks[start:start + size]
+
+    def randbytes(self, size):
+        data = self.read_at(self.offset, size)
+        self.offset += size
+        return data
+
+def create_keystream(seed, caps):
+    if caps & CAP_KEYSTREAM_SHAKE:
+        return ShakeKeystream(seed)
+    return random.Random(seed)
+
+def select_compression(caps):
+    """Kodek z wynegocjowanych caps; przy obu bitach wybieramy szybszy zlib"""
+    if caps & CAP_COMPRESS_ZLIB:
+        return CAP_COMPRESS_ZLIB
+    return caps & CAP_COMPRESS_LZMA
+
+def compress_payload(compression, data):
+    if compression == CAP_COMPRESS_ZLIB:
+        return zlib.compress(data)
+    return lzma.compress(data, preset=LZMA_PRESET)
+
+def decompress_payload(compression, data, max_size=MAX_DECOMPRESSED_SIZE):
+    """Dekompresja z limitem rozmiaru wyniku (ochrona przed bombą dekompresyjną); None przy błędzie lub przekroczeniu"""
+    try:
+        if compression == CAP_COMPRESS_ZLIB:
+            decompressor = zlib.decompressobj()
+            decompressed = decompressor.decompress(data, max_size)
+            complete = decompressor.eof and not decompressor.unconsumed_tail
+        else:
+            decompressor = lzma.LZMADecompressor()
+            decompressed = decompressor.decompress(data, max_length=max_size)
+            complete = decompressor.eof
+    except COMPRESSION_ERRORS:
+        return None
+    return decompressed if complete else None
+
+class FrameReader:
+    """Buforowany odczyt ramek: recv_into do rosnącego bytearray, wyniki jako memoryview.
+
+    Zwrócony memoryview jest ważny tylko do następnego wywołania read_exactly.
+    """
+
+    __slots__ = ('sock', 'buffer', 'start', 'end')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray(FRAME_READER_INITIAL_SIZE)
+        self.start = 0
+        self.end = 0
+
+    def read_exactly(self, bytes_to_receive_count: int):
+        if bytes_to_receive_count == 0:
+            raise RuntimeError("Tried receiving 0 bytes")
+        while self.end - self.start < bytes_to_receive_count:
+            self._fill(bytes_to_receive_count)
+        data = memoryview(self.buffer)[self.start:self.start + bytes_to_receive_count]
+        self.start += bytes_to_receive_count
+        return data
+
+    def _fill(self, bytes_needed):
+        buffered = self.end - self.start
+        if buffered == 0 and len(self.buffer) > FRAME_READER_MAX_IDLE_SIZE:
+            self.buffer = bytearray(FRAME_READER_INITIAL_SIZE)
+        if self.start + bytes_needed > len(self.buffer):
+            if bytes_needed > len(self.buffer):
+                new_buffer = bytearray(max(bytes_needed, 2 * len(self.buffer)))
+                new_buffer[:buffered] = self.buffer[self.start:self.end]
+                self.buffer = new_buffer
+            else:
+                self.buffer[:buffered] = self.buffer[self.start:self.end]
+            self.start = 0
+            self.end = buffered
+
+        with memoryview(self.buffer) as view:
+            received = self.sock.recv_into(view[self.end:])
+        if not received:
+            raise RuntimeError("Connection lost; returned 0 bytes")
+        self.end += received
+
+class Session:
+    """Stan jednej sesji szyfrowanej: gniazdo, oba PRNG i gotowy materiał klucza"""
+
+    __slots__ = ('sock', 'reader', 'write_queue', 'addr', 'K', 'k_bytes', 'hmac_template', 'prng_enc', 'prng_dec',
+                 'bytes_in', 'bytes_out', 'ticket', 'resumed', 'caps', 'compression')
+
+    def __init__(self, sock, addr, K, enc_suffix, dec_suffix, reader=None, caps=0):
+        self.sock = sock
+        self.reader = reader
+        self.write_queue = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.ticket = None
+        self.resumed = False
+        self.caps = caps
+        self.compression = select_compression(caps)
+        self.addr = addr
+        self.K = K
+        self.k_bytes = K.to_bytes((K.bit_length() + 7) // 8 or 1, byteorder='big')
+        self.hmac_template = hmac.new(self.k_bytes, digestmod=hashlib.sha224)
+        self.prng_enc = create_keystream(get_derived_seed(K, enc_suffix), caps)
+        self.prng_dec = create_keystream(get_derived_seed(K, dec_suffix), caps)
+
+    def compute_hmac(self, data):
+        with timed(HMAC_TIME):
+            calculated_hmac = self.hmac_template.copy()
+            calculated_hmac.update(data)
+            return calculated_hmac.digest()
+
+    def close(self, timeout=None):
+        if self.write_queue is not None:
+            self.write_queue.close(timeout)
+        self.sock.close()
+
+def sendmsg_all(sock, buffers):
+    """Wysyła bufory jednym wektorowym sendmsg (writev), dosyłając resztę po częściowym zapisie"""
+    pending = [memoryview(buffer) for buffer in buffers if len(buffer) > 0]
+    first = 0
+    while first < len(pending):
+        sent = sock.sendmsg(pending[first:first + SENDMSG_MAX_BUFFERS])
+        while sent > 0:
+            buffer_size = len(pending[first])
+            if sent >= buffer_size:
+                sent -= buffer_size
+                first += 1
+            else:
+                pending[first] = pending[first][sent:]
+                sent = 0
+
+def compress_message(session, message_type, encoded_message):
+    """(typ, treść) ramki po ewentualnej kompresji - jeszcze bez szyfrowania, więc kolejka zna rozmiar na łączu"""
+    # powyżej MAX_DECOMPRESSED_SIZE odbiorca odrzuciłby rozpakowaną treść, więc taką wysyłamy bez kompresji
+    if session.compression and COMPRESSION_MIN_SIZE <= len(encoded_message) <= MAX_DECOMPRESSED_SIZE:
+        compressed_message = compress_payload(session.compression, encoded_message)
+        if len(compressed_message) < len(encoded_message):
+            COMPRESSED_FRAMES.inc()
+            COMPRESSION_SAVED_BYTES.inc(len(encoded_message) - len(compressed_message))
+            return message_type | FLAG_COMPRESSED, compressed_message
+    return message_type, encoded_message
+
+def encrypt_frame_parts(session, message_type, encoded_message):
+    """Szyfruje treść po compress_message; zwraca (zaszyfrowany nagłówek, zaszyfrowana treść)"""
+    keystream_header = session.prng_enc.randbytes(MESSAGE_HEADER_SIZE)
+    msg_size = len(encoded_message)
+    keystream_content = session.prng_enc.randbytes(msg_size)
+    
+    encrypted_message = xor_bytes(encoded_message, keystream_content)
+    calculated_hmac = session.compute_hmac(encrypted_message)
+    msg_header = struct.pack('!28sIQ', calculated_hmac, message_type, msg_size)
+    encrypted_header = xor_bytes(msg_header, keystream_header)
+    session.bytes_out += MESSAGE_HEADER_SIZE + msg_size
+    BYTES_OUT.inc(MESSAGE_HEADER_SIZE + msg_size)
+    return encrypted_header, encrypted_message
+
+def encrypt_message_parts(session, message_type, encoded_message):
+    return encrypt_frame_parts(session, *compress_message(session, message_type, encoded_message))
+
+def build_encrypted_message(session, message_type, encoded_message):
+    encrypted_header, encrypted_message = encrypt_message_parts(session, message_type, encoded_message)
+    return encrypted_header + encrypted_message
+
+def send_encrypted_message(session, message_type, encoded_message):
+    if session.write_queue is not None:
+        return session.write_queue.enqueue(message_type, encoded_message)
+    sendmsg_all(session.sock, encrypt_message_parts(session, message_type, encoded_message))
+    return True
+
+class FrameWriteQueue:
+    """Ograniczona kolejka wyjściowa jednego połączenia z własnym wątkiem piszącym.
+
+    Ramki są szyfrowane w momencie dodania (kolejność strumienia klucza zgodna z kolejnością
+    na łączu) i wysyłane zbiorczo jednym sendmsg. Gdy w kolejce czeka już max_queued_bytes,
+    o losie nowej ramki decyduje overflow_policy: drop - ramka jest pomijana, disconnect -
+    klient jest rozłączany, block - czekamy do block_timeout, a potem rozłączamy.
+    """
+
+    def __init__(self, session, flush_threshold=WRITE_QUEUE_FLUSH_THRESHOLD, max_delay=WRITE_QUEUE_MAX_DELAY_S,
+                 max_queued_bytes=WRITE_QUEUE_MAX_BYTES, overflow_policy=OVERFLOW_BLOCK,
+                 block_timeout=WRITE_QUEUE_BLOCK_TIMEOUT_S):
+        self.session = session
+        self.flush_threshold = flush_threshold
+        self.max_delay = max_delay
+        self.max_queued_bytes = max_queued_bytes
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.buffers = []
+        self.queued_bytes = 0
+        self.inflight_bytes = 0
+        self.dropped_frames = 0
+        self.oldest_enqueue_time = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.send_lock = threading.Lock()
+        self.flush_thread = threading.Thread(target=self._flush_loop)
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+
+    def _has_room(self, frame_size):
+        pending_bytes = self.queued_bytes + self.inflight_bytes
+        return pending_bytes == 0 or pending_bytes + frame_size <= self.max_queued_bytes
+
+    def _disconnect(self):
+        self.closed = True
+        self.buffers = []
+        self.queued_bytes = 0
+        self.condition.notify_all()
+        try:
+            self.session.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def enqueue(self, message_type, encoded_message):
+        message_type, encoded_message = compress_message(self.session, message_type, encoded_message)
+        frame_size = MESSAGE_HEADER_SIZE + len(encoded_message)
+        with self.condition:
+            if self.closed:
+                return False
+            if not self._has_room(frame_size):
+                if self.overflow_policy == OVERFLOW_DROP:
+                    self.dropped_frames += 1
+                    DROPPED_FRAMES.inc()
+                    return False
+                if self.overflow_policy == OVERFLOW_BLOCK:
+                    deadline = time.monotonic() + self.block_timeout
+                    while not self.closed and not self._has_room(frame_size):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                    if self.closed:
+                        return False
+                if not self._has_room(frame_size):
+                    SLOW_CLIENT_DISCONNECTS.inc()
+                    self._disconnect()
+                    return False
+
+            encrypted_header, encrypted_message = encrypt_frame_parts(self.session, message_type, encoded_message)
+            self.buffers.append(encrypted_header)
+            self.buffers.append(encrypted_message)
+            self.queued_bytes += frame_size
+            if self.oldest_enqueue_time is None:
+                self.oldest_enqueue_time = time.monotonic()
+                self.condition.notify_all()
+            elif self.queued_bytes >= self.flush_threshold:
+                self.condition.notify_all()
+            return True
+
+    def flush(self):
+        with self.send_lock:
+            with self.condition:
+                batch = self.buffers
+                batch_bytes = self.queued_bytes
+                self.buffers = []
+                self.queued_bytes = 0
+                self.inflight_bytes += batch_bytes
+                self.oldest_enqueue_time = None
+            try:
+                if batch:
+                    sendmsg_all(self.session.sock, batch)
+            finally:
+                with self.condition:
+                    self.inflight_bytes -= batch_bytes
+                    self.condition.notify_all()
+
+    def depth(self):
+        return self.queued_bytes + self.inflight_bytes
+
+    def _should_wait(self):
+        if self.closed:
+            return False
+        if not self.buffers:
+            return True
+        if self.queued_bytes >= self.flush_threshold:
+            return False
+        return time.monotonic() - self.oldest_enqueue_time < self.max_delay
+
+    def _flush_loop(self):
+        while True:
+            with self.condition:
+                while self._should_wait():
+                    timeout = None
+                    if self.buffers:
+                        timeout = self.max_delay - (time.monotonic() - self.oldest_enqueue_time)
+                    self.condition.wait(timeout)
+                if self.closed and not self.buffers:
+                    return
+            try:
+                self.flush()
+            except OSError:
+                with self.condition:
+                    self._disconnect()
+                return
+
+    def close(self, timeout=None):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.flush_thread.join(timeout)
+        if self.flush_thread.is_alive():
+            try:
+                self.session.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+def encrypt_chunk_record(session, stream_hmac, chunk):
+    encrypted_length = xor_bytes(struct.pack('!I', len(chunk)), session.prng_enc.randbytes(CHUNK_LENGTH_SIZE))
+    encrypted_chunk = xor_bytes(chunk, session.prng_enc.randbytes(len(chunk))) if chunk else b''
+    stream_hmac.update(encrypted_length)
+    stream_hmac.update(encrypted_chunk)
+    session.bytes_out += CHUNK_LENGTH_SIZE + len(chunk)
+    BYTES_OUT.inc(CHUNK_LENGTH_SIZE + len(chunk))
+    return encrypted_length, encrypted_chunk
+
+def send_chunked_message(session, message_type, source, chunk_size=CHUNKED_TRANSFER_CHUNK_SIZE):
+    """Wysyła treść czytaną z obiektu plikowego source w kawałkach, bez trzymania całości w pamięci.
+
+    Na łączu: ramka TYPE_CHUNKED z typem właściwej wiadomości, rekordy [długość][dane], rekord o długości 0
+    i zaszyfrowany HMAC całego strumienia. Wysyła bezpośrednio na gniazdo, więc nie może przeplatać się
+    z innymi wysyłkami tej sesji. Zwraca liczbę wysłanych bajtów treści.
+    """
+    sendmsg_all(session.sock, encrypt_message_parts(session, TYPE_CHUNKED, struct.pack('!I', message_type)))
+    stream_hmac = session.hmac_template.copy()
+    total_size = 0
+    while True:
+        chunk = source.read(chunk_size)
+        records = encrypt_chunk_record(session, stream_hmac, chunk)
+        if not chunk:
+            break
+        sendmsg_all(session.sock, records)
+        total_size += len(chunk)
+    trailer = xor_bytes(stream_hmac.digest(), session.prng_enc.randbytes(MESSAGE_HMAC_SIZE))
+    session.bytes_out += MESSAGE_HMAC_SIZE
+    BYTES_OUT.inc(MESSAGE_HMAC_SIZE)
+    sendmsg_all(session.sock, [*records, trailer])
+    return total_size
+
+class StreamDigestSink:
+    """Odbiornik strumienia, który zamiast zapisywać liczy rozmiar i SHA-256 treści"""
+
+    __slots__ = ('size', 'digest')
+
+    def __init__(self):
+        self.size = 0
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.size += len(data)
+        self.digest.update(data)
+
+def decrypt_chunk_length(session, stream_hmac, encrypted_length):
+    stream_hmac.update(encrypted_length)
+    session.bytes_in += CHUNK_LENGTH_SIZE
+    BYTES_IN.inc(CHUNK_LENGTH_SIZE)
+    chunk_size, = struct.unpack('!I', xor_bytes(encrypted_length, session.prng_dec.randbytes(CHUNK_LENGTH_SIZE)))
+    return chunk_size
+
+def decrypt_chunk(session, stream_hmac, encrypted_chunk):
+    stream_hmac.update(encrypted_chunk)
+    session.bytes_in += len(encrypted_chunk)
+    BYTES_IN.inc(len(encrypted_chunk))
+    return decrypt_message_content(session, encrypted_chunk)
+
+def verify_stream_hmac(session, stream_hmac, encrypted_trailer):
+    session.bytes_in += MESSAGE_HMAC_SIZE
+    BYTES_IN.inc(MESSAGE_HMAC_SIZE)
+    recv_hmac = xor_bytes(encrypted_trailer, session.prng_dec.randbytes(MESSAGE_HMAC_SIZE))
+    if not hmac.compare_digest(stream_hmac.digest(), recv_hmac):
+        INTEGRITY_FAILURES.inc()
+        print(f"\n[{session.addr}] BŁĄD INTEGRALNOŚCI strumienia! Odebrane dane należy odrzucić.")
+        return False
+    return True
+
+def read_chunked_body(session, sink):
+    """Odbiera rekordy po ramce TYPE_CHUNKED i zapisuje odszyfrowane kawałki do sink (metoda write).
+
+    Kawałki trafiają do sink przed sprawdzeniem HMAC, który przychodzi na końcu - przy wyniku False
+    odbiorca musi odrzucić to, co zapisał. Zwraca False także przy zerwanym połączeniu lub za dużym kawałku.
+    """
+    stream_hmac = session.hmac_template.copy()
+    try:
+        while True:
+            chunk_size = decrypt_chunk_length(session, stream_hmac, session.reader.read_exactly(CHUNK_LENGTH_SIZE))
+            if chunk_size == 0:
+                break
+            if chunk_size > CHUNKED_TRANSFER_MAX_CHUNK_SIZE:
+                print(f"\n[{session.addr}] Za duży kawałek strumienia: {chunk_size} B")
+                return False
+            sink.write(decrypt_chunk(session, stream_hmac, session.reader.read_exactly(chunk_size)))
+        encrypted_trailer = session.reader.read_exactly(MESSAGE_HMAC_SIZE)
+    except RuntimeError:
+        return False
+    return verify_stream_hmac(session, stream_hmac, encrypted_trailer)
+
+async def read_chunked_body_async(session, reader, sink):
+    stream_hmac = session.hmac_template.copy()
+    try:
+        while True:
+            chunk_size = decrypt_chunk_length(session, stream_hmac, await reader.readexactly(CHUNK_LENGTH_SIZE))
+            if chunk_size == 0:
+                break
+            if chunk_size > CHUNKED_TRANSFER_MAX_CHUNK_SIZE:
+                print(f"\n[{session.addr}] Za duży kawałek strumienia: {chunk_size} B")
+                return False
+            sink.write(decrypt_chunk(session, stream_hmac, await reader.readexactly(chunk_size)))
+        encrypted_trailer = await reader.readexactly(MESSAGE_HMAC_SIZE)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return False
+    return verify_stream_hmac(session, stream_hmac, encrypted_trailer)
+
+def parse_chunked_header(session, decrypted_content):
+    if len(decrypted_content) != MESSAGE_TYPE_SIZE:
+        print(f"\n[{session.addr}] Nieprawidłowy nagłówek strumienia.")
+        return None
+    inner_type, = struct.unpack('!I', decrypted_content)
+    return inner_type
+
+def report_chunked_message(session, inner_type, sink):
+    print(f"\n[{session.addr}] Odebrano strumień (typ {inner_type}): {sink.size} B, sha256={sink.digest.hexdigest()}")
+    return True
+
+def decrypt_message_header(session, encrypted_header):
+    keystream_header = session.prng_dec.randbytes(MESSAGE_HEADER_SIZE)
+    decrypted_header = xor_bytes(encrypted_header, keystream_header)
+    return struct.unpack('!28sIQ', decrypted_header)
+
+def check_message_size(session, msg_size):
+    if msg_size > MAX_MESSAGE_SIZE:
+        print(f"\n[{session.addr}] Za duża ramka: {msg_size} B (limit {MAX_MESSAGE_SIZE} B). Odrzucono wiadomość.")
+        return False
+    return True
+
+def decrypt_message_content(session, encrypted_content):
+    if not encrypted_content:
+        return b''
+    keystream_content = session.prng_dec.randbytes(len(encrypted_content))
+    return xor_bytes(encrypted_content, keystream_content)
+
+def verify_message_hmac(session, encrypted_content, recv_hmac):
+    return hmac.compare_digest(session.compute_hmac(encrypted_content), recv_hmac)
+
+def inflate_message(session, msg_type, decrypted_content):
+    """Zdejmuje FLAG_COMPRESSED i rozpakowuje treść; None, gdy kompresji nie wynegocjowano lub treść jest błędna"""
+    if not msg_type & FLAG_COMPRESSED:
+        return msg_type, decrypted_content
+    if not session.compression:
+        print(f"\n[{session.addr}] Skompresowana ramka bez wynegocjowanej kompresji. Odrzucono wiadomość.")
+        return None
+    inflated_content = decompress_payload(session.compression, decrypted_content)
+    if inflated_content is None:
+        print(f"\n[{session.addr}] Błąd dekompresji lub treść większa niż {MAX_DECOMPRESSED_SIZE} B. Odrzucono wiadomość.")
+        return None
+    return msg_type & ~FLAG_COMPRESSED, inflated_content
+
+def process_decrypted_message(session, msg_type, decrypted_content):
+    addr = session.addr
+    if msg_type == TYPE_END_SESSION:
+        print(f"\n[{addr}] Otrzymano ENDSSION. Zamykanie.")
+        return False
+    elif msg_type == TYPE_STANDARD_ENCRYPTED:
+        try:
+            msg_text = decrypted_content.decode('utf-8').rstrip(chr(0))
+            print(f"\n[{addr}]: {msg_text}")
+        except BaseException as e:
+            print(f"\n[{addr}] Błąd dekodowania: {e}")
+        finally:
+            return True
+    elif msg_type == TYPE_OK:
+        print(f"[{addr}] Otrzymano potwierdzenie.")
+        return True
+    elif msg_type == TYPE_ECHO_REQUEST:
+        return send_encrypted_message(session, TYPE_ECHO_REPLY, decrypted_content)
+    return True
+
+def read_encrypted_message(session):
+    """Zwraca (msg_type, decrypted_content) albo None, gdy połączenie zerwano lub HMAC się nie zgadza"""
+    try:
+        encrypted_header = session.reader.read_exactly(MESSAGE_HEADER_SIZE)
+    except RuntimeError:
+        return None
+
+    recv_hmac, msg_type, msg_size = decrypt_message_header(session, encrypted_header)
+    if not check_message_size(session, msg_size):
+        return None
+
+    encrypted_content = b''
+    if msg_size > 0:
+        try:
+            encrypted_content = session.reader.read_exactly(msg_size)
+        except RuntimeError:
+            return None
+    decrypted_content = decrypt_message_content(session, encrypted_content)
+    session.bytes_in += MESSAGE_HEADER_SIZE + msg_size
+    BYTES_IN.inc(MESSAGE_HEADER_SIZE + msg_size)
+
+    if not verify_message_hmac(session, encrypted_content, recv_hmac):
+        INTEGRITY_FAILURES.inc()
+        print(f"\n[{session.addr}] BŁĄD INTEGRALNOŚCI! Odrzucono wiadomość.")
+        return None
+    return inflate_message(session, msg_type, decrypted_content)
+
+def recive_encrypted_message(session):
+    message = read_encrypted_message(session)
+    if message is None:
+        return False
+    msg_type, decrypted_content = message
+    if msg_type == TYPE_CHUNKED:
+        inner_type = parse_chunked_header(session, decrypted_content)
+        sink = StreamDigestSink()
+        if inner_type is None or not read_chunked_body(session, sink):
+            return False
+        return report_chunked_message(session, inner_type, sink)
+    return process_decrypted_message(session, msg_type, decrypted_content)
+
+async def recive_encrypted_message_async(session, reader):
+    try:
+        encrypted_header = await reader.readexactly(MESSAGE_HEADER_SIZE)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return False
+
+    recv_hmac, msg_type, msg_size = decrypt_message_header(session, encrypted_header)
+    if not check_message_size(session, msg_size):
+        return False
+
+    encrypted_content = b''
+    if msg_size > 0:
+        try:
+            encrypted_content = await reader.readexactly(msg_size)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return False
+    decrypted_content = decrypt_message_content(session, encrypted_content)
+    session.bytes_in += MESSAGE_HEADER_SIZE + msg_size
+    BYTES_IN.inc(MESSAGE_HEADER_SIZE + msg_size)
+
+    if not verify_message_hmac(session, encrypted_content, recv_hmac):
+        INTEGRITY_FAILURES.inc()
+        print(f"\n[{session.addr}] BŁĄD INTEGRALNOŚCI! Odrzucono wiadomość.")
+        return False
+    message = inflate_message(session, msg_type, decrypted_content)
+    if message is None:
+        return False
+    msg_type, decrypted_content = message
+    if msg_type == TYPE_CHUNKED:
+        inner_type = parse_chunked_header(session, decrypted_content)
+        sink = StreamDigestSink()
+        if inner_type is None or not await read_chunked_body_async(session, reader, sink):
+            return False
+        return report_chunked_message(session, inner_type, sink)
+    return process_decrypted_message(session, msg_type, decrypted_content)
+
+def log(message):
+    sys.stdout.write(f"\r{message}\n> ")
+    sys.stdout.flush()
+    
+def generate_cryptographically_safe_randint() -> int:
     return secrets.randbelow(MAX_RANDINT_EXCLUSIVE)
\ No newline at end of file
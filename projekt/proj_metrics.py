@@ -0,0 +1,128 @@
+import bisect
+import threading
+import time
+
+LATENCY_BUCKETS_S = [
+    0.000001, 0.000005, 0.00001, 0.00005, 0.0001, 0.0005,
+    0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0
+]
+
+class Counter:
+    __slots__ = ('name', 'help', 'value', 'lock')
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self.value}",
+        ]
+
+class Gauge:
+    """Wartość liczona w chwili odczytu przez podaną funkcję"""
+
+    __slots__ = ('name', 'help', 'function')
+
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    @property
+    def value(self):
+        return self.function()
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.value}",
+        ]
+
+class Histogram:
+    __slots__ = ('name', 'help', 'buckets', 'counts', 'count', 'sum', 'lock')
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS_S):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, fraction):
+        """Przybliżony kwantyl - górna granica kubełka, w którym wypada"""
+        if self.count == 0:
+            return 0.0
+        rank = fraction * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} histogram",
+        ]
+        cumulative = 0
+        for bucket, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{bucket}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+registry = {}
+
+def counter(name, help):
+    return registry.setdefault(name, Counter(name, help))
+
+def gauge(name, help, function):
+    registry[name] = Gauge(name, help, function)
+    return registry[name]
+
+def histogram(name, help, buckets=LATENCY_BUCKETS_S):
+    return registry.setdefault(name, Histogram(name, help, buckets))
+
+def render_prometheus():
+    lines = []
+    for metric in registry.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class timed:
+    """Menedżer kontekstu dopisujący czas wykonania bloku do histogramu"""
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
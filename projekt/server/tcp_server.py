@@ -1,218 +1,1095 @@
-import socket
-import struct
-import threading
-import random
-import hashlib
-import hmac
-import argparse
-import sys
-import os
-
-from proj_lib import *
-
-active_clients_map = {}
-map_lock = threading.Lock()
-
-def handle_client(conn, addr):
-    log(f"[NOWY] Połączono z {addr}")
-    prng_decoder = None
-    prng_encoder = None
-    K = None
-
-    try:
-        header_data = recv_exactly(conn, CLIENT_HELLO_BYTE_SIZE)
-        if not header_data:
-            return
-
-        sig, p, g, A = struct.unpack('!4sQQQ', header_data)
-        
-        if sig != CLIENT_HELLO_SIGNATURE.encode():
-            log(f"[BLAD] Nieprawidłowa sygnatura od {addr}")
-            return
-
-        b_priv = generate_cryptographically_safe_randint()
-        B = pow(g, b_priv, p)
-        K = pow(A, b_priv, p)
-        
-        seed_enc = get_derived_seed(K, "S2C")
-        seed_dec = get_derived_seed(K, "C2S")
-        
-        prng_encoder = random.Random(seed_enc)
-        prng_decoder = random.Random(seed_dec)
-
-        with map_lock:
-            active_clients_map[addr] = {
-                'conn': conn,
-                'prng_enc': prng_encoder,
-                'K': K
-            }
-
-        response = struct.pack('!4sQ', SEVER_HELLO_SIGNATURE.encode(), B)
-        conn.sendall(response)
-        log(f"[{addr}] Handshake OK. Klucz ustalony.")
-
-        continue_communication = True
-        while continue_communication:
-            continue_communication = recive_encrypted_message(conn, prng_decoder, K, addr)
-
-    except RuntimeError:
-        pass
-    except Exception as e:
-        if "Bad file descriptor" not in str(e) and "closed" not in str(e):
-            log(f"[{addr}] Błąd obsługi: {e}")
-    finally:
-        with map_lock:
-            if addr in active_clients_map:
-                del active_clients_map[addr]
-        conn.close()
-        log(f"[ROZLACZONO] {addr}")
-
-def admin_console():
-    """Wątek do wysyłania wiadomości z serwera do klientów"""
-    
-    def log_help():
-        log("--- Konsola Administratora ---")
-        log("Format: <ID> <Wiadomość>")
-        log("Wpisz 'list', aby zobaczyć klientów.")
-        log("Wpisz 'exit', aby zakończyć wszystkie sesje i zakończyć program.")
-        log("Wpisz 'help', aby ponownie wyświetlić tę listę możliwych operacji.")
-    
-    log_help()
-    while True:
-        try:
-            command = input()
-            if not command: continue
-            
-            if command.strip() == "help":
-                log_help()
-                continue
-            
-            if command.strip() == "exit":
-                with map_lock:
-                    for client_data in active_clients_map.values():
-                        try:
-                            send_encrypted_message(
-                                client_data['conn'],
-                                client_data['K'],
-                                client_data['prng_enc'],
-                                TYPE_END_SESSION,
-                                CONTENT_END_SESSION.encode()
-                            )
-                        except Exception as e:
-                            log(f"Błąd przy rozłączaniu klienta: {e}")
-                            
-                    log("Ended all sessions")
-                    os._exit(0)
-            
-            if command.strip() == "list":
-                if len(active_clients_map) == 0:
-                    log("Brak aktywnych klientów")
-                    continue
-                with map_lock:
-                    log(f"Aktywni klienci:")
-                    for idx, addr in enumerate(active_clients_map.keys()):
-                        log(f"[{idx}] {addr}")
-                continue
-            
-
-            parts = command.split(' ', 1)
-            if len(parts) < 2:
-                log("Błędny format. Użyj: <ID_z_listy> <Wiadomość>")
-                continue
-            
-            try:
-                target_idx = int(parts[0])
-                msg_content = parts[1]
-            except ValueError:
-                log("ID musi być liczbą.")
-                continue
-
-            target_addr = None
-            client_data = None
-            
-            with map_lock:
-                clients_list = list(active_clients_map.keys())
-                if 0 <= target_idx < len(clients_list):
-                    target_addr = clients_list[target_idx]
-                    client_data = active_clients_map[target_addr]
-            
-            if client_data:
-                if msg_content == CONTENT_END_SESSION:
-                    try:
-                        send_encrypted_message(
-                            client_data['conn'], 
-                            client_data['K'], 
-                            client_data['prng_enc'], 
-                            TYPE_END_SESSION, 
-                            msg_content.encode()
-                        )
-                    except Exception as e:
-                        log(f"Błąd wysyłania ENDSSION do {target_addr}: {e}")
-
-                    with map_lock:
-                        try:
-                            client_data['conn'].close()
-                        except Exception:
-                            pass
-                        if target_addr in active_clients_map:
-                            del active_clients_map[target_addr]
-                    log(f"[Serwer -> {target_addr}]: Wysłano ENDSSION. Zakończono połączenie.")
-                else:
-                    try:
-                        send_encrypted_message(
-                            client_data['conn'], 
-                            client_data['K'], 
-                            client_data['prng_enc'], 
-                            TYPE_STANDARD_ENCRYPTED, 
-                            msg_content.encode()
-                        )
-                    except Exception as e:
-                        log(f"Błąd wysyłania wiadomości do {target_addr}")
-                    log(f"[Serwer -> {target_addr}]: Wysłano.")
-            else:
-                log("Klient nie istnieje.")
-
-        except EOFError:
-            break
-        except Exception as e:
-            log(f"Błąd konsoli: {e}")
-
-def start_server(host, port, max_clients):
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    try:
-        server.bind((host, port))
-    except PermissionError:
-        log(f"[Błąd] brak uprawnień do portu {port}")
-        return
-    
-    server.listen(5) 
-    log(f"[START] Serwer nasłuchuje na {host}:{port}")
-
-    admin_thread = threading.Thread(target=admin_console)
-    admin_thread.daemon = True
-    admin_thread.start()
-
-    try:
-        while True:
-            conn, addr = server.accept()
-            
-            if threading.active_count() - 2 >= max_clients:
-                log(f"[ODRZUCONO] {addr} - Serwer pełny")
-                conn.close()
-                continue
-
-            thread = threading.Thread(target=handle_client, args=(conn, addr))
-            thread.daemon = True
-            thread.start()
-    except KeyboardInterrupt:
-        log("Zamykanie serwera...")
-    finally:
-        server.close()
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='TCP Server')
-    parser.add_argument('max_clients', type=int, help='Maksymalna liczba jednoczesnych klientów')
-    args = parser.parse_args()
-
-    start_server('0.0.0.0', 5000, args.max_clients)
\ No newline at end of file
+import socket
+import struct
+import threading
+import random
+import hashlib
+import hmac
+import argparse
+import sys
+import os
+import asyncio
+import cProfile
+import pstats
+import io
+import time
+import multiprocessing
+import secrets
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from proj_lib import *
+import proj_metrics
+
+active_clients_map = {}
+map_lock = threading.Lock()
+profiled_sessions = {}
+
+PROFILE_DEFAULT_MESSAGES = 100
+PROFILE_TOP_FUNCTIONS = 15
+
+HANDSHAKE_TIME = proj_metrics.histogram('projekt_handshake_seconds', 'Czas od połączenia do wysłania EHLO')
+MODEXP_TIME = proj_metrics.histogram('projekt_modexp_seconds', 'Czas obu wywołań pow() w handshake')
+
+LISTEN_BACKLOG = 128
+ASYNC_LISTEN_BACKLOG = 4096
+WAIT_QUEUE_TIMEOUT_S = 5.0
+SLOT_POLL_INTERVAL_S = 0.05
+HANDSHAKE_TIMEOUT_S = 10.0
+
+TICKET_CACHE_SIZE = 10000
+TICKET_TTL_S = 3600.0
+TICKET_BUCKET_SIZE = 4
+TICKET_ENTRY_STRUCT = struct.Struct(f'={TICKET_ID_SIZE}sQId')  # ticket_id, K, caps, czas wygaśnięcia (time.monotonic)
+
+TICKETS_ISSUED = proj_metrics.counter('projekt_tickets_issued_total', 'Wydane tickety wznowienia sesji')
+RESUMPTIONS = proj_metrics.counter('projekt_resumptions_total', 'Sesje wznowione z ticketu bez Diffiego-Hellmana')
+RESUMPTION_MISSES = proj_metrics.counter('projekt_resumption_misses_total',
+                                         'Odrzucone tickety (nieznane lub wygasłe) - powrót do pełnego handshake')
+
+server_settings = {
+    'write_queue': False,
+    'flush_threshold': WRITE_QUEUE_FLUSH_THRESHOLD,
+    'flush_delay': WRITE_QUEUE_MAX_DELAY_S,
+    'queue_limit': WRITE_QUEUE_MAX_BYTES,
+    'slow_client_policy': OVERFLOW_BLOCK,
+    'block_timeout': WRITE_QUEUE_BLOCK_TIMEOUT_S,
+    'backlog': None,
+    'wait_queue': 0,
+    'wait_timeout': WAIT_QUEUE_TIMEOUT_S,
+    'handshake_timeout': HANDSHAKE_TIMEOUT_S,
+    'idle_timeout': 0.0,
+}
+
+REJECTED_CONNECTIONS = proj_metrics.counter('projekt_rejected_connections_total',
+                                            'Połączenia odrzucone z braku miejsca (także po czasie w kolejce)')
+QUEUED_CONNECTIONS = proj_metrics.counter('projekt_queued_connections_total',
+                                          'Połączenia, które czekały w kolejce na wolne miejsce')
+HANDSHAKE_TIMEOUTS = proj_metrics.counter('projekt_handshake_timeouts_total', 'Sesje zamknięte przez limit czasu handshake')
+IDLE_TIMEOUTS = proj_metrics.counter('projekt_idle_timeouts_total', 'Sesje zamknięte przez limit czasu bezczynności')
+
+def attach_write_queue(session):
+    session.write_queue = FrameWriteQueue(
+        session,
+        flush_threshold=server_settings['flush_threshold'],
+        max_delay=server_settings['flush_delay'],
+        max_queued_bytes=server_settings['queue_limit'],
+        overflow_policy=server_settings['slow_client_policy'],
+        block_timeout=server_settings['block_timeout']
+    )
+
+def get_queue_depths():
+    return [session.write_queue.depth() for session in get_sessions_snapshot() if session.write_queue is not None]
+
+proj_metrics.gauge('projekt_active_sessions', 'Liczba sesji po handshake', lambda: len(active_clients_map))
+proj_metrics.gauge('projekt_queue_depth_bytes', 'Suma bajtów w kolejkach wyjściowych',
+                   lambda: sum(get_queue_depths()))
+proj_metrics.gauge('projekt_queue_depth_max_bytes', 'Najdłuższa kolejka wyjściowa',
+                   lambda: max(get_queue_depths(), default=0))
+
+class TicketCache:
+    """Tickety wznowienia sesji: ticket_id -> (K, caps, czas wygaśnięcia), z limitem rozmiaru i TTL.
+
+    Tablica leży w pamięci współdzielonej (jak ClientSlots), więc przy --workers ticket wydany przez jeden
+    proces roboczy wznawia sesję w każdym innym. Wpis trafia do kubełka TICKET_BUCKET_SIZE miejsc wybranego
+    po ticket_id; w pełnym kubełku ustępuje wpis najbliższy wygaśnięcia.
+    """
+
+    def __init__(self, max_size=TICKET_CACHE_SIZE, ttl=TICKET_TTL_S):
+        context = multiprocessing.get_context('fork')
+        self.max_size = max_size
+        self.ttl = ttl
+        self.buckets_count = -(-max_size // TICKET_BUCKET_SIZE) if max_size > 0 else 0
+        self.entries = context.RawArray('B', self.buckets_count * TICKET_BUCKET_SIZE * TICKET_ENTRY_STRUCT.size)
+        self.lock = context.Lock()
+
+    def _get_bucket_offsets(self, ticket_id):
+        first = int.from_bytes(ticket_id[:8], 'big') % self.buckets_count * TICKET_BUCKET_SIZE
+        return range(first * TICKET_ENTRY_STRUCT.size, (first + TICKET_BUCKET_SIZE) * TICKET_ENTRY_STRUCT.size,
+                     TICKET_ENTRY_STRUCT.size)
+
+    def issue(self, K, caps=0):
+        if self.max_size <= 0:
+            return None
+        ticket_id = secrets.token_bytes(TICKET_ID_SIZE)
+        now = time.monotonic()
+        with self.lock:
+            # Puste miejsce ma czas wygaśnięcia 0, więc wygrywa razem z wygasłymi
+            victim_offset = min(self._get_bucket_offsets(ticket_id),
+                                key=lambda offset: TICKET_ENTRY_STRUCT.unpack_from(self.entries, offset)[3])
+            TICKET_ENTRY_STRUCT.pack_into(self.entries, victim_offset, ticket_id, K, caps, now + self.ttl)
+        TICKETS_ISSUED.inc()
+        return ticket_id
+
+    def lookup(self, ticket_id):
+        if self.max_size <= 0:
+            return None
+        with self.lock:
+            for offset in self._get_bucket_offsets(ticket_id):
+                entry_id, K, caps, expires_at = TICKET_ENTRY_STRUCT.unpack_from(self.entries, offset)
+                if entry_id != ticket_id or expires_at == 0:
+                    continue
+                if time.monotonic() >= expires_at:
+                    TICKET_ENTRY_STRUCT.pack_into(self.entries, offset, bytes(TICKET_ID_SIZE), 0, 0, 0)
+                    return None
+                return K, caps
+        return None
+
+    def __len__(self):
+        now = time.monotonic()
+        with self.lock:
+            entries = bytes(self.entries)
+        return sum(1 for *_, expires_at in TICKET_ENTRY_STRUCT.iter_unpack(entries) if expires_at > now)
+
+ticket_cache = TicketCache()
+
+proj_metrics.gauge('projekt_ticket_cache_size', 'Liczba ticketów w pamięci podręcznej', lambda: len(ticket_cache))
+
+def compute_shared_key(g, A, p):
+    with proj_metrics.timed(MODEXP_TIME):
+        b_priv = generate_cryptographically_safe_randint()
+        B = pow(g, b_priv, p)
+        K = pow(A, b_priv, p)
+    return B, K
+
+def accept_full_hello(header_data, client_caps=None):
+    """HELO (client_caps=None) albo HEL2 -> (K, wynegocjowane caps, odpowiedź EHLO/EHLT/EHL2, ticket_id albo None)"""
+    sig, p, g, A = struct.unpack('!4sQQQ', header_data)
+    B, K = compute_shared_key(g, A, p)
+
+    if client_caps is None:
+        ticket_id = ticket_cache.issue(K)
+        signature = SERVER_HELLO_TICKET_SIGNATURE if ticket_id is not None else SEVER_HELLO_SIGNATURE
+        return K, 0, struct.pack('!4sQ', signature.encode(), B), ticket_id
+
+    caps = client_caps & SUPPORTED_CAPS
+    ticket_id = ticket_cache.issue(K, caps) if caps & CAP_TICKET else None
+    if ticket_id is None:
+        caps &= ~CAP_TICKET
+    return K, caps, struct.pack('!4sQI', SERVER_HELLO_V2_SIGNATURE.encode(), B, caps), ticket_id
+
+def accept_resume_hello(header_data):
+    """RSUM -> (K', caps z ticketu, odpowiedź RSOK) albo (None, 0, odpowiedź RSNO), gdy ticketu nie ma w pamięci podręcznej"""
+    sig, ticket_id, client_nonce = struct.unpack(RESUME_HELLO_FORMAT, header_data)
+    entry = ticket_cache.lookup(ticket_id)
+    if entry is None:
+        RESUMPTION_MISSES.inc()
+        return None, 0, struct.pack('!4sQ', RESUME_REJECT_SIGNATURE.encode(), 0)
+    RESUMPTIONS.inc()
+    K, caps = entry
+    server_nonce = secrets.randbits(64)
+    return (derive_resumed_key(K, client_nonce, server_nonce), caps,
+            struct.pack('!4sQ', RESUME_OK_SIGNATURE.encode(), server_nonce))
+
+def report_profile(addr, profiler):
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    log(f"[PROFIL {addr}]\n{output.getvalue()}")
+
+def recive_encrypted_message_profiled(session, profile_state):
+    profiler = profile_state['profiler']
+    try:
+        profiler.enable()
+    except ValueError as e:
+        profiled_sessions.pop(session.addr, None)
+        log(f"[PROFIL {session.addr}] Nie można uruchomić cProfile: {e}")
+        return recive_encrypted_message(session)
+    try:
+        result = recive_encrypted_message(session)
+    finally:
+        profiler.disable()
+    profile_state['remaining'] -= 1
+    if profile_state['remaining'] <= 0 or not result:
+        profiled_sessions.pop(session.addr, None)
+        report_profile(session.addr, profiler)
+    return result
+
+def log_session_timeout(addr, handshake_done):
+    if handshake_done:
+        IDLE_TIMEOUTS.inc()
+        log(f"[{addr}] Przekroczono czas bezczynności. Zamykanie.")
+    else:
+        HANDSHAKE_TIMEOUTS.inc()
+        log(f"[{addr}] Przekroczono czas handshake. Zamykanie.")
+
+class HandshakeDeadlineSocket:
+    """Gniazdo dla FrameReader w czasie handshake: przed każdym recv ustawia czas pozostały do wspólnego terminu.
+
+    Sam settimeout ogranicza pojedyncze recv - klient wysyłający bajt co kilka sekund trzymałby miejsce bez końca.
+    """
+
+    def __init__(self, conn, timeout):
+        self.conn = conn
+        self.deadline = time.monotonic() + timeout
+
+    def set_remaining_timeout(self):
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout("handshake deadline exceeded")
+        self.conn.settimeout(remaining)
+
+    def recv_into(self, buffer):
+        self.set_remaining_timeout()
+        return self.conn.recv_into(buffer)
+
+    def sendall(self, data):
+        self.set_remaining_timeout()
+        self.conn.sendall(data)
+
+    def sendmsg(self, buffers):
+        self.set_remaining_timeout()
+        return self.conn.sendmsg(buffers)
+
+def handle_client(conn, addr):
+    log(f"[NOWY] Połączono z {addr}")
+    connection_start = time.perf_counter()
+    handshake_done = False
+
+    try:
+        if server_settings['handshake_timeout']:
+            handshake_conn = HandshakeDeadlineSocket(conn, server_settings['handshake_timeout'])
+        else:
+            conn.settimeout(None)
+            handshake_conn = conn
+        reader = FrameReader(handshake_conn)
+        header_data = bytes(reader.read_exactly(CLIENT_HELLO_BYTE_SIZE))
+        sig = header_data[:4]
+
+        K, ticket_id = None, None
+        if sig == RESUME_HELLO_SIGNATURE.encode():
+            K, caps, response = accept_resume_hello(header_data)
+            if K is None:
+                handshake_conn.sendall(response)
+                header_data = bytes(reader.read_exactly(CLIENT_HELLO_BYTE_SIZE))
+                sig = header_data[:4]
+        resumed = K is not None
+
+        if K is None:
+            client_caps = None
+            if sig == CLIENT_HELLO_V2_SIGNATURE.encode():
+                client_caps, = struct.unpack('!I', reader.read_exactly(CLIENT_HELLO_V2_BYTE_SIZE - CLIENT_HELLO_BYTE_SIZE))
+            elif sig != CLIENT_HELLO_SIGNATURE.encode():
+                log(f"[BLAD] Nieprawidłowa sygnatura od {addr}")
+                return
+            K, caps, response, ticket_id = accept_full_hello(header_data, client_caps)
+
+        session = Session(conn, addr, K, "S2C", "C2S", reader, caps)
+        session.resumed = resumed
+        if server_settings['write_queue']:
+            attach_write_queue(session)
+
+        if ticket_id is not None:
+            sendmsg_all(handshake_conn, [response, *encrypt_message_parts(session, TYPE_TICKET, ticket_id)])
+        else:
+            handshake_conn.sendall(response)
+
+        with map_lock:
+            active_clients_map[addr] = session
+        HANDSHAKE_TIME.observe(time.perf_counter() - connection_start)
+        if session.resumed:
+            log(f"[{addr}] Wznowiono sesję z ticketu.")
+        else:
+            log(f"[{addr}] Handshake OK. Klucz ustalony.")
+        handshake_done = True
+        reader.sock = conn
+        conn.settimeout(server_settings['idle_timeout'] or None)
+
+        continue_communication = True
+        while continue_communication:
+            profile_state = profiled_sessions.get(addr)
+            if profile_state is not None:
+                continue_communication = recive_encrypted_message_profiled(session, profile_state)
+            else:
+                continue_communication = recive_encrypted_message(session)
+
+    except socket.timeout:
+        log_session_timeout(addr, handshake_done)
+    except RuntimeError:
+        pass
+    except Exception as e:
+        if "Bad file descriptor" not in str(e) and "closed" not in str(e):
+            log(f"[{addr}] Błąd obsługi: {e}")
+    finally:
+        with map_lock:
+            session = active_clients_map.pop(addr, None)
+        if session is not None and session.write_queue is not None:
+            session.write_queue.close(server_settings['block_timeout'])
+        conn.close()
+        log(f"[ROZLACZONO] {addr}")
+
+class StreamWriterConn:
+    """Obiekt udający gniazdo dla konsoli administratora w trybie asyncio"""
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    async def _write(self, buffers):
+        self.writer.writelines(buffers)
+        await self.writer.drain()
+
+    def sendall(self, data):
+        self.sendmsg([data])
+
+    def sendmsg(self, buffers):
+        asyncio.run_coroutine_threadsafe(self._write(buffers), self.loop).result()
+        return sum(len(buffer) for buffer in buffers)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+class AsyncWriteQueue:
+    """Odpowiednik FrameWriteQueue dla trybu asyncio - kolejką jest bufor transportu pętli zdarzeń"""
+
+    def __init__(self, session, loop, writer):
+        self.session = session
+        self.loop = loop
+        self.writer = writer
+        self.max_queued_bytes = server_settings['queue_limit']
+        self.overflow_policy = server_settings['slow_client_policy']
+        self.block_timeout = server_settings['block_timeout']
+        self.scheduled_bytes = 0
+        self.dropped_frames = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def depth(self):
+        return self.scheduled_bytes + self.writer.transport.get_write_buffer_size()
+
+    def _has_room(self, frame_size):
+        pending_bytes = self.depth()
+        return pending_bytes == 0 or pending_bytes + frame_size <= self.max_queued_bytes
+
+    def _write(self, buffers, frame_size):
+        self.scheduled_bytes -= frame_size
+        if not self.writer.is_closing():
+            self.writer.writelines(buffers)
+
+    def _wait_for_drain(self, timeout):
+        try:
+            asyncio.run_coroutine_threadsafe(self.writer.drain(), self.loop).result(timeout)
+        except Exception:
+            pass
+
+    def enqueue(self, message_type, encoded_message):
+        message_type, encoded_message = compress_message(self.session, message_type, encoded_message)
+        frame_size = MESSAGE_HEADER_SIZE + len(encoded_message)
+        with self.lock:
+            if self.closed:
+                return False
+            if not self._has_room(frame_size):
+                if self.overflow_policy == OVERFLOW_DROP:
+                    self.dropped_frames += 1
+                    DROPPED_FRAMES.inc()
+                    return False
+                if self.overflow_policy == OVERFLOW_BLOCK and not self._in_loop_thread():
+                    self._wait_for_drain(self.block_timeout)
+                if not self._has_room(frame_size):
+                    SLOW_CLIENT_DISCONNECTS.inc()
+                    self.closed = True
+                    self.loop.call_soon_threadsafe(self.writer.transport.abort)
+                    return False
+
+            encrypted_header, encrypted_message = encrypt_frame_parts(self.session, message_type, encoded_message)
+            self.scheduled_bytes += frame_size
+            self.loop.call_soon_threadsafe(self._write, [encrypted_header, encrypted_message], frame_size)
+            return True
+
+    def _in_loop_thread(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def close(self, timeout=None):
+        self.closed = True
+        if not self._in_loop_thread():
+            self._wait_for_drain(timeout)
+
+class TimeoutStreamReader:
+    """StreamReader z limitem czasu na każde readexactly - odpowiednik settimeout z trybu threaded"""
+
+    def __init__(self, reader, timeout):
+        self.reader = reader
+        self.timeout = timeout
+
+    async def readexactly(self, size):
+        return await asyncio.wait_for(self.reader.readexactly(size), self.timeout)
+
+def with_read_timeout(reader, timeout):
+    return TimeoutStreamReader(reader, timeout) if timeout else reader
+
+async def acquire_slot_async(slots, timeout):
+    """Miejsce dla klienta; przy pełnym serwerze czeka w kolejce, sprawdzając co SLOT_POLL_INTERVAL_S"""
+    if slots.try_acquire():
+        return True
+    if timeout <= 0 or not slots.enter_queue():
+        return False
+    QUEUED_CONNECTIONS.inc()
+    try:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            await asyncio.sleep(SLOT_POLL_INTERVAL_S)
+            if slots.try_acquire():
+                return True
+        return False
+    finally:
+        slots.leave_queue()
+
+async def accept_handshake_async(reader, writer, addr):
+    """Handshake w trybie asyncio; zwraca Session albo None przy nieprawidłowej sygnaturze"""
+    header_data = await reader.readexactly(CLIENT_HELLO_BYTE_SIZE)
+    sig = header_data[:4]
+
+    K, ticket_id = None, None
+    if sig == RESUME_HELLO_SIGNATURE.encode():
+        K, caps, response = accept_resume_hello(header_data)
+        if K is None:
+            writer.write(response)
+            await writer.drain()
+            header_data = await reader.readexactly(CLIENT_HELLO_BYTE_SIZE)
+            sig = header_data[:4]
+    resumed = K is not None
+
+    if K is None:
+        client_caps = None
+        if sig == CLIENT_HELLO_V2_SIGNATURE.encode():
+            client_caps, = struct.unpack('!I', await reader.readexactly(CLIENT_HELLO_V2_BYTE_SIZE - CLIENT_HELLO_BYTE_SIZE))
+        elif sig != CLIENT_HELLO_SIGNATURE.encode():
+            log(f"[BLAD] Nieprawidłowa sygnatura od {addr}")
+            return None
+        K, caps, response, ticket_id = accept_full_hello(header_data, client_caps)
+
+    loop = asyncio.get_running_loop()
+    session = Session(StreamWriterConn(loop, writer), addr, K, "S2C", "C2S", caps=caps)
+    session.resumed = resumed
+    session.write_queue = AsyncWriteQueue(session, loop, writer)
+
+    if ticket_id is not None:
+        writer.writelines([response, *encrypt_message_parts(session, TYPE_TICKET, ticket_id)])
+    else:
+        writer.write(response)
+    await writer.drain()
+    return session
+
+async def handle_client_async(stream_reader, writer, slots):
+    addr = writer.get_extra_info('peername')
+    if not await acquire_slot_async(slots, server_settings['wait_timeout']):
+        REJECTED_CONNECTIONS.inc()
+        log(f"[ODRZUCONO] {addr} - Serwer pełny")
+        writer.close()
+        return
+
+    log(f"[NOWY] Połączono z {addr}")
+    connection_start = time.perf_counter()
+    handshake_done = False
+    try:
+        # Jeden termin na cały handshake, nie na każdy odczyt - powolny klient nie przedłuży go kolejnymi bajtami
+        handshake = accept_handshake_async(stream_reader, writer, addr)
+        if server_settings['handshake_timeout']:
+            session = await asyncio.wait_for(handshake, server_settings['handshake_timeout'])
+        else:
+            session = await handshake
+        if session is None:
+            return
+
+        with map_lock:
+            active_clients_map[addr] = session
+        HANDSHAKE_TIME.observe(time.perf_counter() - connection_start)
+        if session.resumed:
+            log(f"[{addr}] Wznowiono sesję z ticketu.")
+        else:
+            log(f"[{addr}] Handshake OK. Klucz ustalony.")
+        handshake_done = True
+        reader = with_read_timeout(stream_reader, server_settings['idle_timeout'])
+
+        continue_communication = True
+        while continue_communication:
+            continue_communication = await recive_encrypted_message_async(session, reader)
+
+    except asyncio.TimeoutError:
+        log_session_timeout(addr, handshake_done)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    except Exception as e:
+        log(f"[{addr}] Błąd obsługi: {e}")
+    finally:
+        slots.release()
+        with map_lock:
+            session = active_clients_map.pop(addr, None)
+        if session is not None:
+            session.write_queue.close()
+        writer.close()
+        log(f"[ROZLACZONO] {addr}")
+
+def get_sessions_snapshot():
+    with map_lock:
+        return list(active_clients_map.values())
+
+def broadcast(message_type, encoded_message):
+    sessions = get_sessions_snapshot()
+    delivered = 0
+    for session in sessions:
+        try:
+            if send_encrypted_message(session, message_type, encoded_message):
+                delivered += 1
+        except Exception as e:
+            log(f"[{session.addr}] Błąd wysyłania: {e}")
+    return delivered, len(sessions)
+
+def get_stats_lines():
+    lines = []
+    for metric in proj_metrics.registry.values():
+        if isinstance(metric, proj_metrics.Histogram):
+            mean_ms = metric.sum / metric.count * 1000 if metric.count else 0.0
+            lines.append(f"{metric.name}: n={metric.count}, średnio={mean_ms:.3f} ms, "
+                         f"p50<={metric.quantile(0.5) * 1000:.3f} ms, p99<={metric.quantile(0.99) * 1000:.3f} ms")
+        else:
+            lines.append(f"{metric.name}: {metric.value}")
+    for session in get_sessions_snapshot():
+        depth = session.write_queue.depth() if session.write_queue is not None else 0
+        lines.append(f"{session.addr}: odebrano={session.bytes_in} B, wysłano={session.bytes_out} B, kolejka={depth} B")
+    return lines
+
+class LocalControl:
+    """Operacje konsoli administratora na sesjach obsługiwanych przez ten proces"""
+
+    def list_clients(self):
+        with map_lock:
+            return list(active_clients_map.keys())
+
+    def describe(self, addr):
+        return str(addr)
+
+    def send_message(self, addr, msg_content):
+        with map_lock:
+            session = active_clients_map.get(addr)
+        if session is None:
+            return None
+        return send_encrypted_message(session, TYPE_STANDARD_ENCRYPTED, msg_content.encode())
+
+    def end_session(self, addr):
+        with map_lock:
+            session = active_clients_map.pop(addr, None)
+        if session is None:
+            return False
+        try:
+            send_encrypted_message(session, TYPE_END_SESSION, CONTENT_END_SESSION.encode())
+        except Exception as e:
+            log(f"Błąd wysyłania ENDSSION do {addr}: {e}")
+        try:
+            session.close(server_settings['block_timeout'])
+        except Exception:
+            pass
+        return True
+
+    def broadcast_message(self, msg_content):
+        return broadcast(TYPE_STANDARD_ENCRYPTED, msg_content.encode())
+
+    def end_all_sessions(self):
+        broadcast(TYPE_END_SESSION, CONTENT_END_SESSION.encode())
+        for session in get_sessions_snapshot():
+            try:
+                session.close(server_settings['block_timeout'])
+            except Exception as e:
+                log(f"Błąd przy rozłączaniu klienta: {e}")
+
+    def stats_lines(self):
+        return get_stats_lines()
+
+    def start_profile(self, addr, messages_count):
+        with map_lock:
+            session = active_clients_map.get(addr)
+        if session is None:
+            return "Klient nie istnieje."
+        if isinstance(session.sock, StreamWriterConn):
+            return "Profilowanie pojedynczej sesji jest dostępne tylko w trybie threaded."
+        profiled_sessions[addr] = {'remaining': messages_count, 'profiler': cProfile.Profile()}
+        return f"[PROFIL {addr}] Profilowanie {messages_count} kolejnych wiadomości."
+
+class WorkerPoolControl:
+    """Operacje konsoli administratora przekazywane kanałem sterującym do procesów roboczych"""
+
+    def __init__(self, workers, control_conns):
+        self.workers = workers
+        self.control_conns = control_conns
+
+    def _call(self, worker_idx, name, *args):
+        control_conn = self.control_conns[worker_idx]
+        control_conn.send((name, args))
+        return control_conn.recv()
+
+    def list_clients(self):
+        clients = []
+        for worker_idx in range(len(self.control_conns)):
+            clients.extend((worker_idx, addr) for addr in self._call(worker_idx, 'list_clients'))
+        return clients
+
+    def describe(self, client):
+        worker_idx, addr = client
+        return f"{addr} (proces {worker_idx})"
+
+    def send_message(self, client, msg_content):
+        worker_idx, addr = client
+        return self._call(worker_idx, 'send_message', addr, msg_content)
+
+    def end_session(self, client):
+        worker_idx, addr = client
+        return self._call(worker_idx, 'end_session', addr)
+
+    def broadcast_message(self, msg_content):
+        delivered, total = 0, 0
+        for worker_idx in range(len(self.control_conns)):
+            worker_delivered, worker_total = self._call(worker_idx, 'broadcast_message', msg_content)
+            delivered += worker_delivered
+            total += worker_total
+        return delivered, total
+
+    def end_all_sessions(self):
+        for worker_idx in range(len(self.control_conns)):
+            self._call(worker_idx, 'end_all_sessions')
+        for worker in self.workers:
+            worker.terminate()
+
+    def stats_lines(self):
+        lines = []
+        for worker_idx in range(len(self.control_conns)):
+            lines.append(f"--- Proces roboczy {worker_idx} (pid {self.workers[worker_idx].pid}) ---")
+            lines.extend(self._call(worker_idx, 'stats_lines'))
+        return lines
+
+    def start_profile(self, client, messages_count):
+        worker_idx, addr = client
+        return self._call(worker_idx, 'start_profile', addr, messages_count)
+
+def worker_control_loop(control_conn):
+    """Wątek procesu roboczego wykonujący polecenia konsoli z procesu nadrzędnego"""
+    local_control = LocalControl()
+    while True:
+        try:
+            name, args = control_conn.recv()
+        except (EOFError, OSError):
+            os._exit(0)
+        try:
+            result = getattr(local_control, name)(*args)
+        except Exception as e:
+            log(f"Błąd polecenia {name}: {e}")
+            result = None
+        control_conn.send(result)
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = proj_metrics.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port):
+    metrics_server = ThreadingHTTPServer(('127.0.0.1', port), MetricsRequestHandler)
+    metrics_thread = threading.Thread(target=metrics_server.serve_forever)
+    metrics_thread.daemon = True
+    metrics_thread.start()
+    log(f"[START] Metryki Prometheus na http://127.0.0.1:{port}/metrics")
+
+def admin_console(control):
+    """Wątek do wysyłania wiadomości z serwera do klientów"""
+    
+    def log_help():
+        log("--- Konsola Administratora ---")
+        log("Format: <ID> <Wiadomość>")
+        log("Wpisz 'list', aby zobaczyć klientów.")
+        log("Wpisz 'broadcast <Wiadomość>', aby wysłać wiadomość do wszystkich klientów.")
+        log("Wpisz 'stats', aby zobaczyć liczniki i histogramy serwera.")
+        log(f"Wpisz 'profile <ID> [N]', aby sprofilować (cProfile) N kolejnych wiadomości klienta (domyślnie {PROFILE_DEFAULT_MESSAGES}).")
+        log("Wpisz 'exit', aby zakończyć wszystkie sesje i zakończyć program.")
+        log("Wpisz 'help', aby ponownie wyświetlić tę listę możliwych operacji.")
+
+    def get_client_by_index(target_idx):
+        clients_list = control.list_clients()
+        if 0 <= target_idx < len(clients_list):
+            return clients_list[target_idx]
+        return None
+    
+    log_help()
+    while True:
+        try:
+            command = input()
+            if not command: continue
+            
+            if command.strip() == "help":
+                log_help()
+                continue
+            
+            if command.strip() == "exit":
+                control.end_all_sessions()
+                log("Ended all sessions")
+                os._exit(0)
+
+            if command.strip() == "stats":
+                log("--- Statystyki ---")
+                for line in control.stats_lines():
+                    log(line)
+                continue
+
+            if command.startswith("profile "):
+                profile_args = command.split()
+                try:
+                    target_idx = int(profile_args[1])
+                    messages_count = int(profile_args[2]) if len(profile_args) > 2 else PROFILE_DEFAULT_MESSAGES
+                except (ValueError, IndexError):
+                    log("Użyj: profile <ID_z_listy> [liczba_wiadomości]")
+                    continue
+                client = get_client_by_index(target_idx)
+                if client is None:
+                    log("Klient nie istnieje.")
+                else:
+                    log(control.start_profile(client, messages_count))
+                continue
+
+            if command.startswith("broadcast "):
+                msg_content = command.split(' ', 1)[1]
+                delivered, total = control.broadcast_message(msg_content)
+                log(f"[Serwer -> wszyscy]: Wysłano do {delivered}/{total} klientów.")
+                continue
+            
+            if command.strip() == "list":
+                clients_list = control.list_clients()
+                if len(clients_list) == 0:
+                    log("Brak aktywnych klientów")
+                    continue
+                log(f"Aktywni klienci:")
+                for idx, client in enumerate(clients_list):
+                    log(f"[{idx}] {control.describe(client)}")
+                continue
+            
+
+            parts = command.split(' ', 1)
+            if len(parts) < 2:
+                log("Błędny format. Użyj: <ID_z_listy> <Wiadomość>")
+                continue
+            
+            try:
+                target_idx = int(parts[0])
+                msg_content = parts[1]
+            except ValueError:
+                log("ID musi być liczbą.")
+                continue
+
+            client = get_client_by_index(target_idx)
+            
+            if client is not None:
+                target_name = control.describe(client)
+                if msg_content == CONTENT_END_SESSION:
+                    control.end_session(client)
+                    log(f"[Serwer -> {target_name}]: Wysłano ENDSSION. Zakończono połączenie.")
+                else:
+                    try:
+                        result = control.send_message(client, msg_content)
+                        if result is None:
+                            log("Klient nie istnieje.")
+                        elif result:
+                            log(f"[Serwer -> {target_name}]: Wysłano.")
+                        else:
+                            log(f"[Serwer -> {target_name}]: Kolejka klienta pełna, wiadomość odrzucona.")
+                    except Exception as e:
+                        log(f"Błąd wysyłania wiadomości do {target_name}")
+            else:
+                log("Klient nie istnieje.")
+
+        except EOFError:
+            break
+        except Exception as e:
+            log(f"Błąd konsoli: {e}")
+
+def start_admin_console(control):
+    admin_thread = threading.Thread(target=admin_console, args=(control,))
+    admin_thread.daemon = True
+    admin_thread.start()
+
+class ClientSlots:
+    """Licznik zajętych miejsc na klientów i liczba oczekujących w kolejce, współdzielone między procesami roboczymi"""
+
+    def __init__(self, max_clients, max_waiting=0):
+        context = multiprocessing.get_context('fork')
+        self.max_clients = max_clients
+        self.max_waiting = max_waiting
+        self.condition = context.Condition()
+        self.used = context.RawValue('i', 0)
+        self.waiting = context.RawValue('i', 0)
+
+    def try_acquire(self):
+        with self.condition:
+            if self.used.value >= self.max_clients:
+                return False
+            self.used.value += 1
+            return True
+
+    def enter_queue(self):
+        with self.condition:
+            if self.waiting.value >= self.max_waiting:
+                return False
+            self.waiting.value += 1
+            return True
+
+    def leave_queue(self):
+        with self.condition:
+            self.waiting.value -= 1
+
+    def acquire(self, timeout):
+        """Blokujące zajęcie miejsca: czeka w kolejce do timeout sekund, o ile kolejka nie jest pełna"""
+        if self.try_acquire():
+            return True
+        if timeout <= 0 or not self.enter_queue():
+            return False
+        QUEUED_CONNECTIONS.inc()
+        try:
+            with self.condition:
+                if not self.condition.wait_for(lambda: self.used.value < self.max_clients, timeout):
+                    return False
+                self.used.value += 1
+                return True
+        finally:
+            self.leave_queue()
+
+    def release(self):
+        with self.condition:
+            self.used.value -= 1
+            self.condition.notify()
+
+def create_listening_socket(host, port, backlog, reuse_port=False):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.bind((host, port))
+    server.listen(backlog)
+    return server
+
+def handle_client_in_slot(conn, addr, slots):
+    try:
+        handle_client(conn, addr)
+    finally:
+        slots.release()
+
+def wait_for_slot_and_handle(conn, addr, slots):
+    if not slots.acquire(server_settings['wait_timeout']):
+        REJECTED_CONNECTIONS.inc()
+        log(f"[ODRZUCONO] {addr} - Serwer pełny")
+        conn.close()
+        return
+    handle_client_in_slot(conn, addr, slots)
+
+def accept_loop(server, slots):
+    while True:
+        conn, addr = server.accept()
+
+        if slots.try_acquire():
+            target = handle_client_in_slot
+        elif slots.max_waiting > 0:
+            target = wait_for_slot_and_handle
+        else:
+            REJECTED_CONNECTIONS.inc()
+            log(f"[ODRZUCONO] {addr} - Serwer pełny")
+            conn.close()
+            continue
+
+        thread = threading.Thread(target=target, args=(conn, addr, slots))
+        thread.daemon = True
+        thread.start()
+
+def start_server(host, port, max_clients):
+    try:
+        server = create_listening_socket(host, port, server_settings['backlog'] or LISTEN_BACKLOG)
+    except PermissionError:
+        log(f"[Błąd] brak uprawnień do portu {port}")
+        return
+    log(f"[START] Serwer nasłuchuje na {host}:{port}")
+
+    start_admin_console(LocalControl())
+
+    try:
+        accept_loop(server, ClientSlots(max_clients, server_settings['wait_queue']))
+    except KeyboardInterrupt:
+        log("Zamykanie serwera...")
+    finally:
+        server.close()
+
+def raise_open_files_limit():
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+async def serve_async(server_socket, slots):
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_client_async(reader, writer, slots),
+        sock=server_socket
+    )
+    async with server:
+        await server.serve_forever()
+
+def start_server_async(host, port, max_clients):
+    raise_open_files_limit()
+    try:
+        server = create_listening_socket(host, port, server_settings['backlog'] or ASYNC_LISTEN_BACKLOG)
+    except PermissionError:
+        log(f"[Błąd] brak uprawnień do portu {port}")
+        return
+    log(f"[START] Serwer (asyncio) nasłuchuje na {host}:{port}")
+
+    start_admin_console(LocalControl())
+
+    try:
+        asyncio.run(serve_async(server, ClientSlots(max_clients, server_settings['wait_queue'])))
+    except KeyboardInterrupt:
+        log("Zamykanie serwera...")
+
+def run_worker(worker_idx, host, port, mode, slots, control_conn, inherited_conns, metrics_port):
+    # Końcówki procesu nadrzędnego odziedziczone przy fork - bez zamknięcia recv() nie zgłosi EOF po jego śmierci
+    for inherited_conn in inherited_conns:
+        inherited_conn.close()
+
+    control_thread = threading.Thread(target=worker_control_loop, args=(control_conn,))
+    control_thread.daemon = True
+    control_thread.start()
+
+    if metrics_port:
+        start_metrics_server(metrics_port + worker_idx)
+
+    backlog = server_settings['backlog'] or (ASYNC_LISTEN_BACKLOG if mode == 'asyncio' else LISTEN_BACKLOG)
+    server = create_listening_socket(host, port, backlog, reuse_port=True)
+    log(f"[START] Proces roboczy {worker_idx} (pid {os.getpid()}) nasłuchuje na {host}:{port}")
+    try:
+        if mode == 'asyncio':
+            raise_open_files_limit()
+            asyncio.run(serve_async(server, slots))
+        else:
+            accept_loop(server, slots)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+def start_prefork_server(host, port, max_clients, workers_count, mode, metrics_port):
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        log("[Błąd] SO_REUSEPORT nie jest dostępne na tym systemie")
+        return
+
+    context = multiprocessing.get_context('fork')
+    slots = ClientSlots(max_clients, server_settings['wait_queue'])
+    workers = []
+    control_conns = []
+    for worker_idx in range(workers_count):
+        parent_conn, worker_conn = context.Pipe()
+        worker = context.Process(
+            target=run_worker,
+            args=(worker_idx, host, port, mode, slots, worker_conn, control_conns + [parent_conn], metrics_port)
+        )
+        worker.daemon = True
+        worker.start()
+        worker_conn.close()
+        workers.append(worker)
+        control_conns.append(parent_conn)
+
+    start_admin_console(WorkerPoolControl(workers, control_conns))
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        log("Zamykanie serwera...")
+        for worker in workers:
+            worker.terminate()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='TCP Server')
+    parser.add_argument('max_clients', type=int, help='Maksymalna liczba jednoczesnych klientów')
+    parser.add_argument('--mode', choices=['threaded', 'asyncio'], default='threaded',
+                        help='threaded - jeden wątek na klienta, asyncio - wszyscy klienci w jednej pętli zdarzeń')
+    queue_group = parser.add_argument_group(
+        'kolejka wyjściowa',
+        'W trybie threaded kolejka to osobny wątek wysyłający dla każdego klienta (dwa wątki na połączenie); '
+        'włącza ją --write-queue albo dowolna z pozostałych opcji, bez nich wiadomość wysyła od razu wątek, '
+        'który ją nadaje. W trybie asyncio kolejką jest bufor transportu, a limit i polityka działają zawsze.')
+    queue_group.add_argument('--write-queue', action='store_true',
+                             help='Kolejka z domyślnymi ustawieniami (tryb threaded)')
+    queue_group.add_argument('--flush-threshold', type=int,
+                             help='Liczba bajtów w kolejce, po której następuje natychmiastowe wysłanie '
+                                  f'(domyślnie {WRITE_QUEUE_FLUSH_THRESHOLD})')
+    queue_group.add_argument('--flush-delay-ms', type=float,
+                             help='Maksymalny czas oczekiwania ramki w kolejce na zbiorcze wysłanie [ms] '
+                                  f'(domyślnie {WRITE_QUEUE_MAX_DELAY_S * 1000:g})')
+    queue_group.add_argument('--queue-limit', type=int,
+                             help=f'Maksymalna liczba bajtów w kolejce jednego klienta (domyślnie {WRITE_QUEUE_MAX_BYTES})')
+    queue_group.add_argument('--slow-client-policy', choices=OVERFLOW_POLICIES,
+                             help='Co zrobić, gdy kolejka klienta jest pełna: drop - pomiń wiadomość, '
+                                  'disconnect - rozłącz klienta, block - czekaj --block-timeout, potem rozłącz '
+                                  f'(domyślnie {OVERFLOW_BLOCK})')
+    queue_group.add_argument('--block-timeout', type=float,
+                             help='Czas oczekiwania na miejsce w kolejce dla polityki block [s] '
+                                  f'(domyślnie {WRITE_QUEUE_BLOCK_TIMEOUT_S:g})')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='Port lokalnego endpointu HTTP /metrics w formacie Prometheus (0 - wyłączony); '
+                             'przy --workers proces roboczy i używa portu metrics_port + i')
+    parser.add_argument('--ticket-cache-size', type=int, default=TICKET_CACHE_SIZE,
+                        help='Maksymalna liczba ticketów wznowienia sesji (0 - bez ticketów); '
+                             'przy --workers pamięć ticketów jest wspólna dla wszystkich procesów')
+    parser.add_argument('--ticket-ttl', type=float, default=TICKET_TTL_S,
+                        help='Czas ważności ticketu wznowienia sesji [s]')
+    parser.add_argument('--backlog', type=int,
+                        help=f'Długość kolejki listen() (domyślnie {LISTEN_BACKLOG}, w trybie asyncio {ASYNC_LISTEN_BACKLOG})')
+    parser.add_argument('--wait-queue', type=int, default=0,
+                        help='Ilu klientów może czekać na wolne miejsce, gdy serwer jest pełny (0 - od razu odrzucaj)')
+    parser.add_argument('--wait-timeout', type=float, default=WAIT_QUEUE_TIMEOUT_S,
+                        help='Jak długo klient może czekać w kolejce na wolne miejsce [s]')
+    parser.add_argument('--handshake-timeout', type=float, default=HANDSHAKE_TIMEOUT_S,
+                        help='Limit czasu na handshake, liczony od zajęcia miejsca [s] (0 - bez limitu)')
+    parser.add_argument('--idle-timeout', type=float, default=0.0,
+                        help='Zamknij sesję, gdy klient nic nie wysyła przez tyle sekund (0 - bez limitu)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Liczba procesów roboczych współdzielących port przez SO_REUSEPORT (1 - jeden proces)')
+    args = parser.parse_args()
+
+    queue_options = {
+        'flush_threshold': args.flush_threshold,
+        'flush_delay': args.flush_delay_ms / 1000 if args.flush_delay_ms is not None else None,
+        'queue_limit': args.queue_limit,
+        'slow_client_policy': args.slow_client_policy,
+        'block_timeout': args.block_timeout,
+    }
+    for name, value in queue_options.items():
+        if value is not None:
+            server_settings[name] = value
+    server_settings['write_queue'] = args.write_queue or any(value is not None for value in queue_options.values())
+    server_settings['backlog'] = args.backlog
+    server_settings['wait_queue'] = args.wait_queue
+    server_settings['wait_timeout'] = args.wait_timeout
+    server_settings['handshake_timeout'] = args.handshake_timeout
+    server_settings['idle_timeout'] = args.idle_timeout
+    ticket_cache = TicketCache(args.ticket_cache_size, args.ticket_ttl)
+
+    if args.workers > 1:
+        start_prefork_server('0.0.0.0', 5000, args.max_clients, args.workers, args.mode, args.metrics_port)
+        sys.exit(0)
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    if args.mode == 'asyncio':
+        start_server_async('0.0.0.0', 5000, args.max_clients)
+    else:
+        start_server('0.0.0.0', 5000, args.max_clients)
\ No newline at end of file
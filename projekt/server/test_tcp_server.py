@@ -0,0 +1,137 @@
+import asyncio
+import multiprocessing
+import socket
+import struct
+import threading
+import time
+import unittest
+
+import tcp_server
+from proj_lib import (CLIENT_HELLO_V2_SIGNATURE, RESUME_HELLO_FORMAT, RESUME_HELLO_SIGNATURE, RESUME_OK_SIGNATURE,
+                      RESUME_REJECT_SIGNATURE, TICKET_ID_SIZE)
+from tcp_server import (TICKET_BUCKET_SIZE, ClientSlots, TicketCache, accept_resume_hello, handle_client,
+                        handle_client_async, server_settings)
+
+HANDSHAKE_TIMEOUT_S = 0.6
+PIECE_INTERVAL_S = 0.4
+
+def get_slow_hello_pieces():
+    """RSUM z nieznanym ticketem, po RSNO nagłówek HEL2 i osobno caps - każdy kawałek mieści się w limicie, całość nie"""
+    return [
+        struct.pack(RESUME_HELLO_FORMAT, RESUME_HELLO_SIGNATURE.encode(), bytes(TICKET_ID_SIZE), 1),
+        struct.pack('!4sQQQ', CLIENT_HELLO_V2_SIGNATURE.encode(), 23, 5, 8),
+        struct.pack('!I', 0),
+    ]
+
+def send_slowly(sock):
+    for index, piece in enumerate(get_slow_hello_pieces()):
+        if index:
+            time.sleep(PIECE_INTERVAL_S)
+        try:
+            sock.sendall(piece)
+        except OSError:
+            return
+
+class HandshakeDeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.saved_timeout = server_settings['handshake_timeout']
+        server_settings['handshake_timeout'] = HANDSHAKE_TIMEOUT_S
+        self.timeouts = tcp_server.HANDSHAKE_TIMEOUTS.value
+
+    def tearDown(self):
+        server_settings['handshake_timeout'] = self.saved_timeout
+
+    def test_threaded_handshake_has_one_deadline(self):
+        client_sock, server_sock = socket.socketpair()
+        thread = threading.Thread(target=handle_client, args=(server_sock, "slow"))
+        thread.start()
+        with client_sock:
+            send_slowly(client_sock)
+            thread.join(HANDSHAKE_TIMEOUT_S)
+            timeouts = tcp_server.HANDSHAKE_TIMEOUTS.value
+        thread.join()
+        self.assertEqual(timeouts, self.timeouts + 1)
+
+    def test_async_handshake_has_one_deadline(self):
+        slots = ClientSlots(1)
+
+        async def run():
+            server = await asyncio.start_server(lambda reader, writer: handle_client_async(reader, writer, slots),
+                                                '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            with socket.create_connection(('127.0.0.1', port)) as client_sock:
+                await asyncio.to_thread(send_slowly, client_sock)
+                while slots.used.value:
+                    await asyncio.sleep(0.01)
+            server.close()
+            await server.wait_closed()
+
+        asyncio.run(asyncio.wait_for(run(), 5 * HANDSHAKE_TIMEOUT_S))
+        self.assertEqual(tcp_server.HANDSHAKE_TIMEOUTS.value, self.timeouts + 1)
+
+def build_resume_hello(ticket_id, client_nonce=1):
+    return struct.pack(RESUME_HELLO_FORMAT, RESUME_HELLO_SIGNATURE.encode(), ticket_id, client_nonce)
+
+def issue_in_child(cache, conn):
+    conn.send(cache.issue(12345, 7))
+    conn.close()
+
+class TicketCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.saved_cache = tcp_server.ticket_cache
+
+    def tearDown(self):
+        tcp_server.ticket_cache = self.saved_cache
+
+    def test_ticket_issued_by_another_worker_resumes(self):
+        cache = TicketCache(16)
+        context = multiprocessing.get_context('fork')
+        parent_conn, child_conn = context.Pipe()
+        worker = context.Process(target=issue_in_child, args=(cache, child_conn))
+        worker.start()
+        ticket_id = parent_conn.recv()
+        worker.join()
+        self.assertEqual(cache.lookup(ticket_id), (12345, 7))
+        self.assertEqual(len(cache), 1)
+
+    def test_expired_ticket_is_rejected(self):
+        tcp_server.ticket_cache = TicketCache(16, ttl=0.05)
+        ticket_id = tcp_server.ticket_cache.issue(12345)
+        time.sleep(0.1)
+        K, caps, response = accept_resume_hello(build_resume_hello(ticket_id))
+        self.assertIsNone(K)
+        self.assertEqual(response[:4], RESUME_REJECT_SIGNATURE.encode())
+        self.assertEqual(len(tcp_server.ticket_cache), 0)
+
+    def test_replayed_resume_hello_gets_new_key(self):
+        tcp_server.ticket_cache = TicketCache(16)
+        ticket_id = tcp_server.ticket_cache.issue(12345, 7)
+        first_key, caps, first_response = accept_resume_hello(build_resume_hello(ticket_id))
+        second_key, _, second_response = accept_resume_hello(build_resume_hello(ticket_id))
+        self.assertEqual(caps, 7)
+        self.assertEqual(first_response[:4], RESUME_OK_SIGNATURE.encode())
+        self.assertEqual(second_response[:4], RESUME_OK_SIGNATURE.encode())
+        # Świeży nonce serwera - powtórzone RSUM nie odtwarza klucza poprzedniej sesji
+        self.assertNotEqual(first_key, second_key)
+
+    def test_unknown_ticket_is_rejected(self):
+        tcp_server.ticket_cache = TicketCache(16)
+        tcp_server.ticket_cache.issue(12345)
+        K, _, response = accept_resume_hello(build_resume_hello(bytes(TICKET_ID_SIZE)))
+        self.assertIsNone(K)
+        self.assertEqual(response[:4], RESUME_REJECT_SIGNATURE.encode())
+
+    def test_full_cache_evicts_ticket_closest_to_expiry(self):
+        cache = TicketCache(TICKET_BUCKET_SIZE)
+        ticket_ids = [cache.issue(K) for K in range(TICKET_BUCKET_SIZE + 1)]
+        self.assertIsNone(cache.lookup(ticket_ids[0]))
+        self.assertEqual([cache.lookup(ticket_id)[0] for ticket_id in ticket_ids[1:]],
+                         list(range(1, TICKET_BUCKET_SIZE + 1)))
+
+    def test_disabled_cache_issues_no_tickets(self):
+        cache = TicketCache(0)
+        self.assertIsNone(cache.issue(12345))
+        self.assertIsNone(cache.lookup(bytes(TICKET_ID_SIZE)))
+
+if __name__ == "__main__":
+    unittest.main()
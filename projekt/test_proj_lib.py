@@ -0,0 +1,145 @@
+import asyncio
+import io
+import socket
+import struct
+import threading
+import unittest
+
+import proj_lib
+from proj_lib import (CAP_COMPRESS_ZLIB, FRAME_READER_INITIAL_SIZE, MAX_DECOMPRESSED_SIZE, MAX_MESSAGE_SIZE,
+                      MESSAGE_HEADER_SIZE, OVERFLOW_DROP, TYPE_CHUNKED, TYPE_ECHO_REQUEST, FrameReader,
+                      FrameWriteQueue, Session, parse_chunked_header, read_chunked_body, read_encrypted_message,
+                      recive_encrypted_message_async, send_chunked_message, send_encrypted_message, xor_bytes)
+
+SHARED_KEY = 123456789
+
+def open_session_pair(caps):
+    client_sock, server_sock = socket.socketpair()
+    sender = Session(client_sock, "client", SHARED_KEY, "C2S", "S2C", FrameReader(client_sock), caps)
+    receiver = Session(server_sock, "server", SHARED_KEY, "S2C", "C2S", FrameReader(server_sock), caps)
+    return sender, receiver
+
+def round_trip(caps, message):
+    sender, receiver = open_session_pair(caps)
+    try:
+        thread = threading.Thread(target=send_encrypted_message, args=(sender, TYPE_ECHO_REQUEST, message))
+        thread.start()
+        received = read_encrypted_message(receiver)
+        thread.join()
+    finally:
+        sender.sock.close()
+        receiver.sock.close()
+    if received is None:
+        return None
+    msg_type, content = received
+    return msg_type, bytes(content)
+
+def forge_header(sender, msg_size):
+    """Zaszyfrowany nagłówek z dowolnym rozmiarem treści - HMAC nie ma znaczenia, bo odbiorca odrzuca wcześniej"""
+    keystream_header = sender.prng_enc.randbytes(MESSAGE_HEADER_SIZE)
+    return xor_bytes(struct.pack('!28sIQ', bytes(28), TYPE_ECHO_REQUEST, msg_size), keystream_header)
+
+class CompressionTest(unittest.TestCase):
+    def test_compressed_message_round_trip(self):
+        compressed_frames = proj_lib.COMPRESSED_FRAMES.value
+        message = b"a" * 4096
+        self.assertEqual(round_trip(CAP_COMPRESS_ZLIB, message), (TYPE_ECHO_REQUEST, message))
+        self.assertEqual(proj_lib.COMPRESSED_FRAMES.value, compressed_frames + 1)
+
+    def test_message_above_decompression_limit_is_delivered(self):
+        compressed_frames = proj_lib.COMPRESSED_FRAMES.value
+        message = b"a" * (MAX_DECOMPRESSED_SIZE + 1)
+        self.assertEqual(round_trip(CAP_COMPRESS_ZLIB, message), (TYPE_ECHO_REQUEST, message))
+        self.assertEqual(proj_lib.COMPRESSED_FRAMES.value, compressed_frames)
+
+class FrameWriteQueueTest(unittest.TestCase):
+    def test_queue_budget_counts_compressed_frames(self):
+        sender, receiver = open_session_pair(CAP_COMPRESS_ZLIB)
+        message = b"a" * 65536
+        # Bez opóźnionego wysłania ramki zostają w kolejce, a limit mieści kilka skompresowanych, nie jedną surową
+        queue = FrameWriteQueue(sender, flush_threshold=1 << 30, max_delay=60.0, max_queued_bytes=len(message) // 4,
+                                overflow_policy=OVERFLOW_DROP)
+        try:
+            self.assertTrue(queue.enqueue(TYPE_ECHO_REQUEST, message))
+            self.assertTrue(queue.enqueue(TYPE_ECHO_REQUEST, message))
+            self.assertEqual(queue.dropped_frames, 0)
+            self.assertEqual(queue.queued_bytes, sum(len(buffer) for buffer in queue.buffers))
+            self.assertLess(queue.queued_bytes, 2 * (MESSAGE_HEADER_SIZE + len(message)))
+            queue.close(1.0)
+            for _ in range(2):
+                msg_type, content = read_encrypted_message(receiver)
+                self.assertEqual((msg_type, bytes(content)), (TYPE_ECHO_REQUEST, message))
+        finally:
+            sender.sock.close()
+            receiver.sock.close()
+
+class FrameSizeTest(unittest.TestCase):
+    def test_oversized_frame_is_rejected_before_buffering(self):
+        sender, receiver = open_session_pair(0)
+        try:
+            sender.sock.sendall(forge_header(sender, MAX_MESSAGE_SIZE + 1))
+            self.assertIsNone(read_encrypted_message(receiver))
+            self.assertEqual(len(receiver.reader.buffer), FRAME_READER_INITIAL_SIZE)
+        finally:
+            sender.sock.close()
+            receiver.sock.close()
+
+    def test_oversized_frame_is_rejected_async(self):
+        sender, receiver = open_session_pair(0)
+        try:
+            async def receive():
+                reader = asyncio.StreamReader()
+                reader.feed_data(forge_header(sender, MAX_MESSAGE_SIZE + 1))
+                return await recive_encrypted_message_async(receiver, reader)
+
+            self.assertFalse(asyncio.run(receive()))
+        finally:
+            sender.sock.close()
+            receiver.sock.close()
+
+class ChunkedMessageTest(unittest.TestCase):
+    def transfer(self, content, tamper=None):
+        """Wysyła content strumieniem w kawałkach; zwraca (wynik read_chunked_body, typ wewnętrzny, odebrane bajty)"""
+        sender, receiver = open_session_pair(0)
+        relay_in, relay_out = socket.socketpair()
+        try:
+            # Strumień przechodzi przez drugą parę gniazd, żeby dało się go zmienić po drodze
+            receiver.reader = FrameReader(relay_out)
+            send_chunked_message(sender, TYPE_ECHO_REQUEST, io.BytesIO(content), chunk_size=1000)
+            sender.sock.shutdown(socket.SHUT_WR)
+            wire = bytearray()
+            while True:
+                data = receiver.sock.recv(65536)
+                if not data:
+                    break
+                wire += data
+            if tamper is not None:
+                wire[tamper] ^= 1
+            relay_in.sendall(wire)
+            relay_in.shutdown(socket.SHUT_WR)
+
+            msg_type, header = read_encrypted_message(receiver)
+            self.assertEqual(msg_type, TYPE_CHUNKED)
+            sink = io.BytesIO()
+            return read_chunked_body(receiver, sink), parse_chunked_header(receiver, header), sink.getvalue()
+        finally:
+            for sock in (sender.sock, receiver.sock, relay_in, relay_out):
+                sock.close()
+
+    def test_chunks_are_reassembled(self):
+        content = bytes(range(256)) * 40 + b"tail"
+        self.assertEqual(self.transfer(content), (True, TYPE_ECHO_REQUEST, content))
+
+    def test_empty_stream(self):
+        self.assertEqual(self.transfer(b""), (True, TYPE_ECHO_REQUEST, b""))
+
+    def test_tampered_chunk_fails_stream_hmac(self):
+        content = bytes(range(256)) * 40
+        # Bajt w środku drugiego kawałka: nagłówek ramki, typ, rekord 1 (długość + 1000 B), długość rekordu 2
+        offset = MESSAGE_HEADER_SIZE + 4 + (4 + 1000) + 4 + 500
+        verified, _, received = self.transfer(content, tamper=offset)
+        self.assertFalse(verified)
+        self.assertEqual(len(received), len(content))
+
+if __name__ == "__main__":
+    unittest.main()